@@ -1,7 +1,9 @@
 import hashlib
 import time
 
+from Encoding import Encoding
 from MerkleTree import MerkleTree
+from Transaction import Transaction
 
 
 class Block:
@@ -13,7 +15,9 @@ class Block:
             i (int): Index of the block in the chain.
             transactions (list): List of Transaction objects.
             previous_hash (str): Hash of the previous block in the chain.
-            **options (dict): Optional parameters for the block.
+            **options (dict): Optional parameters for the block, including the merkle_root advertised by the sender of
+                a received block. The Merkle tree is only built when it is needed, so the header and the proof of work
+                of a received block can be checked first with the advertised root, see `verify_merkle_root`.
         """
         self.index = i
         self.h = options.get("hash", None)  # optional hash parameter, defaults to None
@@ -21,13 +25,15 @@ class Block:
         self.timestamp = options.get("timestamp",
                                      time.time_ns())  # optional timestamp parameter, defaults to current time
         self.nonce = options.get("nonce", 0)  # optional nonce parameter, defaults to 0
-        self.merkle_tree = MerkleTree(transactions)
+        self._transactions = list(transactions)  # None once the block is pruned
+        self._merkle_tree = None  # Built on demand
+        self._merkle_root = options.get("merkle_root", None)  # Advertised root, or root of a pruned block
 
     def __str__(self):
         """
-        Returns a string representation of the block, used in hashing.
+        Returns a string representation of the block header, used in hashing.
         """
-        return str((self.index, self.previous_hash, self.merkle_tree.get_root().hash, self.nonce, self.timestamp))
+        return self.encode_header().decode()
 
     def __repr__(self):
         """
@@ -60,9 +66,41 @@ class Block:
         Returns:
             str: Computed hash.
         """
-        self.h = hashlib.sha256(str(self).encode()).hexdigest()
+        self.h = Block.header_hash(self.header())
         return self.h
 
+    @staticmethod
+    def header_hash(header):
+        """
+        Computes the hash of a block from its header alone, as light clients that only keep the headers do.
+
+        Parameters:
+            header (dict): Header of the block, see `header`.
+
+        Returns:
+            str: Hash of the block.
+        """
+        return hashlib.sha256(Encoding.encode(header)).hexdigest()
+
+    def header(self):
+        """
+        Returns the header of the block, the part of the block that is hashed.
+
+        Returns:
+            dict: Index, previous hash, Merkle root, nonce and timestamp of the block.
+        """
+        return {"index": self.index, "previous_hash": self.previous_hash, "merkle_root": self.merkle_root(),
+                "nonce": self.nonce, "timestamp": self.timestamp}
+
+    def encode_header(self):
+        """
+        Returns the canonical encoding of the header of the block.
+
+        Returns:
+            bytes: Encoded header.
+        """
+        return Encoding.encode(self.header())
+
     def as_dict(self):
         """
         Returns a dictionary representation of the block.
@@ -70,15 +108,80 @@ class Block:
         Returns:
             dict: Dictionary representation of the block.
         """
-        block_dict = self.__dict__.copy()
-        block_dict["merkle_tree"] = self.merkle_tree.as_dict()
-        return block_dict
+        return {"index": self.index, "h": self.h, "previous_hash": self.previous_hash, "timestamp": self.timestamp,
+                "nonce": self.nonce, "merkle_root": self.merkle_root(),
+                "merkle_tree": self.merkle_tree.as_dict() if not self.is_pruned() else None}
+
+    @property
+    def merkle_tree(self):
+        """
+        The Merkle tree of the block, built the first time it is needed. None if the block was pruned.
+        """
+        if self._merkle_tree is None and self._transactions is not None:
+            self._merkle_tree = MerkleTree(self._transactions)
+            self._transactions = self._merkle_tree.transactions
+        return self._merkle_tree
 
     def transactions(self):
         """
-        Returns the list of transactions in the block.
+        Returns the list of transactions in the block, without building the Merkle tree.
+
+        Returns:
+            list: List of transactions, None if the block was pruned.
+        """
+        if self._merkle_tree is not None:
+            return self._merkle_tree.transactions
+        if self._transactions is not None and not all(isinstance(tx, Transaction) for tx in self._transactions):
+            self._transactions = [tx if isinstance(tx, Transaction) else Transaction(tx) for tx in self._transactions]
+        return self._transactions
+
+    def merkle_root(self):
+        """
+        Returns the hash of the root of the Merkle tree of the block: the advertised root until the tree is built. The
+        root of a block without transactions is a hash of zeros, like the previous hash of the genesis block.
+
+        Returns:
+            str: Merkle root.
+        """
+        if self._merkle_tree is None and self._merkle_root is not None:
+            return self._merkle_root
+        return self._tree_root()
+
+    def _tree_root(self):
+        """
+        Builds the Merkle tree of the block if needed and returns the hash of its root.
+
+        Returns:
+            str: Hash of the root of the tree, a hash of zeros if the block has no transactions.
+        """
+        root = self.merkle_tree.get_root()
+        return root.hash if root is not None else "0" * 64
+
+    def verify_merkle_root(self):
+        """
+        Builds the Merkle tree of the block and checks that its root is the advertised one.
+
+        Returns:
+            bool: True if the root matches or if no root was advertised, False otherwise.
+        """
+        if self.is_pruned():
+            return True
+        return self._merkle_root is None or self._tree_root() == self._merkle_root
+
+    def prune(self):
+        """
+        Discards the transactions and the Merkle tree of the block, only the header is kept.
+        """
+        if not self.is_pruned():
+            self._merkle_root = self.merkle_root()
+            self._merkle_tree = None
+            self._transactions = None
+
+    def is_pruned(self):
+        """
+        Checks if the body of the block was discarded.
 
         Returns:
-            list: List of transactions.
+            bool: True if the block was pruned, False otherwise.
         """
-        return self.merkle_tree.transactions
+        return self._merkle_tree is None and self._transactions is None
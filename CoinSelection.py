@@ -0,0 +1,121 @@
+from Transaction import Transaction
+
+
+class CoinSelection:
+    """
+    The strategies used to choose the UTXOs spent by a payment. Every input costs a signature to its sender and a
+    verification to every miner, and every change output is a new UTXO to spend later, so the strategies try to spend
+    few UTXOs and to avoid change:
+
+    - "bnb": Branch and bound search of a set of UTXOs whose total is exactly the amount, or exceeds it by at most
+      `max_excess` which is then left to the miner instead of creating a change output. The sets with the fewest inputs
+      are preferred. Falls back to "largest_first" when there is no such set.
+    - "largest_first": Spends the largest UTXOs first, the fewest inputs a greedy selection can reach.
+    - "consolidate": Spends the smallest UTXOs first, and keeps adding them up to `max_inputs`, to merge many small
+      UTXOs into the change when the payment goes through anyway.
+    """
+    DEFAULT = "bnb"
+    STRATEGIES = ("bnb", "largest_first", "consolidate")
+    # Maximum number of branches explored by the branch and bound search
+    max_tries = 100000
+
+    @staticmethod
+    def select(utxos, amount, strategy=DEFAULT, max_excess=0, max_inputs=Transaction.max_inputs):
+        """
+        Chooses the UTXOs to spend to pay an amount.
+
+        :param utxos: dict: The available UTXOs, indexed by their id ("transaction_hash:output_index").
+        :param amount: int: The amount to pay.
+        :param strategy: str: The name of the strategy.
+        :param max_excess: int: The excess of an exact match left to the miner rather than given back as change.
+        :param max_inputs: int: The maximum number of UTXOs to spend.
+        :return: list: The ids of the UTXOs to spend, None if they can't cover the amount.
+        """
+        if strategy == "bnb":
+            selection = CoinSelection.branch_and_bound(utxos, amount, max_excess, max_inputs)
+            if selection is not None:
+                return selection
+            return CoinSelection.largest_first(utxos, amount, max_inputs)
+        if strategy == "largest_first":
+            return CoinSelection.largest_first(utxos, amount, max_inputs)
+        if strategy == "consolidate":
+            return CoinSelection.consolidate(utxos, amount, max_inputs)
+        raise ValueError(f"Unknown coin selection strategy {strategy}")
+
+    @staticmethod
+    def branch_and_bound(utxos, amount, max_excess=0, max_inputs=Transaction.max_inputs):
+        """
+        Searches the set with the fewest UTXOs whose total is between the amount and the amount plus `max_excess`. The
+        UTXOs are explored from the largest one, including then excluding each of them, and a branch is abandoned as
+        soon as it exceeds the target, can't reach it anymore or can't have fewer inputs than the best set found.
+
+        :return: list: The ids of the UTXOs to spend, None if no set was found within `max_tries` branches.
+        """
+        candidates = sorted(((utxo["amount"], utxo_id) for utxo_id, utxo in utxos.items() if utxo["amount"] > 0),
+                            reverse=True)
+        values = [value for value, _ in candidates]
+        # Total of the UTXOs from each position, to know if a branch can still reach the amount
+        remaining = [0] * (len(values) + 1)
+        for i in range(len(values) - 1, -1, -1):
+            remaining[i] = remaining[i + 1] + values[i]
+        if remaining[0] < amount:
+            return None
+
+        best = None
+        selected = []
+        tries = 0
+        # Each frame is the position of the next UTXO to decide and the total of the selected ones
+        stack = [(0, 0, False)]
+        while stack and tries < CoinSelection.max_tries:
+            tries += 1
+            position, total, backtrack = stack.pop()
+            if backtrack:
+                selected.pop()
+                continue
+            if total >= amount:
+                if total <= amount + max_excess and (best is None or len(selected) < len(best)):
+                    best = list(selected)
+                continue
+            if position == len(values) or total + remaining[position] < amount:
+                continue
+            if len(selected) + 1 > max_inputs or (best is not None and len(selected) + 1 >= len(best)):
+                continue
+            # Exclude the UTXO, explored after including it
+            stack.append((position + 1, total, False))
+            if total + values[position] <= amount + max_excess:
+                stack.append((None, None, True))
+                stack.append((position + 1, total + values[position], False))
+                selected.append(position)
+        if best is None:
+            return None
+        return [candidates[position][1] for position in best]
+
+    @staticmethod
+    def largest_first(utxos, amount, max_inputs=Transaction.max_inputs):
+        """
+        Spends the largest UTXOs until they cover the amount.
+
+        :return: list: The ids of the UTXOs to spend, None if they can't cover the amount.
+        """
+        selection = []
+        total = 0
+        for utxo_id, utxo in sorted(utxos.items(), key=lambda item: item[1]["amount"], reverse=True):
+            if total >= amount or len(selection) == max_inputs:
+                break
+            selection.append(utxo_id)
+            total += utxo["amount"]
+        return selection if total >= amount else None
+
+    @staticmethod
+    def consolidate(utxos, amount, max_inputs=Transaction.max_inputs):
+        """
+        Spends the smallest UTXOs, up to `max_inputs` of them even once they cover the amount. Falls back to
+        "largest_first" when the smallest ones can't cover the amount.
+
+        :return: list: The ids of the UTXOs to spend, None if they can't cover the amount.
+        """
+        selection = [utxo_id for utxo_id, _ in
+                     sorted(utxos.items(), key=lambda item: item[1]["amount"])[:max_inputs]]
+        if sum(utxos[utxo_id]["amount"] for utxo_id in selection) >= amount:
+            return selection
+        return CoinSelection.largest_first(utxos, amount, max_inputs)
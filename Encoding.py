@@ -0,0 +1,30 @@
+import json
+
+
+class Encoding:
+    """
+    The canonical byte encoding of the data that is hashed, stored or sent over the network: compact JSON with sorted
+    keys in UTF-8. The same value always gives the same bytes, whatever the order of the keys of its dictionaries or
+    the Python version, and decoding then re-encoding gives back the same bytes, so hashes survive the JSON round-trip
+    through the network.
+    """
+    @staticmethod
+    def encode(value):
+        """
+        Encodes a value made of dictionaries, lists, tuples, strings, numbers, booleans and None.
+
+        :param value: The value to encode.
+        :return: bytes: The canonical encoding.
+        """
+        return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+                          allow_nan=False).encode("utf-8")
+
+    @staticmethod
+    def decode(data):
+        """
+        Decodes bytes produced by `encode`. Tuples are decoded as lists.
+
+        :param data: bytes: The canonical encoding.
+        :return: The decoded value.
+        """
+        return json.loads(data.decode("utf-8"))
@@ -0,0 +1,114 @@
+import os
+import threading
+
+from Crypto.PublicKey import ECC, RSA
+
+from Signature import Signature
+from Workers import Workers
+
+
+class Keystore:
+    """
+    A store of private keys, so that nodes don't have to generate a new key pair every time they are created. The keys
+    are saved in PEM files named after the nodes in the directory of the store, so a node keeps its address across
+    restarts. New keys are drawn from a pool of precomputed keys when it isn't empty, which can be filled in advance
+    with `fill`, and generated on demand otherwise.
+    """
+    def __init__(self, path=None):
+        """
+        Initializes the keystore.
+
+        :param path: str: The directory where the keys are saved, the keys are only kept in memory if None.
+        """
+        self.path = path
+        # Precomputed private keys not yet given to a node, indexed by signature scheme
+        self.pool = {scheme: [] for scheme in Signature.SCHEMES}
+        self.lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def fill(self, count, scheme=Signature.DEFAULT, threshold=8):
+        """
+        Precomputes private keys and adds them to the pool. The keys are generated on the process pool when there are
+        at least `threshold` of them, RSA key generation being slow.
+
+        :param count: int: The number of keys to generate.
+        :param scheme: str: The signature scheme of the keys.
+        :param threshold: int: The minimum number of keys to generate to use the process pool.
+        :return: Keystore: The keystore.
+        """
+        keys = [Keystore.import_private_key(pem) for pem in
+                Workers.map(_generate_private_keys, [scheme] * count, threshold=threshold)]
+        with self.lock:
+            self.pool[scheme].extend(keys)
+        return self
+
+    def load(self, name, scheme=Signature.DEFAULT):
+        """
+        Returns the key pair saved under the given name. If there is none, a key is drawn from the pool, or generated
+        if the pool is empty, and saved under that name. A saved key keeps its own scheme.
+
+        :param name: str: The name of the key, usually the name of the node. The key isn't saved if None.
+        :param scheme: str: The signature scheme of a new key.
+        :return: tuple: The private key and the public key.
+        """
+        with self.lock:
+            file_path = self._file_path(name)
+            if file_path is not None and os.path.exists(file_path):
+                with open(file_path) as file:
+                    private_key = Keystore.import_private_key(file.read())
+            else:
+                private_key = self.pool[scheme].pop() if self.pool[scheme] else None
+                if private_key is None:
+                    private_key = Signature.generate_key_pair(scheme)[0]
+                if file_path is not None:
+                    # The private key is only readable by its owner
+                    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                    with os.fdopen(fd, "w") as file:
+                        file.write(Keystore.export_private_key(private_key))
+        return private_key, private_key.public_key()
+
+    def _file_path(self, name):
+        """
+        Returns the path of the file of a key, None if the keys are only kept in memory.
+
+        :param name: str: The name of the key.
+        :return: str: The path of the PEM file.
+        """
+        if self.path is None or name is None:
+            return None
+        file_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name))
+        return os.path.join(self.path, f"{file_name}.pem")
+
+    @staticmethod
+    def export_private_key(private_key):
+        """
+        Exports a private key of any scheme in PEM format.
+
+        :param private_key: RsaKey or EccKey: The private key.
+        :return: str: The PEM encoding of the private key.
+        """
+        pem = private_key.export_key(format="PEM")
+        return pem.decode() if isinstance(pem, bytes) else pem
+
+    @staticmethod
+    def import_private_key(pem):
+        """
+        Imports a private key exported by `export_private_key`.
+
+        :param pem: str: The PEM encoding of the private key.
+        :return: RsaKey or EccKey: The private key.
+        """
+        if "RSA PRIVATE KEY" in pem:
+            return RSA.import_key(pem)
+        return ECC.import_key(pem)
+
+
+def _generate_private_keys(schemes):
+    """
+    Generates one private key per scheme, meant to run on the process pool.
+
+    :param schemes: list: The signature scheme of each key.
+    :return: list: The PEM encoding of each private key.
+    """
+    return [Keystore.export_private_key(Signature.generate_key_pair(scheme)[0]) for scheme in schemes]
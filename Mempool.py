@@ -0,0 +1,338 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from Transaction import Transaction
+
+
+class Mempool:
+    """
+    A pool of pending transactions indexed by transaction hash. The insertion order is preserved, so the pool can be
+    iterated like the list it replaces, while membership tests and removals cost O(1) per transaction. The pool also
+    indexes the outputs spent by its transactions ("transaction_hash:output_index"), so that two transactions of the
+    pool never spend the same output.
+    The size of the pool is bounded in number of transactions and in bytes: when it is full, the transactions with the
+    lowest fee rate are evicted first. Transactions that stay in the pool for too long expire.
+    """
+    def __init__(self, transactions=None, **options):
+        """
+        Initializes the pool with the given transactions.
+
+        :param transactions: list: Transactions or transaction dictionaries to add to the pool.
+        :param options: dict: include max_count, max_bytes and expiry (in seconds).
+        """
+        self.max_count = options.get("max_count", 50000)
+        self.max_bytes = options.get("max_bytes", 100 * 1024 ** 2)
+        self.expiry = options.get("expiry", 24 * 60 * 60)
+        self.stats = {"evicted": 0, "expired": 0, "rejected": 0}
+        self._transactions = OrderedDict()
+        self._spenders = {}
+        # (fee rate, size, time of arrival) of each transaction
+        self._entries = {}
+        self._bytes = 0
+        # Heap of (fee rate, -sequence, hash), the lowest fee rate and then the most recent transaction is evicted first
+        self._eviction_heap = []
+        self._sequence = itertools.count()
+        self.lock = threading.RLock()
+        for tx in transactions or []:
+            self.add(tx)
+
+    @staticmethod
+    def _key(tx):
+        """
+        Returns the hash used to index a transaction.
+
+        :param tx: Transaction, dict or str: A transaction, a transaction dictionary or a transaction hash.
+        :return: str: The hash of the transaction.
+        """
+        if isinstance(tx, str):
+            return tx
+        if not isinstance(tx, Transaction):
+            tx = Transaction(tx)
+        return tx.hash()
+
+    def add(self, tx, fee=0, cost=0):
+        """
+        Adds a transaction at the end of the pool, unless it spends an output already spent by another transaction of
+        the pool or spends the same output twice. If the pool is full, the transaction must pay a higher fee rate than
+        the transactions it evicts.
+        The fee rate is the fee divided by the size of the transaction in bytes, or by its execution cost when the
+        cost is higher, so that transactions that are expensive to check must pay for it.
+
+        :param tx: Transaction or dict: The transaction to add.
+        :param fee: int: The fee paid by the transaction, the sum of its inputs minus the sum of its outputs.
+        :param cost: int: The execution cost of the transaction, see Transaction.cost.
+        :return: bool: True if the transaction was added, False if it was already in the pool, conflicts with it or
+        doesn't pay enough to enter the full pool.
+        """
+        if not isinstance(tx, Transaction):
+            tx = Transaction(tx)
+        outpoints = Mempool.outpoints(tx)
+        with self.lock:
+            if tx.hash() in self._transactions or len(set(outpoints)) != len(outpoints):
+                return False
+            if any(outpoint in self._spenders for outpoint in outpoints):
+                return False
+            self.expire()
+            size = len(tx.encode())
+            fee_rate = fee / max(size, cost)
+            if self._is_full(1, size):
+                lowest_fee_rate = self._lowest_fee_rate()
+                if lowest_fee_rate is None or fee_rate <= lowest_fee_rate:
+                    self.stats["rejected"] += 1
+                    return False
+            self._transactions[tx.hash()] = tx
+            for outpoint in outpoints:
+                self._spenders[outpoint] = tx.hash()
+            self._entries[tx.hash()] = (fee_rate, size, time.time())
+            self._bytes += size
+            heapq.heappush(self._eviction_heap, (fee_rate, -next(self._sequence), tx.hash()))
+            self._evict()
+            # Drop the entries of the transactions removed from the pool since the heap was last rebuilt
+            if len(self._eviction_heap) > 2 * len(self._transactions) + 64:
+                self._eviction_heap = [entry for entry in self._eviction_heap if entry[2] in self._transactions]
+                heapq.heapify(self._eviction_heap)
+            return tx.hash() in self._transactions
+
+    def expire(self, now=None):
+        """
+        Removes the transactions that entered the pool more than `expiry` seconds ago, along with their descendants.
+
+        :param now: float: The current time in seconds since the Epoch, defaults to time.time().
+        :return: list: The removed transactions.
+        """
+        now = time.time() if now is None else now
+        removed = []
+        with self.lock:
+            # The transactions are kept in order of arrival, so the expired ones are at the front
+            while self._transactions:
+                tx_hash = next(iter(self._transactions))
+                if self._entries[tx_hash][2] > now - self.expiry:
+                    break
+                removed.extend(self._pop_with_descendants(tx_hash))
+            self.stats["expired"] += len(removed)
+        return removed
+
+    def fee_rate(self, tx):
+        """
+        Returns the fee rate of a transaction of the pool, in fee per byte of its encoding (or per unit of execution
+        cost when it is higher).
+
+        :param tx: Transaction, dict or str: A transaction, a transaction dictionary or a transaction hash.
+        :return: float: The fee rate, None if the transaction isn't in the pool.
+        """
+        entry = self._entries.get(self._key(tx))
+        return entry[0] if entry is not None else None
+
+    def size_in_bytes(self):
+        """
+        Returns the total size of the encodings of the transactions of the pool.
+
+        :return: int: The size in bytes.
+        """
+        return self._bytes
+
+    def _is_full(self, extra_count=0, extra_bytes=0):
+        """
+        Checks if the pool would exceed its limits with additional transactions.
+
+        :return: bool: True if the limits would be exceeded.
+        """
+        return len(self._transactions) + extra_count > self.max_count or self._bytes + extra_bytes > self.max_bytes
+
+    def _lowest_fee_rate(self):
+        """
+        Returns the lowest fee rate of the pool, dropping the stale entries of the eviction heap on the way.
+
+        :return: float: The lowest fee rate, None if the pool is empty.
+        """
+        while self._eviction_heap and self._eviction_heap[0][2] not in self._transactions:
+            heapq.heappop(self._eviction_heap)
+        return self._eviction_heap[0][0] if self._eviction_heap else None
+
+    def _evict(self):
+        """
+        Evicts the transactions with the lowest fee rate, and their descendants, until the pool is within its limits.
+        """
+        while self._is_full() and self._eviction_heap:
+            tx_hash = heapq.heappop(self._eviction_heap)[2]
+            if tx_hash in self._transactions:
+                self.stats["evicted"] += len(self._pop_with_descendants(tx_hash))
+
+    @staticmethod
+    def outpoints(tx):
+        """
+        Returns the outputs spent by a transaction.
+
+        :param tx: Transaction: The transaction.
+        :return: list: The spent outputs, as "transaction_hash:output_index" strings.
+        """
+        return [f"{tx_input['transaction_hash']}:{tx_input['output_index']}" for tx_input in tx.inputs]
+
+    def spender(self, outpoint):
+        """
+        Returns the hash of the transaction of the pool that spends an output.
+
+        :param outpoint: str: The output, as a "transaction_hash:output_index" string.
+        :return: str: The hash of the spending transaction, None if the output isn't spent in the pool.
+        """
+        return self._spenders.get(outpoint)
+
+    def get(self, tx):
+        """
+        Returns the transaction of the pool with the same hash, None if there is none.
+
+        :param tx: Transaction, dict or str: A transaction, a transaction dictionary or a transaction hash.
+        :return: Transaction: The transaction of the pool.
+        """
+        return self._transactions.get(self._key(tx))
+
+    def remove(self, tx):
+        """
+        Removes a transaction from the pool.
+
+        :param tx: Transaction, dict or str: A transaction, a transaction dictionary or a transaction hash.
+        :return: Transaction: The removed transaction, None if it wasn't in the pool.
+        """
+        with self.lock:
+            return self._pop(self._key(tx))
+
+    def remove_many(self, txs):
+        """
+        Removes several transactions from the pool, such as the transactions of a mined block.
+
+        :param txs: list: Transactions, transaction dictionaries or transaction hashes.
+        :return: list: The removed transactions.
+        """
+        with self.lock:
+            removed = [self._pop(self._key(tx)) for tx in txs]
+        return [tx for tx in removed if tx is not None]
+
+    def remove_conflicts(self, txs):
+        """
+        Removes the transactions of the pool that spend the same outputs as the given transactions, such as the
+        transactions of a block received from another node, along with the transactions that spend their outputs.
+
+        :param txs: list: Transactions that were added to the blockchain.
+        :return: list: The removed transactions.
+        """
+        removed = []
+        with self.lock:
+            for tx in txs:
+                for outpoint in Mempool.outpoints(tx):
+                    tx_hash = self._spenders.get(outpoint)
+                    if tx_hash is not None and tx_hash != tx.hash():
+                        removed.extend(self._pop_with_descendants(tx_hash))
+        return removed
+
+    def _pop(self, tx_hash):
+        """
+        Removes a transaction from the pool and from the index of the spent outputs.
+
+        :param tx_hash: str: The hash of the transaction.
+        :return: Transaction: The removed transaction, None if it wasn't in the pool.
+        """
+        tx = self._transactions.pop(tx_hash, None)
+        if tx is not None:
+            for outpoint in Mempool.outpoints(tx):
+                if self._spenders.get(outpoint) == tx_hash:
+                    del self._spenders[outpoint]
+            self._bytes -= self._entries.pop(tx_hash)[1]
+        return tx
+
+    def _pop_with_descendants(self, tx_hash):
+        """
+        Removes a transaction from the pool along with the transactions of the pool that spend its outputs, which can't
+        be valid without it.
+
+        :param tx_hash: str: The hash of the transaction.
+        :return: list: The removed transactions.
+        """
+        removed = []
+        pending = [tx_hash]
+        while pending:
+            tx = self._pop(pending.pop())
+            if tx is None:
+                continue
+            removed.append(tx)
+            for i in range(len(tx.outputs)):
+                spender = self._spenders.get(f"{tx.hash()}:{i}")
+                if spender is not None:
+                    pending.append(spender)
+        return removed
+
+    def select(self, max_count=None, max_bytes=None):
+        """
+        Selects the transactions of a block template: the transactions with the highest fee rates, within the given
+        limits. A transaction is only selected if the transactions of the pool whose outputs it spends are selected too.
+
+        :param max_count: int: The maximum number of transactions, no limit if None.
+        :param max_bytes: int: The maximum total size of the transactions, no limit if None.
+        :return: list: The selected transactions, in order of arrival so that parents come before their children.
+        """
+        with self.lock:
+            order = {tx_hash: i for i, tx_hash in enumerate(self._transactions)}
+            candidates = sorted(self._transactions, key=lambda h: (-self._entries[h][0], order[h]))
+            selected = set()
+            # Transactions waiting for one of their parents to be selected, indexed by parent
+            waiting = {}
+            total_bytes = 0
+            for candidate in candidates:
+                pending = [candidate]
+                while pending:
+                    tx_hash = pending.pop()
+                    if tx_hash in selected or (max_count is not None and len(selected) >= max_count):
+                        continue
+                    size = self._entries[tx_hash][1]
+                    if max_bytes is not None and total_bytes + size > max_bytes:
+                        continue
+                    parents = {tx_input['transaction_hash'] for tx_input in self._transactions[tx_hash].inputs}
+                    missing = [parent for parent in parents if parent in self._transactions and parent not in selected]
+                    if missing:
+                        waiting.setdefault(missing[0], []).append(tx_hash)
+                        continue
+                    selected.add(tx_hash)
+                    total_bytes += size
+                    pending.extend(waiting.pop(tx_hash, []))
+            return [tx for tx_hash, tx in self._transactions.items() if tx_hash in selected]
+
+    def clear(self):
+        """
+        Removes all the transactions of the pool, the limits and the counters are kept.
+        """
+        with self.lock:
+            self._transactions.clear()
+            self._spenders.clear()
+            self._entries.clear()
+            self._eviction_heap.clear()
+            self._bytes = 0
+
+    def hashes(self):
+        """
+        Returns the hashes of the transactions of the pool, in insertion order.
+
+        :return: list: The hashes.
+        """
+        with self.lock:
+            return list(self._transactions.keys())
+
+    def __contains__(self, tx):
+        return self._key(tx) in self._transactions
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def __iter__(self):
+        # Iterate over a snapshot, the pool is updated by other threads
+        with self.lock:
+            return iter(list(self._transactions.values()))
+
+    def __eq__(self, other):
+        if isinstance(other, Mempool):
+            return self.hashes() == other.hashes()
+        return list(self) == other
+
+    def __repr__(self):
+        return repr(list(self))
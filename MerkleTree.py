@@ -1,23 +1,63 @@
 import hashlib
 from Transaction import Transaction
+from Workers import Workers
+
+# Size in bytes of the digests stored in the levels of the tree
+DIGEST_SIZE = 32
 
 
 class MerkleTreeNode:
-    def __init__(self, h, level, left=None, right=None, parent=None):
+    __slots__ = ("tree", "level", "position")
+
+    def __init__(self, tree, level, position):
         """
-        A class to represent a node in the Merkle tree.
+        A class to represent a node in the Merkle tree. The nodes are not stored, they are views over the levels of the
+        tree, created when they are needed.
 
-        :param h: str: The hash of the node.
-        :param level: int: The level of the node in the Merkle tree.
-        :param left: MerkleTreeNode: The left child of the node.
-        :param right: MerkleTreeNode: The right child of the node.
-        :param parent: MerkleTreeNode: The parent of the node.
+        :param tree: MerkleTree: The tree of the node.
+        :param level: int: The level of the node in the Merkle tree, 0 for the leaves.
+        :param position: int: The position of the node in its level.
         """
-        self.hash = h
+        # A lone node is carried to the next level as is, so the node it copies is used instead
+        while level > 0 and 2 * position + 1 >= tree.level_size(level - 1):
+            level, position = level - 1, 2 * position
+        self.tree = tree
         self.level = level
-        self.left = left
-        self.right = right
-        self.parent = parent
+        self.position = position
+
+    @property
+    def hash(self):
+        """
+        The hash of the node.
+        """
+        return self.tree.digest(self.level, self.position).hex()
+
+    @property
+    def left(self):
+        """
+        The left child of the node, None for a leaf.
+        """
+        return MerkleTreeNode(self.tree, self.level - 1, 2 * self.position) if self.level > 0 else None
+
+    @property
+    def right(self):
+        """
+        The right child of the node, None for a leaf.
+        """
+        return MerkleTreeNode(self.tree, self.level - 1, 2 * self.position + 1) if self.level > 0 else None
+
+    @property
+    def parent(self):
+        """
+        The parent of the node, None for the root.
+        """
+        level, position = self.level, self.position
+        # Skip the levels where the node is a lone node carried as is
+        while level < self.tree.height() and position ^ 1 >= self.tree.level_size(level):
+            level, position = level + 1, position // 2
+        if level == self.tree.height():
+            return None
+        return MerkleTreeNode(self.tree, level + 1, position // 2)
 
     def is_leaf(self):
         """
@@ -25,103 +65,190 @@ class MerkleTreeNode:
 
         :return: bool: True if the node is a leaf node, False otherwise.
         """
-        return self.left is None and self.right is None
+        return self.level == 0
 
     def as_dict(self):
         """
-        Convert the node to a dictionary representation.
+        Convert the node to a dictionary representation. The children are not included, they can be rebuilt from the
+        transactions.
 
         :return: dict: A dictionary representation of the node.
         """
-        node_dict = self.__dict__.copy()
-        del node_dict['parent']
-        node_dict['left'] = node_dict['left'].as_dict() if node_dict['left'] else None
-        node_dict['right'] = node_dict['right'].as_dict() if node_dict['right'] else None
+        return {'hash': self.hash, 'level': self.level}
 
 
 class MerkleTree:
-    def __init__(self, transactions=None):
+    # Hashing of two nodes used by default, see _hash_functions
+    default_hashing = "sorted"
+    # Minimum number of leaves to compute the lower levels of the tree on the process pool
+    parallel_threshold = 1 << 16
+
+    def __init__(self, transactions=None, hashing=None):
         """
-        A class to represent a Merkle tree.
+        A class to represent a Merkle tree. Each level of the tree is stored as a flat array of 32 bytes digests, the
+        leaves being the hashes of the transactions. The children of the node at position i are at positions 2i and
+        2i + 1 of the level below, and a lone node at the end of a level is carried to the next level as is.
+        Two nodes are hashed together with one of the `_hash_functions`: "sorted" (the default) hashes the
+        concatenation of the two digests in ascending order, "commutative" is the original hashing of the sum of the
+        two hashes as integers. Both don't depend on the order of the nodes, so the proofs are plain lists of hashes.
 
         :param transactions: list: A list of transactions to include in the Merkle tree.
+        :param hashing: str: "sorted" or "commutative", defaults to MerkleTree.default_hashing.
         """
-        self.transactions = list(map(lambda x: Transaction(x), transactions)) if transactions else []
-        self.tree_root = None
+        self.hashing = hashing or MerkleTree.default_hashing
+        self._hash_digests = _hash_functions[self.hashing]
+        self.transactions = list(map(MerkleTree._as_transaction, transactions)) if transactions else []
+        self.levels = []
+        # Position of the first leaf of each transaction hash
+        self.leaf_positions = {}
         self.build_tree()
 
     def as_dict(self):
         """
         Convert the Merkle tree to a dictionary representation.
 
-        :return: dict: A dictionary representation of the Merkle tree.
+        :return: dict: A dictionary representation of the Merkle tree, whose tree is None if it has no transactions.
         """
+        root = self.get_root()
         return {
             'transactions': list(map(lambda x: x.as_dict(), self.transactions.copy())),
-            'tree': self.tree_root.as_dict()
+            'tree': root.as_dict() if root is not None else None
         }
 
     def build_tree(self):
         """
         Build the Merkle tree.
         """
-        level = 0
-        tree_leaves = [MerkleTreeNode(tx.hash(), level, None, None) for tx in self.transactions]
+        nodes = [bytes.fromhex(tx.hash()) for tx in self.transactions]
+        self.levels = [bytearray(b"".join(nodes))]
+        self.leaf_positions = {}
+        for position, tx in enumerate(self.transactions):
+            self.leaf_positions.setdefault(tx.hash(), position)
+
+        if len(nodes) >= MerkleTree.parallel_threshold and Workers.count() > 1:
+            # Subtrees of 2 ** depth leaves, a few per worker
+            depth = min(max(10, (len(nodes) // (4 * Workers.count())).bit_length()), (len(nodes) - 1).bit_length() - 1)
+            self.levels.extend(self._build_levels_in_chunks(depth))
+        self.levels.extend(_build_levels([self.levels[-1]], self.hashing)[0])
+
+    def _build_levels_in_chunks(self, depth):
+        """
+        Computes the levels above the leaves up to the given depth on the process pool. The leaves are split in
+        subtrees of 2 ** depth leaves, whose levels are the slices of the levels of the whole tree, since only the last
+        subtree can have a lone node at each level.
 
-        # Build the tree by either creating a new node to hold two sub-nodes or using the lone node as is
-        while len(tree_leaves) > 1:
-            level += 1
-            new_tree_leaves = []
-            for i in range(0, len(tree_leaves), 2):
-                if i < len(tree_leaves) - 1:
-                    # Two sub-nodes
-                    h = self._hash_nodes(tree_leaves[i].hash, tree_leaves[i + 1].hash)
-                    new_tree_leaves.append(MerkleTreeNode(h, level, tree_leaves[i], tree_leaves[i + 1]))
-                else:
-                    # Lone node
-                    new_tree_leaves.append(tree_leaves[i])
-            tree_leaves = new_tree_leaves
+        :param depth: int: The number of levels to compute.
+        :return: list: The computed levels.
+        """
+        chunk_size = DIGEST_SIZE << depth
+        leaves = self.levels[0]
+        chunks = [bytes(leaves[i:i + chunk_size]) for i in range(0, len(leaves), chunk_size)]
+        chunk_levels = Workers.map(_build_levels, chunks, self.hashing, depth, threshold=2)
+        return [bytearray(b"".join(levels[i] for levels in chunk_levels)) for i in range(depth)]
 
-        # The root node gives access to the whole tree
-        self.tree_root = tree_leaves[0]
+    def height(self):
+        """
+        Returns the level of the root of the tree.
 
-        # Walk the tree to set the parents
-        self._set_parent(self.tree_root)
+        :return: int: The number of levels above the leaves.
+        """
+        return len(self.levels) - 1
 
-    def _set_parent(self, node):
+    def level_size(self, level):
         """
-        Set the parent of the node and all its children.
+        Returns the number of nodes of a level.
 
-        :param node: The node to start from.
+        :param level: int: The level, 0 for the leaves.
+        :return: int: The number of nodes.
         """
-        if node.left is not None:
-            node.left.parent = node
-            self._set_parent(node.left)
-        if node.right is not None:
-            node.right.parent = node
-            self._set_parent(node.right)
+        return len(self.levels[level]) // DIGEST_SIZE
+
+    def digest(self, level, position):
+        """
+        Returns the digest of a node.
+
+        :param level: int: The level of the node, 0 for the leaves.
+        :param position: int: The position of the node in its level.
+        :return: bytes: The 32 bytes digest.
+        """
+        return bytes(self.levels[level][position * DIGEST_SIZE:(position + 1) * DIGEST_SIZE])
 
     def get_root(self):
         """
         Returns the Merkle Tree root node.
 
-        :return: MerkleTreeNode: The root node.
+        :return: MerkleTreeNode: The root node, None if the tree is empty.
         """
-        return self.tree_root
+        if self.level_size(0) == 0:
+            return None
+        return MerkleTreeNode(self, self.height(), 0)
 
     def update_tree(self, new_transactions):
         """
-        Updates the Merkle Tree by adding new transactions.
+        Updates the Merkle Tree by adding new transactions, see `append`.
 
         Args:
             new_transactions: A list of new transactions to be added to the Merkle Tree.
         """
-        self.transactions.extend(list(map(lambda x: Transaction(x), new_transactions)) if new_transactions else [])
-        self.tree_root = None
-        self.build_tree()
+        for tx in new_transactions or []:
+            self.append(tx)
 
-    @staticmethod
-    def _hash_nodes(left, right):
+    def append(self, tx):
+        """
+        Adds a transaction at the end of the tree. Only the nodes on the path from the new leaf to the root are
+        computed, in O(log n).
+
+        :param tx: Transaction or dict: The transaction to add.
+        """
+        tx = MerkleTree._as_transaction(tx)
+        self.transactions.append(tx)
+        self.leaf_positions.setdefault(tx.hash(), len(self.transactions) - 1)
+        self._update_path(len(self.transactions) - 1)
+
+    def replace_leaf(self, position, tx):
+        """
+        Replaces the transaction of a leaf, such as the coinbase transaction of a block template, in O(log n).
+
+        :param position: int: The position of the leaf.
+        :param tx: Transaction or dict: The new transaction.
+        """
+        tx = MerkleTree._as_transaction(tx)
+        old_hash = self.transactions[position].hash()
+        if self.leaf_positions.get(old_hash) == position:
+            del self.leaf_positions[old_hash]
+        self.transactions[position] = tx
+        self.leaf_positions.setdefault(tx.hash(), position)
+        self._update_path(position)
+
+    def _update_path(self, position):
+        """
+        Sets the digest of a leaf from its transaction, then recomputes the nodes on the path from the leaf to the
+        root. The leaf may be a new leaf at the end of the tree.
+
+        :param position: int: The position of the leaf.
+        """
+        digest = bytes.fromhex(self.transactions[position].hash())
+        level = 0
+        while True:
+            self.levels[level][position * DIGEST_SIZE:(position + 1) * DIGEST_SIZE] = digest
+            size = self.level_size(level)
+            if size == 1:
+                # This node is the root
+                del self.levels[level + 1:]
+                return
+            if level + 1 == len(self.levels):
+                self.levels.append(bytearray())
+            sibling = position ^ 1
+            if sibling >= size:
+                # Lone node, carried to the next level as is
+                pass
+            elif sibling < position:
+                digest = self._hash_digests(self.digest(level, sibling), digest)
+            else:
+                digest = self._hash_digests(digest, self.digest(level, sibling))
+            level, position = level + 1, position // 2
+
+    def _hash_nodes(self, left, right):
         """
         Computes the hash of two Merkle Tree nodes.
 
@@ -132,11 +259,7 @@ class MerkleTree:
         Returns:
             The hash of the two nodes.
         """
-        # To make the operation commutative (left + right == right + left),
-        # we will convert both sides to integers
-        left = int(left, 16)
-        right = int(right, 16)
-        return hashlib.sha256(str(left + right).encode()).hexdigest()
+        return self._hash_digests(bytes.fromhex(left), bytes.fromhex(right)).hex()
 
     def get_proof(self, tx_hash):
         """
@@ -149,19 +272,127 @@ class MerkleTree:
             A list of hashes that make up the Merkle Proof for the given transaction.
             Returns None if the transaction is not found in the Merkle Tree.
         """
-        proof = []
-        node = self._find_node(self.tree_root, tx_hash)
-        if node is None:
+        position = self._find_leaf(tx_hash)
+        if position is None:
             return None
 
-        current = node
-        while current.level < self.tree_root.level:
-            sibling = self._get_sibling(current)
-            proof.append(sibling.hash)
-            current = current.parent
+        proof = []
+        for level in range(self.height()):
+            sibling = position ^ 1
+            # A lone node has no sibling, it is carried to the next level as is
+            if sibling < self.level_size(level):
+                proof.append(self.digest(level, sibling).hex())
+            position //= 2
 
         return proof
 
+    @staticmethod
+    def get_proof_root(tx_hash, proof, hashing=None):
+        """
+        Computes the root of the tree from a transaction and its Merkle Proof, so that the proof can be checked against
+        a Merkle root without the tree, such as the root of a block header.
+
+        :param tx_hash: str: The hash of the transaction.
+        :param proof: list: The Merkle Proof of the transaction, as returned by `get_proof`.
+        :param hashing: str: The hashing of the tree, defaults to MerkleTree.default_hashing.
+        :return: str: The hash of the root, None if the proof or the hashing is malformed, or if one of its hashes is
+        not a SHA256 digest.
+        """
+        hash_digests = _hash_functions.get(hashing or MerkleTree.default_hashing)
+        if hash_digests is None:
+            return None
+        try:
+            digest = _digest(tx_hash)
+            for next_hash in proof:
+                digest = hash_digests(digest, _digest(next_hash))
+        except (TypeError, ValueError):
+            return None
+        return digest.hex()
+
+    def get_multiproof(self, tx_hashes):
+        """
+        Returns a single Merkle Proof for several transactions of the tree. The hashes shared by the paths of the
+        transactions, and the nodes that can be computed from the transactions themselves, are only included once.
+
+        :param tx_hashes: list: The hashes of the transactions to get the proof for.
+        :return: dict: The number of leaves of the tree, the positions of the leaves of the transactions and the hashes
+        of the proof, level by level. None if one of the transactions is not found in the Merkle Tree.
+        """
+        positions = [self._find_leaf(tx_hash) for tx_hash in tx_hashes]
+        if any(position is None for position in positions):
+            return None
+
+        hashes = []
+        known = set(positions)
+        for level in range(self.height()):
+            size = self.level_size(level)
+            for position in sorted(known):
+                sibling = position ^ 1
+                if sibling < size and sibling not in known:
+                    hashes.append(self.digest(level, sibling).hex())
+            known = {position // 2 for position in known}
+
+        return {'leaf_count': self.level_size(0), 'positions': positions, 'hashes': hashes}
+
+    def verify_multiproof(self, tx_hashes, multiproof):
+        """
+        Verifies a Merkle Proof of several transactions produced by `get_multiproof`, in one pass over the levels.
+
+        :param tx_hashes: list: The hashes of the transactions, in the order of the positions of the proof.
+        :param multiproof: dict: The Merkle Proof of the transactions.
+        :return: bool: True if the Merkle Proof is valid, False otherwise.
+        """
+        return (self.get_root() is not None
+                and self.get_multiproof_root(tx_hashes, multiproof, self.hashing) == self.get_root().hash)
+
+    @staticmethod
+    def get_multiproof_root(tx_hashes, multiproof, hashing=None):
+        """
+        Computes the root of the tree from the transactions of a Merkle Proof produced by `get_multiproof`.
+
+        :param tx_hashes: list: The hashes of the transactions, in the order of the positions of the proof.
+        :param multiproof: dict: The Merkle Proof of the transactions.
+        :param hashing: str: The hashing of the tree, defaults to MerkleTree.default_hashing.
+        :return: str: The hash of the root, None if the proof or the hashing is malformed.
+        """
+        hash_digests = _hash_functions.get(hashing or MerkleTree.default_hashing)
+        if hash_digests is None:
+            return None
+        try:
+            size = multiproof['leaf_count']
+            positions = multiproof['positions']
+            hashes = iter(_digest(h) for h in multiproof['hashes'])
+            if len(positions) != len(tx_hashes) or not tx_hashes or not all(0 <= p < size for p in positions):
+                return None
+            nodes = {}
+            for position, tx_hash in zip(positions, tx_hashes):
+                digest = _digest(tx_hash)
+                if nodes.setdefault(position, digest) != digest:
+                    return None
+            while size > 1:
+                parents = {}
+                for position in sorted(nodes):
+                    if position // 2 in parents:
+                        continue
+                    sibling = position ^ 1
+                    if sibling >= size:
+                        # Lone node, carried to the next level as is
+                        parents[position // 2] = nodes[position]
+                        continue
+                    sibling_digest = nodes[sibling] if sibling in nodes else next(hashes)
+                    if sibling < position:
+                        parents[position // 2] = hash_digests(sibling_digest, nodes[position])
+                    else:
+                        parents[position // 2] = hash_digests(nodes[position], sibling_digest)
+                nodes = parents
+                size = (size + 1) // 2
+            # All the hashes of the proof must be used
+            if next(hashes, None) is not None:
+                return None
+            return nodes[0].hex()
+        except (KeyError, TypeError, ValueError, StopIteration):
+            return None
+
     def verify_proof(self, tx_hash, proof):
         """
         Verifies the Merkle Proof of a transaction.
@@ -176,35 +407,88 @@ class MerkleTree:
         current_hash = tx_hash
         for next_hash in proof:
             current_hash = self._hash_nodes(current_hash, next_hash)
-        return current_hash == self.tree_root.hash
+        return current_hash == self.get_root().hash
 
-    def _find_node(self, node, tx_hash):
+    @staticmethod
+    def _as_transaction(tx):
         """
-        Recursively searches the Merkle Tree for a node with the given transaction hash.
-
-        :param node: MerkleTreeNode: The node to start the search from.
-        :param tx_hash: str: The transaction hash to look for.
-        :return: MerkleTreeNode: The node with the given transaction hash if found, None otherwise.
+        Returns the transaction as a Transaction instance, without copying it if it already is one.
         """
-        if node is None:
-            return None
-        if node.is_leaf() and node.hash == tx_hash:
-            return node
-
-        left_result = self._find_node(node.left, tx_hash)
-        right_result = self._find_node(node.right, tx_hash)
+        return tx if isinstance(tx, Transaction) else Transaction(tx)
 
-        return left_result if left_result else right_result
-
-    @staticmethod
-    def _get_sibling(node):
+    def _find_leaf(self, tx_hash):
         """
-        Returns the sibling of the node in the Merkle Tree.
+        Finds the leaf of the given transaction hash in the index of the leaves.
 
-        :param node: MerkleTreeNode: The node whose sibling to get.
-        :return: MerkleTreeNode: The sibling of the node.
+        :param tx_hash: str: The transaction hash to look for.
+        :return: int: The position of the first leaf with the given transaction hash if found, None otherwise.
         """
-        parent = node.parent
-        if parent is None:
-            return None
-        return parent.left if parent.right == node else parent.right
\ No newline at end of file
+        return self.leaf_positions.get(tx_hash)
+
+
+def _digest(node_hash):
+    """
+    Decodes the hash of a Merkle Tree node received in a proof. Any other length than a SHA256 digest is rejected, a
+    longer value could stand for the concatenation of two nodes, or for a chosen sum with the "commutative" hashing.
+
+    :param node_hash: str: The hexadecimal hash of the node.
+    :return: bytes: The digest of the node.
+    :raises ValueError: if the hash is not the hexadecimal encoding of a SHA256 digest.
+    """
+    digest = bytes.fromhex(node_hash)
+    if len(digest) != hashlib.sha256().digest_size:
+        raise ValueError(f"Invalid Merkle Tree node hash {node_hash}")
+    return digest
+
+
+def _hash_sorted(left, right):
+    """
+    Computes the digest of two Merkle Tree nodes from their digests, by hashing them in ascending order so that the
+    operation is commutative, without leaving bytes.
+
+    :param left: bytes: The digest of the left node.
+    :param right: bytes: The digest of the right node.
+    :return: bytes: The digest of the two nodes.
+    """
+    return hashlib.sha256(left + right if left <= right else right + left).digest()
+
+
+def _hash_commutative(left, right):
+    """
+    Computes the digest of two Merkle Tree nodes from their digests like the original implementation.
+
+    :param left: bytes: The digest of the left node.
+    :param right: bytes: The digest of the right node.
+    :return: bytes: The digest of the two nodes.
+    """
+    # To make the operation commutative (left + right == right + left),
+    # we will convert both sides to integers
+    left = int.from_bytes(left, "big")
+    right = int.from_bytes(right, "big")
+    return hashlib.sha256(str(left + right).encode()).digest()
+
+
+_hash_functions = {"sorted": _hash_sorted, "commutative": _hash_commutative}
+
+
+def _build_levels(levels, hashing, depth=None):
+    """
+    Builds the levels above each of the given levels, meant to run on the process pool for the subtrees of large trees.
+
+    :param levels: list: The levels to start from, as flat arrays of digests.
+    :param hashing: str: The name of the hashing of the tree.
+    :param depth: int: The number of levels to build, until a single node is left if None.
+    :return: list: The built levels above each given level.
+    """
+    hash_digests = _hash_functions[hashing]
+    results = []
+    for level in levels:
+        nodes = [bytes(level[i:i + DIGEST_SIZE]) for i in range(0, len(level), DIGEST_SIZE)]
+        built = []
+        # Build the tree by either hashing two sub-nodes together or carrying the lone node as is
+        while (len(nodes) > 1) if depth is None else (len(built) < depth):
+            lone_node = [nodes[-1]] if len(nodes) % 2 else []
+            nodes = [hash_digests(left, right) for left, right in zip(nodes[::2], nodes[1::2])] + lone_node
+            built.append(bytearray(b"".join(nodes)))
+        results.append(built)
+    return results
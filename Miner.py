@@ -1,10 +1,14 @@
 import hashlib
 import threading
 import time
+from collections import OrderedDict
 
 from Node import Node
 from Block import Block
+from CoinSelection import CoinSelection
+from Mempool import Mempool
 from Transaction import Transaction
+from Validator import Validator
 import random
 
 
@@ -15,15 +19,52 @@ class Miner(Node):
 
         :param **options: optional parameters to configure the Miner object.
         """
-        super().__init__(**options)
+        # The node is started once the miner is fully initialized
+        super().__init__(**{**options, "autostart": False})
         self.difficulty = options.get("difficulty", 2)
         self.block_min_transactions = options.get("block_min_transactions", 2)
+        self.validator = Validator(self.difficulty, parallel_threshold=options.get("parallel_threshold", 64))
         self.stop_mining = False
-        self.transaction_pool = []
+        self.block_max_transactions = options.get("block_max_transactions", 1000)
+        # Maximum execution cost of a transaction relayed or mined by this miner, see Transaction.cost
+        self.max_transaction_cost = options.get("max_transaction_cost", Transaction.max_cost)
+        self.transaction_pool = Mempool(max_count=options.get("mempool_max_count", 50000),
+                                        max_bytes=options.get("mempool_max_bytes", 100 * 1024 ** 2),
+                                        expiry=options.get("mempool_expiry", 24 * 60 * 60))
         self.blockchain = []
         self.utxos = {}
-        # Add mining thread with a difficulty
-        threading.Thread(target=self._mine, args=(self.difficulty,), daemon=True).start()
+        # Number of recent blocks whose transactions are kept, older blocks are reduced to their header. The last block
+        # is always kept whole, it is broadcast and its transactions are removed from the pool once it is connected
+        self.prune_depth = options.get("prune_depth", None)
+        if self.prune_depth is not None and self.prune_depth < 1:
+            raise ValueError(f"Invalid prune depth {self.prune_depth}, at least the last block must be kept")
+        self.pruned_height = 0
+        # Blocks whose parent is still unknown, with their sender and the time until which they wait for the parent,
+        # indexed by their hash from the oldest to the most recent. Several blocks may claim the same parent
+        self.orphan_timeout = options.get("orphan_timeout", 5)
+        self.max_orphan_blocks = options.get("max_orphan_blocks", 64)
+        self.orphan_blocks = OrderedDict()
+        self.orphan_lock = threading.Lock()
+        # Nodes subscribed to the changes of the UTXOs of each address, and address of each subscribed locking script
+        self.subscriptions = {}
+        self.subscribed_scripts = {}
+        self.subscriptions_lock = threading.Lock()
+        self.mining_thread = None
+        if options.get("autostart", True):
+            self.start()
+
+    def start(self):
+        """
+        Starts the node and the mining thread. Does nothing if the miner is already started.
+
+        :return: Miner: the Miner object
+        """
+        super().start()
+        if self.mining_thread is None:
+            # Add mining thread with a difficulty
+            self.mining_thread = threading.Thread(target=self._mine, args=(self.difficulty,), daemon=True)
+            self.mining_thread.start()
+        return self
 
     def _mine(self, difficulty):
         """
@@ -32,15 +73,18 @@ class Miner(Node):
         :param difficulty: the difficulty level of the mining process.
         """
         while True:
+            self.transaction_pool.expire()
+            self._expire_orphan_blocks()
             if not self.stop_mining and len(self.transaction_pool) >= self.block_min_transactions:
 
                 previous_hash = self.blockchain[-1].hash() if len(self.blockchain) > 0 else "0" * 64
-                new_block = Block(len(self.blockchain), self.transaction_pool, previous_hash)
                 # Create a coinbase transaction for the mining reward
                 transaction_fee = 50
                 coinbase_transaction = self._create_reward_transaction(transaction_fee)
-                new_block.merkle_tree.transactions.insert(0, coinbase_transaction)
-                new_block.merkle_tree.build_tree()
+                # Only take the transactions with the highest fee rates, not the whole pool, the tree is built once
+                new_block = Block(len(self.blockchain),
+                                  [coinbase_transaction] + self.transaction_pool.select(self.block_max_transactions),
+                                  previous_hash)
                 # New idea : use current timestamp instead of random and sequential numbers,
                 # This way, we can see the exact time the block was mined, so we can order them correctly later on
                 new_block.nonce = time.time_ns()
@@ -53,12 +97,16 @@ class Miner(Node):
                         break
                     new_block.nonce = time.time_ns()
 
-                if new_block.hash().startswith("0" * difficulty):
+                # Another block may have been connected while mining, this one would then be stale
+                if new_block.hash().startswith("0" * difficulty) and len(self.blockchain) == new_block.index and \
+                        previous_hash == (self.blockchain[-1].hash() if len(self.blockchain) > 0 else "0" * 64):
                     # Add the mined block to the blockchain and broadcast it
                     self.blockchain.append(new_block)
-                    self._update_utxos_from_blockchain()
-                    self.transaction_pool = [tx for tx in self.transaction_pool if
-                                             tx not in new_block.merkle_tree.transactions[1:]]
+                    self._update_utxos_from_block(new_block)
+                    self._prune_blockchain()
+                    self.transaction_pool.remove_many(new_block.merkle_tree.transactions[1:])
+                    self.transaction_pool.remove_conflicts(new_block.merkle_tree.transactions[1:])
+                    self._connect_orphan_blocks()
                     mining_duration = (new_block.nonce - new_block.timestamp) / 1e9
                     if mining_duration < 60:
                         mining_duration_str = f"{mining_duration:.2f}s"
@@ -112,9 +160,125 @@ class Miner(Node):
         :param addr: the address of the sender node.
         """
         data = payload.get("data")
-        transaction = Transaction(data)
-        if transaction.execute():
-            self.transaction_pool.append(transaction)
+        self._add_transactions(self._parse_transactions([data]))
+
+    def _handle_incoming_transactions(self, payload, addr):
+        """
+        An override of the `_handle_incoming_transactions` method of the Node class.
+        Handles incoming batches of transactions from other nodes.
+
+        :param payload: the payload received from other nodes, containing a list of transactions.
+        :param addr: the address of the sender node.
+        """
+        data = payload.get("data")
+        self._add_transactions(self._parse_transactions(data))
+
+    def _parse_transactions(self, data):
+        """
+        Builds the transactions received from another node. The malformed entries are skipped one by one, so that they
+        don't drop the valid transactions sent along with them.
+
+        :param data: list: the serialized transactions.
+        :return: list: the transactions that could be built.
+        """
+        transactions = []
+        for tx in data if isinstance(data, list) else []:
+            try:
+                transactions.append(Transaction(tx))
+            except Exception:
+                if self.logging_level >= 1:
+                    Node.print(f"Node {self.node_name} skipped a malformed transaction.")
+        return transactions
+
+    def _add_transactions(self, transactions):
+        """
+        Adds the valid transactions of a batch to the transaction pool, in order. The signatures of the whole batch are
+        checked at once, and a transaction may spend the outputs of a previous transaction of the batch.
+
+        :param transactions: the transactions to add.
+        """
+        batch = {}
+        for tx in transactions:
+            if tx in self.transaction_pool or tx.hash() in batch:
+                continue
+            # Cheap checks first, the signatures are the expensive part
+            if not tx.is_well_formed() or not self._spends_unspent_outputs(tx, batch) or \
+                    self._transaction_fee(tx, batch) < 0 or not tx.execute(max_cost=self.max_transaction_cost):
+                continue
+            batch[tx.hash()] = tx
+        candidates = list(batch.values())
+        for tx, valid in zip(candidates, self._verify_transactions_inputs(candidates, batch)):
+            if valid and self._spends_unspent_outputs(tx):
+                self.transaction_pool.add(tx, self._transaction_fee(tx), tx.cost())
+
+    def _transaction_fee(self, transaction, batch=None):
+        """
+        Computes the fee paid by a transaction whose inputs spend known outputs: the sum of the amounts of the spent
+        outputs minus the sum of the amounts of its outputs. A negative fee means that the transaction creates coins.
+
+        :param transaction: the transaction.
+        :param batch: dict: transactions being added along with this one, indexed by hash, whose outputs can be spent.
+        :return: the fee.
+        """
+        total_input_value = sum(self._find_output(tx_input['transaction_hash'], tx_input['output_index'],
+                                                  batch)['amount'] for tx_input in transaction.inputs)
+        return total_input_value - sum(tx_output['amount'] for tx_output in transaction.outputs)
+
+    def _spends_unspent_outputs(self, transaction, batch=None):
+        """
+        Checks in O(inputs) that a transaction only spends outputs that are unspent, in the UTXOs or in the transaction
+        pool, and that no other transaction of the pool spends.
+
+        :param transaction: the transaction to check.
+        :param batch: dict: transactions being added along with this one, indexed by hash, whose outputs can be spent.
+        :return: bool: whether the transaction can enter the pool.
+        """
+        outpoints = Mempool.outpoints(transaction)
+        if len(set(outpoints)) != len(outpoints):
+            return False
+        for outpoint, tx_input in zip(outpoints, transaction.inputs):
+            if self.transaction_pool.spender(outpoint) is not None:
+                return False
+            if self._find_output(tx_input['transaction_hash'], tx_input['output_index'], batch) is None:
+                return False
+        return True
+
+    def _verify_transactions_inputs(self, transactions, batch=None):
+        """
+        Checks the unlocking scripts of the inputs of a batch of transactions in one go, so that the signatures can be
+        checked on the process pool. The outputs they spend are looked up in the UTXOs, in the transaction pool and in
+        the batch, an input whose spent output is unknown is invalid.
+
+        :param transactions: the transactions to check.
+        :param batch: dict: the transactions of the batch indexed by hash, whose outputs can be spent.
+        :return: list: whether the inputs of each transaction are valid.
+        """
+        scripts = []
+        for tx in transactions:
+            for tx_input in tx.inputs:
+                tx_output = self._find_output(tx_input['transaction_hash'], tx_input['output_index'], batch)
+                scripts.append((tx_input['unlocking_script'], tx_input['transaction_hash'], tx_input['output_index'],
+                                tx_output['locking_script'] if tx_output is not None else None))
+        results = iter(Transaction.verify_unlocking_scripts(scripts, self.validator.parallel_threshold))
+        return [all([next(results) for _ in tx.inputs]) for tx in transactions]
+
+    def _find_output(self, transaction_hash, output_index, batch=None):
+        """
+        Finds an unspent output in the UTXOs or among the outputs of the transactions of the pool.
+
+        :param transaction_hash: the hash of the transaction of the output.
+        :param output_index: the index of the output in the transaction.
+        :param batch: dict: other transactions indexed by hash whose outputs are also searched.
+        :return: dict: the output, None if it is unknown.
+        """
+        tx_output = self.utxos.get(f"{transaction_hash}:{output_index}")
+        if tx_output is None:
+            tx = self.transaction_pool.get(transaction_hash)
+            if tx is None and batch is not None:
+                tx = batch.get(transaction_hash)
+            if tx is not None and isinstance(output_index, int) and 0 <= output_index < len(tx.outputs):
+                tx_output = tx.outputs[output_index]
+        return tx_output
 
     def _handle_incoming_mined_block(self, payload, addr):
         """
@@ -125,27 +289,36 @@ class Miner(Node):
         :param addr: the address of the sender node.
         """
         data = payload.get("data")
-        index, timestamp, previous_hash, nonce = data['index'], data['timestamp'], data['previous_hash'], data['nonce']
-        transactions = data['merkle_tree']['transactions']
-        block = Block(index, transactions, previous_hash, nonce=nonce, timestamp=timestamp)
+        try:
+            block = self._parse_block(data)
+        except Exception:
+            if self.logging_level >= 1:
+                Node.print(f"Node {self.node_name} rejected a malformed block from {payload['sender_name']}.")
+            return
+        if block.index < len(self.blockchain) - 1:
+            # Stale block, nothing to do with it
+            return
 
         # Check if the received block is valid
         if self._is_valid_block_with_current_blockchain(block):
-            self.stop_mining = True
-
-            # Check if the received block's transactions are in the miner's current transaction list
-            for tx in transactions:
-                if tx in self.transaction_pool:
-                    self.transaction_pool.remove(tx)
-
-            # Add the block to the blockchain
-            self.blockchain.append(block)
-            self._update_utxos_from_blockchain()
-            self.stop_mining = False
+            # Check the scripts and signatures of the block before connecting it
+            invalid = self.validator.validate_block(block, self.blockchain[-1] if self.blockchain else None,
+                                                    self.utxos, data.get('h'))
+            if invalid is not None:
+                if self.logging_level >= 1:
+                    Node.print(f"Node {self.node_name} rejected block {invalid[0]} from {payload['sender_name']} : "
+                               f"{invalid[1]}.")
+                return
+            self._connect_block(block)
+            self._connect_orphan_blocks()
         elif self._is_valid_block(block):
             if block.index >= len(self.blockchain):
-                # This block is ahead of the current block, request an update
-                self._request_blockchain_update(payload['sender'])
+                if len(self.blockchain) > 0 and block.previous_hash == self.blockchain[-1].hash():
+                    # The parent is our last block but the block doesn't follow it, request an update
+                    self._request_blockchain_update(payload['sender'])
+                else:
+                    # The parent of this block is unknown, it's probably still on its way
+                    self._add_orphan_block(block, payload['sender'])
             elif block.index == len(self.blockchain) - 1:
                 # Same length of the blockchain, need to find other criteria to decide what to do
                 # Check if this block was mined before my last block
@@ -153,6 +326,104 @@ class Miner(Node):
                         (block.nonce == self.blockchain[-1].nonce and block.timestamp < self.blockchain[-1].timestamp):
                     self._request_blockchain_update(payload['sender'])
 
+    @staticmethod
+    def _parse_block(data):
+        """
+        Builds a block received from another node, after checking the types of its header. The header must advertise
+        the Merkle root, so that the hash and the proof of work are checked without building the Merkle tree, which is
+        only built if they are valid.
+
+        :param data: the block as a dictionary, as it is sent over the network.
+        :return: Block: the block.
+        """
+        index, timestamp, previous_hash, nonce = data['index'], data['timestamp'], data['previous_hash'], data['nonce']
+        merkle_root = data.get('merkle_root')
+        if not all(isinstance(value, int) for value in (index, timestamp, nonce)) or \
+                not all(isinstance(value, str) for value in (previous_hash, merkle_root)) or len(merkle_root) != 64:
+            raise ValueError("Malformed block header")
+        transactions = data['merkle_tree']['transactions']
+        if not isinstance(transactions, list):
+            raise ValueError("Malformed block transactions")
+        return Block(index, transactions, previous_hash, nonce=nonce, timestamp=timestamp, merkle_root=merkle_root)
+
+    def _connect_block(self, block):
+        """
+        Appends a block that follows the current blockchain and removes its transactions from the transaction pool.
+
+        :param block: the block to connect, it must be valid with the current blockchain.
+        """
+        self.stop_mining = True
+
+        # Remove the received block's transactions from the transaction pool, and the ones that conflict with them
+        self.transaction_pool.remove_many(block.transactions())
+        self.transaction_pool.remove_conflicts(block.transactions())
+
+        # Add the block to the blockchain
+        self.blockchain.append(block)
+        self._update_utxos_from_block(block)
+        self._prune_blockchain()
+        self.stop_mining = False
+
+    def _add_orphan_block(self, block, sender):
+        """
+        Buffers a block whose parent is unknown until the parent arrives. If the gap is not closed after
+        `orphan_timeout` seconds, a blockchain update is requested from the sender, see `_expire_orphan_blocks`.
+
+        :param block: the orphan block.
+        :param sender: the node that sent the block.
+        """
+        with self.orphan_lock:
+            block_hash = block.hash()
+            if block_hash in self.orphan_blocks:
+                return
+            self.orphan_blocks[block_hash] = (block, sender, time.time() + self.orphan_timeout)
+            # Drop the oldest orphans once the pool is full
+            while len(self.orphan_blocks) > self.max_orphan_blocks:
+                self.orphan_blocks.popitem(last=False)
+
+    def _expire_orphan_blocks(self):
+        """
+        Drops the orphan blocks whose parent didn't arrive in time, and requests a blockchain update from their senders
+        if they are still ahead of the blockchain. Called by the mining thread.
+        """
+        now = time.time()
+        with self.orphan_lock:
+            expired = [block_hash for block_hash, (_, _, deadline) in self.orphan_blocks.items() if deadline <= now]
+            expired = [self.orphan_blocks.pop(block_hash) for block_hash in expired]
+        senders = []
+        for block, sender, _ in expired:
+            if block.index >= len(self.blockchain) and sender not in senders:
+                senders.append(sender)
+                self._request_blockchain_update(sender)
+
+    def _connect_orphan_blocks(self):
+        """
+        Connects the buffered orphan blocks that follow the last block of the blockchain, one after the other. When
+        several orphans claim the last block as their parent, the first valid one is connected and the others are
+        dropped. If none of them is valid, a blockchain update is requested from their senders.
+        """
+        while len(self.blockchain) > 0:
+            last_hash = self.blockchain[-1].hash()
+            with self.orphan_lock:
+                children = [block_hash for block_hash, (block, _, _) in self.orphan_blocks.items()
+                            if block.previous_hash == last_hash]
+                children = [self.orphan_blocks.pop(block_hash) for block_hash in children]
+            if not children:
+                return
+            for block, sender, _ in children:
+                # Only the header of the orphan was checked when it was received
+                if self._is_valid_block_with_current_blockchain(block) and \
+                        self.validator.validate_block(block, self.blockchain[-1], self.utxos) is None:
+                    self._connect_block(block)
+                    break
+            else:
+                senders = []
+                for _, sender, _ in children:
+                    if sender not in senders:
+                        senders.append(sender)
+                        self._request_blockchain_update(sender)
+                return
+
     def _handle_incoming_blockchain_request(self, payload, addr):
         """
         An override of the `_handle_incoming_blockchain_request` method of the Node class.
@@ -161,6 +432,12 @@ class Miner(Node):
         :param payload: the blockchain request payload received from other nodes.
         :param addr: the address of the sender node.
         """
+        # A pruned blockchain can't be used by the other nodes to rebuild their UTXOs
+        if self.pruned_height > 0:
+            self._send({"request": "request_blockchain", "reason": "blockchain pruned"}, "data_unavailable",
+                       receiver=payload["sender"])
+            return
+
         # Send the current blockchain to the requesting node
         serialized_blockchain = [block.as_dict() for block in self.blockchain]
         serialized_transactions = [tx.as_dict() for tx in self.transaction_pool]
@@ -174,33 +451,126 @@ class Miner(Node):
         :param payload: the blockchain update payload received from other nodes.
         :param addr: the address of the sender node.
         """
+        try:
+            adopted = self._adopt_blockchain(payload)
+        except Exception:
+            if self.logging_level >= 1:
+                Node.print(f"Node {self.node_name} rejected the malformed blockchain of {payload['sender_name']}.")
+            adopted = False
+        finally:
+            # Mining resumes whatever happens to the received blockchain
+            self.stop_mining = False
+        if adopted:
+            self._connect_orphan_blocks()
+
+    def _adopt_blockchain(self, payload):
+        """
+        Validates the blockchain received from another node, and adopts it if it isn't shorter than the local one.
+
+        :param payload: the blockchain update payload received from other nodes.
+        :return: bool: whether the received blockchain is valid and at least as long as the local one.
+        """
         serialized_blockchain, serialized_transactions = payload.get("data")
+        if len(serialized_blockchain) < len(self.blockchain):
+            return False
+
+        # Validate the whole received blockchain before adopting it
+        invalid = self.validator.validate_blockchain(serialized_blockchain)
+        if invalid is not None:
+            if self.logging_level >= 1:
+                Node.print(f"Node {self.node_name} rejected the blockchain of {payload['sender_name']}, block "
+                           f"{invalid[0]} is invalid : {invalid[1]}.")
+            return False
+
+        # The Merkle roots were checked by the validator, the trees are only built if they are needed
         received_blockchain = [Block(block['index'], block["merkle_tree"]["transactions"], block["previous_hash"],
-                                     nonce=block["nonce"], timestamp=block["timestamp"]) for block in
-                               serialized_blockchain]
-        received_transactions = [Transaction(tx) for tx in serialized_transactions]
+                                     nonce=block["nonce"], timestamp=block["timestamp"],
+                                     merkle_root=block.get("merkle_root")) for block in serialized_blockchain]
+        received_transactions = self._parse_transactions(serialized_transactions)
 
         # Compare the length of the received blockchain with the local blockchain
         if len(received_blockchain) >= len(self.blockchain):
             # If the received blockchain is longer, update the local blockchain
             self.blockchain = received_blockchain
-            self.transaction_pool = received_transactions
+            self.pruned_height = 0
             self._update_utxos_from_blockchain()
+            self._prune_blockchain()
+            # Only keep the received transactions that can still be mined on top of the new blockchain, they go
+            # through the same checks as the transactions relayed by other nodes
+            self.transaction_pool.clear()
+            self._add_transactions(received_transactions)
             Node.print(f"Node {self.node_name} updated it's blockchain from {payload['sender_name']}.")
+        return True
+
+    def _handle_incoming_data_unavailable(self, payload, addr):
+        """
+        An override of the `_handle_incoming_data_unavailable` method of the Node class.
+        Resumes mining when the blockchain requested from another node was pruned.
+
+        :param payload: the payload received from the pruned node.
+        :param addr: the address of the sender node.
+        """
+        if self.logging_level >= 1:
+            Node.print(f"Node {self.node_name} couldn't get data from {payload['sender_name']} : "
+                       f"{payload.get('data')}.")
         self.stop_mining = False
 
     def _handle_incoming_utxos_request(self, payload, addr):
         """
         A private method that handles incoming UTXO requests from a wallet.
 
-        :param payload: the UTXO request payload received from a wallet.
+        :param payload: the UTXO request payload received from a wallet, its data is the address and the id of the
+        request, or only the address for older wallets.
         :param addr: the address of the sender node.
         """
-        address = payload.get("data")
+        data = payload.get("data")
+        address, request_id = (data.get("address"), data.get("request_id")) if isinstance(data, dict) else (data, None)
         # Find the UTXOs that belong to the miner and have not been spent
         utxos = {utxo_id: utxo for utxo_id, utxo in self.utxos.items() if
                  utxo["locking_script"] == self.generate_locking_script(address)}
-        self._send(utxos, 'utxos_response', receiver=tuple(payload.get('sender')))
+        # The response carries the id of the request, so that the wallet knows which request it answers
+        response = utxos if request_id is None else {"request_id": request_id, "utxos": utxos}
+        self._send(response, 'utxos_response', receiver=tuple(payload.get('sender')))
+
+    def _handle_incoming_headers_request(self, payload, addr):
+        """
+        An override of the `_handle_incoming_headers_request` method of the Node class.
+        Sends the headers of the blocks from the requested height to a light client. The headers of the pruned blocks
+        are kept, so they can always be sent.
+
+        :param payload: the payload received from the light client, its data is the first requested height.
+        :param addr: the address of the sender node.
+        """
+        start = max(0, int(payload.get("data") or 0))
+        headers = [block.header() for block in self.blockchain[start:]]
+        self._send({"start": start, "headers": headers}, "headers_response", receiver=tuple(payload.get("sender")))
+
+    def _handle_incoming_merkle_proof_request(self, payload, addr):
+        """
+        An override of the `_handle_incoming_merkle_proof_request` method of the Node class.
+        Sends the Merkle proofs of the requested transactions to a light client, along with the transactions and the
+        index of their blocks. The transactions that are unknown or in pruned blocks are left out, and if the pruned
+        blocks may hold some of them, a data_unavailable message lists those.
+
+        :param payload: the payload received from the light client, its data is a list of transaction hashes.
+        :param addr: the address of the sender node.
+        """
+        tx_hashes = set(payload.get("data") or [])
+        proofs = []
+        # The most recent blocks are the most likely to hold the transactions of a wallet
+        for block in reversed(self.blockchain):
+            if not tx_hashes or block.is_pruned():
+                break
+            merkle_tree = block.merkle_tree
+            for tx_hash in [tx_hash for tx_hash in tx_hashes if tx_hash in merkle_tree.leaf_positions]:
+                tx_hashes.discard(tx_hash)
+                proofs.append({"transaction": merkle_tree.transactions[merkle_tree.leaf_positions[tx_hash]].as_dict(),
+                               "block_index": block.index, "proof": merkle_tree.get_proof(tx_hash)})
+        self._send(proofs, "merkle_proof_response", receiver=tuple(payload.get("sender")))
+        # The transactions of the pruned blocks are unknown, the ones not found may be in them
+        if tx_hashes and self.pruned_height > 0:
+            self._send({"request": "merkle_proof_request", "reason": "blockchain pruned",
+                        "transactions": sorted(tx_hashes)}, "data_unavailable", receiver=tuple(payload.get("sender")))
 
     def _is_valid_block_with_current_blockchain(self, block):
         """
@@ -231,15 +601,13 @@ class Miner(Node):
         return True
 
     def _is_valid_block(self, block):
-        # Validate the proof-of-work by checking if the block's hash starts with the required number of zeros
-        if not block.hash().startswith("0" * self.difficulty):
-            return False
-
-        # Validate that the block was not cheated
-        if not block.nonce >= block.timestamp:
-            return False
+        """
+        Check if a block is independently valid, i.e. its proof of work is correct and its nonce was not cheated.
 
-        return True
+        :param block: the block to check
+        :return: bool: whether the block is valid or not
+        """
+        return Validator.check_proof_of_work(block, self.difficulty) is None
 
     def _request_blockchain_update(self, receiver):
         """
@@ -253,24 +621,116 @@ class Miner(Node):
 
     def _update_utxos_from_blockchain(self):
         """
-        Clears the current UTXOs and rebuilds them from the updated blockchain.
+        Clears the current UTXOs and rebuilds them from the updated blockchain, which must not be pruned. Blocks may
+        have been disconnected, so the subscribers receive all the UTXOs of their address again.
 
         :return: None
         """
         # Clear the current UTXOs and rebuild them from the updated blockchain
         self.utxos = {}
         for block in self.blockchain:
-            for tx in block.merkle_tree.transactions:
-                tx_hash = tx.hash()
-                for i, tx_output in enumerate(tx.outputs):
-                    self.utxos[f"{tx_hash}:{i}"] = tx_output
+            self._update_utxos_from_block(block, push=False)
+        with self.subscriptions_lock:
+            subscriptions = {address: set(subscribers) for address, subscribers in self.subscriptions.items()}
+        for address, subscribers in subscriptions.items():
+            for subscriber in subscribers:
+                self._push_utxos_snapshot(address, subscriber)
+
+    def _update_utxos_from_block(self, block, push=True):
+        """
+        Updates the current UTXOs with the outputs created and spent by a block appended to the blockchain, and pushes
+        the changes of the subscribed addresses to their subscribers.
 
-                for tx_input in tx.inputs:
-                    utxo_id = f"{tx_input['transaction_hash']}:{tx_input['output_index']}"
-                    if utxo_id in self.utxos:
-                        del self.utxos[utxo_id]
+        :param block: the new block.
+        :param push: whether to push the changes to the subscribers.
+        :return: None
+        """
+        # Created and spent UTXOs of each subscribed address
+        deltas = {}
+        push = push and len(self.subscribed_scripts) > 0
+        for tx in block.transactions():
+            tx_hash = tx.hash()
+            for i, tx_output in enumerate(tx.outputs):
+                self.utxos[f"{tx_hash}:{i}"] = tx_output
+                address = self._subscribed_address(tx_output) if push else None
+                if address is not None:
+                    deltas.setdefault(address, ({}, []))[0][f"{tx_hash}:{i}"] = tx_output
+
+            for tx_input in tx.inputs:
+                utxo_id = f"{tx_input['transaction_hash']}:{tx_input['output_index']}"
+                if utxo_id in self.utxos:
+                    address = self._subscribed_address(self.utxos[utxo_id]) if push else None
+                    if address is not None:
+                        created, spent = deltas.setdefault(address, ({}, []))
+                        # An output created and spent in the same block is not pushed at all
+                        if created.pop(utxo_id, None) is None:
+                            spent.append(utxo_id)
+                    del self.utxos[utxo_id]
+
+        for address, (created, spent) in deltas.items():
+            if not created and not spent:
+                continue
+            with self.subscriptions_lock:
+                subscribers = list(self.subscriptions.get(address, ()))
+            for subscriber in subscribers:
+                self._send({"address": address, "created": created, "spent": spent, "reset": False,
+                            "height": block.index + 1}, "utxos_delta", receiver=subscriber)
+
+    def _subscribed_address(self, utxo):
+        """
+        Returns the subscribed address whose locking script locks the given UTXO.
+
+        :param utxo: the UTXO.
+        :return: str: the address, None if the address of the UTXO has no subscribers.
+        """
+        return self.subscribed_scripts.get(tuple(utxo["locking_script"]))
 
-    def spend_mining_reward(self, receiver_address, amount):
+    def _push_utxos_snapshot(self, address, subscriber):
+        """
+        Sends all the UTXOs of an address to a subscriber, replacing the UTXOs it knows.
+
+        :param address: the subscribed address.
+        :param subscriber: the id of the subscribed node.
+        :return: None
+        """
+        locking_script = self.generate_locking_script(address)
+        utxos = {utxo_id: utxo for utxo_id, utxo in self.utxos.items() if utxo["locking_script"] == locking_script}
+        self._send({"address": address, "created": utxos, "spent": [], "reset": True, "height": len(self.blockchain)},
+                   "utxos_delta", receiver=subscriber)
+
+    def _handle_incoming_utxos_subscribe(self, payload, addr):
+        """
+        An override of the `_handle_incoming_utxos_subscribe` method of the Node class.
+        Subscribes a wallet to the changes of the UTXOs of its address: it first receives all of them, then the UTXOs
+        created and spent each time a block is connected, and all of them again when blocks are disconnected.
+
+        :param payload: the payload received from the wallet, its data is the address.
+        :param addr: the address of the sender node.
+        """
+        address = payload.get("data")
+        subscriber = tuple(payload.get("sender"))
+        with self.lock:
+            # The subscription may arrive before the new_node message of the wallet
+            self.known_nodes.add(subscriber)
+        with self.subscriptions_lock:
+            self.subscriptions.setdefault(address, set()).add(subscriber)
+            self.subscribed_scripts[tuple(self.generate_locking_script(address))] = address
+        self._push_utxos_snapshot(address, subscriber)
+
+    def _prune_blockchain(self):
+        """
+        In pruning mode, discards the transactions and Merkle trees of the blocks that are older than the last
+        `prune_depth` blocks. Only their headers are kept, the UTXOs are enough to validate new transactions.
+
+        :return: None
+        """
+        if self.prune_depth is None:
+            return
+        for block in self.blockchain[self.pruned_height:len(self.blockchain) - self.prune_depth]:
+            block.prune()
+        self.pruned_height = max(self.pruned_height, len(self.blockchain) - self.prune_depth)
+
+    def spend_mining_reward(self, receiver_address, amount, coin_selection=CoinSelection.DEFAULT):
         """
         Creates a new transaction using the available UTXOs and sends the desired amount to the receiver's address.
 
@@ -278,6 +738,8 @@ class Miner(Node):
         :type receiver_address: str
         :param amount: The amount to be sent.
         :type amount: float
+        :param coin_selection: The strategy used to choose the UTXOs to spend, see CoinSelection.
+        :type coin_selection: str
         :return: None
         """
         # Find the UTXOs that belong to the miner and have not been spent
@@ -289,20 +751,18 @@ class Miner(Node):
         outputs = []
         total_input_value = 0
 
-        for utxo_id, utxo in available_utxos.items():
+        selected_utxos = CoinSelection.select(available_utxos, amount, coin_selection)
+        if selected_utxos is None:
+            Node.print(f"Node {self.node_name} has insufficient balance.")
+            return
+
+        for utxo_id in selected_utxos:
             inputs.append({
                 "transaction_hash": utxo_id.split(':')[0],
                 "output_index": int(utxo_id.split(':')[1]),
                 "unlocking_script": None
             })
-            total_input_value += utxo["amount"]
-
-            if total_input_value >= amount:
-                break
-
-        if total_input_value < amount:
-            Node.print(f"Node {self.node_name} has insufficient balance.")
-            return
+            total_input_value += available_utxos[utxo_id]["amount"]
 
         outputs.append({
             "amount": amount,
@@ -320,6 +780,7 @@ class Miner(Node):
             signature = Transaction.sign_transaction_input(self.private_key, tx_input['transaction_hash'],
                                                            tx_input['output_index'])
             tx_input['unlocking_script'] = self.generate_unlocking_script(tx_input['transaction_hash'],
-                                                                          tx_input['output_index'], signature)
+                                                                          tx_input['output_index'], signature,
+                                                                          self.public_key)
 
         return self.create_transaction(inputs, outputs)
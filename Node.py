@@ -5,8 +5,8 @@ import threading
 import time
 import hashlib
 
-from Crypto.PublicKey import RSA
-
+from Encoding import Encoding
+from Signature import Signature
 from Transaction import Transaction
 
 
@@ -14,27 +14,85 @@ class Node:
     def __init__(self, **options):
         """
         Initializes a Node object with the given options.
-        Generates a key pair for the node and creates an address from the public key.
-        Starts listening on the given port and accepts incoming connections.
-        Sends a "new_node" message to all known nodes.
+        The key pair of the node is loaded from its keystore, or generated, the first time it is needed, and the
+        address is derived from the public key.
+        Unless autostart is False, starts the node with `start`.
 
-        :param options: dict: include host, port, node_name, max_listens, max_recv_size, logging_level, known_nodes.
+        :param options: dict: include host, port, node_name, max_listens, max_recv_size, max_batch_size, logging_level,
+        known_nodes, signature_scheme ("ed25519", "ecdsa" or "rsa"), keystore (a Keystore), key_name (defaults to the
+        node_name, or to the address of the node if it has a fixed port; a node without a key name doesn't save its
+        key), autostart.
         """
         self.host = options.get("host", "127.0.0.1")
         self.port = options.get("port", 0)
         self.node_name = options.get("node_name", str((self.host, self.port)))
         self.max_listens = options.get("max_listens", 1024 ** 2)
         self.max_recv_size = options.get("max_recv_size", 1024 ** 2)
+        self.max_batch_size = options.get("max_batch_size", 500)
         self.logging_level = options.get("logging_level", 1)
         self.outgoing_socket = None
         self.incoming_socket = None
         self.hash_history = set()
         self.known_nodes = options.get("known_nodes", set())
-        self.private_key, self.public_key = self.generate_key_pair()
-        self.address = self.generate_address(self.public_key)
+        self.signature_scheme = options.get("signature_scheme", Signature.DEFAULT)
+        self.keystore = options.get("keystore", None)
+        # The default name of a node with a random port changes at each restart, its key isn't worth saving
+        self.key_name = options.get("key_name", options.get("node_name", self.node_name if self.port else None))
+        self._key_pair = None
+        self._address = None
+        self._key_lock = threading.Lock()
         self.lock = threading.Lock()
-        self.listen()
-        self._send((self.host, self.port), "new_node")
+        if options.get("autostart", True):
+            self.start()
+
+    def start(self):
+        """
+        Starts listening on the given port and accepts incoming connections, then sends a "new_node" message to all
+        known nodes. Does nothing if the node is already started.
+
+        :return: Node: the Node object
+        """
+        if self.incoming_socket is None:
+            self.listen()
+            self._send((self.host, self.port), "new_node")
+        return self
+
+    @property
+    def private_key(self):
+        """
+        The private key of the node, loaded the first time it is needed.
+        """
+        return self._load_key_pair()[0]
+
+    @property
+    def public_key(self):
+        """
+        The public key of the node, loaded the first time it is needed.
+        """
+        return self._load_key_pair()[1]
+
+    @property
+    def address(self):
+        """
+        The address of the node, derived from its public key the first time it is needed.
+        """
+        if self._address is None:
+            self._address = self.generate_address(self.public_key)
+        return self._address
+
+    def _load_key_pair(self):
+        """
+        Loads the key pair of the node from its keystore, or generates it if the node has no keystore.
+
+        :return: tuple: The private key and the public key.
+        """
+        with self._key_lock:
+            if self._key_pair is None:
+                if self.keystore is not None:
+                    self._key_pair = self.keystore.load(self.key_name, self.signature_scheme)
+                else:
+                    self._key_pair = self.generate_key_pair(self.signature_scheme)
+            return self._key_pair
 
     def id(self):
         """
@@ -80,13 +138,12 @@ class Node:
         if sender is None:
             sender = self.id()
             sender_name = self.node_name
-        payload_repr = repr((data_type, data, sender, sender_name, receiver, timestamp))
-        payload_hash = hashlib.sha256(payload_repr.encode()).hexdigest() if data_hash is None else data_hash
+        payload_encoding = Encoding.encode((data_type, data, sender, sender_name, receiver, timestamp))
+        payload_hash = hashlib.sha256(payload_encoding).hexdigest() if data_hash is None else data_hash
         self.hash_history.add(payload_hash)
         payload = {"hash": payload_hash, "type": data_type, "sender": sender, "sender_name": sender_name,
                    "sent_at": timestamp, "receiver": receiver, "data": data}
-        payload = json.dumps(payload)
-        payload = payload.encode()
+        payload = Encoding.encode(payload)
         with self.lock:
             for known_node in self.known_nodes:
                 self._connect_and_send(known_node, payload)
@@ -102,7 +159,7 @@ class Node:
         :param payload: encoded data to send
         """
         try:
-            self._connect(*node).send(payload)
+            self._connect(*node).sendall(payload)
         except Exception as e:
             Node.print(e)
 
@@ -154,7 +211,16 @@ class Node:
         :param addr: address of the sending socket
         """
         with conn:
-            data = conn.recv(self.max_recv_size).decode()
+            # The sender closes the connection once the whole payload is sent
+            chunks = []
+            size = 0
+            while size < self.max_recv_size:
+                chunk = conn.recv(self.max_recv_size - size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+            data = b"".join(chunks).decode()
             threading.Thread(target=self._handle_incoming_data, args=(data, addr)).start()
 
     def _handle_incoming_data(self, payload, addr):
@@ -200,6 +266,8 @@ class Node:
             self._handle_incoming_known_nodes(payload, addr)
         elif data_type == "transaction":
             self._handle_incoming_transaction(payload, addr)
+        elif data_type == "transactions":
+            self._handle_incoming_transactions(payload, addr)
         elif data_type == "mined_block":
             self._handle_incoming_mined_block(payload, addr)
         elif data_type == "request_blockchain":
@@ -210,6 +278,20 @@ class Node:
             self._handle_incoming_utxos_request(payload, addr)
         elif data_type == "utxos_response":
             self._handle_incoming_utxos_response(payload, addr)
+        elif data_type == "data_unavailable":
+            self._handle_incoming_data_unavailable(payload, addr)
+        elif data_type == "utxos_subscribe":
+            self._handle_incoming_utxos_subscribe(payload, addr)
+        elif data_type == "utxos_delta":
+            self._handle_incoming_utxos_delta(payload, addr)
+        elif data_type == "headers_request":
+            self._handle_incoming_headers_request(payload, addr)
+        elif data_type == "headers_response":
+            self._handle_incoming_headers_response(payload, addr)
+        elif data_type == "merkle_proof_request":
+            self._handle_incoming_merkle_proof_request(payload, addr)
+        elif data_type == "merkle_proof_response":
+            self._handle_incoming_merkle_proof_response(payload, addr)
         else:
             # Do nothing if the data type is not recognized
             pass
@@ -252,6 +334,13 @@ class Node:
         """
         pass
 
+    def _handle_incoming_transactions(self, payload, addr):
+        """
+        This method is a callback function that is called whenever a batch of transactions is received from another
+        node in the network.
+        """
+        pass
+
     def _handle_incoming_mined_block(self, payload, addr):
         """
         This method is a callback function that is called whenever a new block is mined by a Miner in the network.
@@ -286,6 +375,55 @@ class Node:
         """
         pass
 
+    def _handle_incoming_data_unavailable(self, payload, addr):
+        """
+        This method is a callback function that is called whenever another node in the network can't answer a request
+        because the requested data was pruned.
+        """
+        pass
+
+    def _handle_incoming_utxos_subscribe(self, payload, addr):
+        """
+        This method is a callback function that is called whenever a Wallet subscribes to the changes of the UTXOs of
+        its address.
+        """
+        pass
+
+    def _handle_incoming_utxos_delta(self, payload, addr):
+        """
+        This method is a callback function that is called whenever a Miner in the network pushes the changes of the
+        UTXOs of a subscribed address.
+        """
+        pass
+
+    def _handle_incoming_headers_request(self, payload, addr):
+        """
+        This method is a callback function that is called whenever a light client requests the headers of the blocks
+        of the current node's copy of the blockchain.
+        """
+        pass
+
+    def _handle_incoming_headers_response(self, payload, addr):
+        """
+        This method is a callback function that is called whenever a Miner in the network sends block headers in
+        response to a request.
+        """
+        pass
+
+    def _handle_incoming_merkle_proof_request(self, payload, addr):
+        """
+        This method is a callback function that is called whenever a light client requests the Merkle proofs of some
+        transactions.
+        """
+        pass
+
+    def _handle_incoming_merkle_proof_response(self, payload, addr):
+        """
+        This method is a callback function that is called whenever a Miner in the network sends Merkle proofs in
+        response to a request.
+        """
+        pass
+
     def create_transaction(self, inputs, outputs):
         """
         Creates a transaction and sends it to other nodes for processing.
@@ -305,6 +443,60 @@ class Node:
         Node.print(f"Node {self.node_name} sent a transaction : {transaction.as_dict()}")
         return transaction
 
+    def create_transactions(self, transactions):
+        """
+        Creates several transactions and sends them to other nodes for processing in batches, instead of one message
+        per transaction.
+
+        Args:
+            transactions (list): List of (inputs, outputs) tuples, one per transaction.
+
+        Returns:
+            transactions (list): The created transaction objects.
+        """
+        transactions = [Transaction({'inputs': inputs, 'outputs': outputs}) for inputs, outputs in transactions]
+        return self.send_transactions(transactions)
+
+    def send_transactions(self, transactions):
+        """
+        Sends already created transactions to other nodes in messages of at most `max_batch_size` transactions. The
+        receiving nodes read at most `max_recv_size` bytes of a message, so a batch is also cut before its message
+        reaches that size. A transaction too large to fit in a message is sent alone.
+
+        Args:
+            transactions (list): List of Transaction objects.
+
+        Returns:
+            transactions (list): The sent transaction objects.
+        """
+        # Size of a message without its transactions, see _send
+        envelope_size = len(Encoding.encode({"hash": "0" * 64, "type": "transactions", "sender": self.id(),
+                                             "sender_name": self.node_name, "sent_at": time.time_ns(),
+                                             "receiver": None, "data": []}))
+        batch, batch_size = [], envelope_size
+        for tx in transactions:
+            data = tx.as_dict()
+            # The transactions of a batch are separated by commas
+            size = len(Encoding.encode(data)) + 1
+            if batch and (len(batch) == self.max_batch_size or batch_size + size > self.max_recv_size):
+                self._send_batch(batch)
+                batch, batch_size = [], envelope_size
+            batch.append(data)
+            batch_size += size
+        if batch:
+            self._send_batch(batch)
+        return transactions
+
+    def _send_batch(self, batch):
+        """
+        Sends a batch of serialized transactions in a single `transactions` message.
+
+        :param batch: list: the transactions as dictionaries.
+        """
+        self._send(batch, "transactions")
+        if self.logging_level >= 1:
+            Node.print(f"Node {self.node_name} sent a batch of {len(batch)} transactions")
+
     def __repr__(self):
         """
         Returns a string representation of the Node object.
@@ -328,7 +520,7 @@ class Node:
         return [address, "OP_EQUAL"]
 
     @staticmethod
-    def generate_unlocking_script(transaction_hash, output_index, signature):
+    def generate_unlocking_script(transaction_hash, output_index, signature, public_key=None):
         """
         Generates the unlocking script for a given transaction hash, output index, and signature.
 
@@ -336,36 +528,42 @@ class Node:
             transaction_hash (str): The hash of the transaction being unlocked.
             output_index (int): The index of the output being unlocked.
             signature (bytes): The signature used to unlock the output.
+            public_key (object): The public key of the owner of the output, needed by the miners to check the signature.
+                The signature scheme of the key is written after it.
 
         Returns:
             list: A list representing the unlocking script for the given transaction hash, output index, and signature.
         """
         # Convert the signature to a base64 string
         signature_str = base64.b64encode(signature).decode()
-        return [signature_str, f"{transaction_hash}:{output_index}"]
+        unlocking_script = [signature_str, f"{transaction_hash}:{output_index}"]
+        if public_key is not None:
+            unlocking_script.append(base64.b64encode(Signature.export_public_key(public_key)).decode())
+            unlocking_script.append(Signature.scheme_of(public_key))
+        return unlocking_script
 
     @staticmethod
-    def generate_key_pair():
+    def generate_key_pair(scheme=Signature.DEFAULT):
         """
-        Generates a pair of RSA keys (private and public).
+        Generates a pair of keys (private and public) for the given signature scheme.
+        Args:
+            scheme: str: The signature scheme, "ed25519" (default), "ecdsa" or "rsa".
         Returns:
-            private_key: object: RSA private key object.
-            public_key: object: RSA public key object.
+            private_key: object: Private key object.
+            public_key: object: Public key object.
         """
-        private_key = RSA.generate(2048)
-        public_key = private_key.publickey()
-        return private_key, public_key
+        return Signature.generate_key_pair(scheme)
 
     @staticmethod
     def generate_address(public_key):
         """
         Generates a public address from a given public key using SHA256 hash.
         Args:
-            public_key: object: RSA public key object.
+            public_key: object: Public key object, of any signature scheme.
         Returns:
             str: Public address string.
         """
-        return hashlib.sha256(public_key.export_key(format='DER')).hexdigest()
+        return hashlib.sha256(Signature.export_public_key(public_key)).hexdigest()
 
     @staticmethod
     def wait(*nodes):
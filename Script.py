@@ -1,12 +1,65 @@
+import functools
 import hashlib
+import math
+
+# Operations of the compiled scripts
+PUSH, DUP, HASH160, EQUALVERIFY = range(4)
 
 
 class Script:
+    # Cost of each operation, hashing is the expensive one
+    operation_costs = {PUSH: 1, DUP: 1, HASH160: 10, EQUALVERIFY: 1}
+    # Limits enforced by execute, they also bound the cost of a script
+    max_length = 1000
+    max_item_size = 520
+    max_stack_depth = 1000
+
     def __init__(self, code):
         """
-        Initializes a new Script instance with the specified list of opcodes.
+        Initializes a new Script instance with the specified list of opcodes. The script is compiled the first time it
+        is executed.
         """
         self.code = code
+        self.compiled = None
+
+    @staticmethod
+    def compile(code):
+        """
+        Compiles a list of opcodes into a tuple of (operation, argument) pairs, so that the opcodes are only parsed
+        once. The compiled scripts are kept in an LRU cache keyed by the content of the script, since the same standard
+        scripts are executed over and over. The scripts beyond the limits of `execute` are neither compiled nor cached,
+        so that a large rejected script doesn't stay in memory, and neither are the malformed scripts (not a list of
+        strings).
+
+        :param code: list: The opcodes of the script.
+        :return: tuple: The compiled script, None if the script is malformed or exceeds the limits.
+        """
+        if not isinstance(code, (list, tuple)) or len(code) > Script.max_length or \
+                not all(isinstance(op, str) and len(op) <= Script.max_item_size for op in code):
+            return None
+        return _compile(tuple(code))
+
+    @staticmethod
+    def cost(code):
+        """
+        Returns the execution cost of a list of opcodes: the sum of the costs of its operations. The scripts have no
+        branches, so the cost is known before running them. The malformed scripts and the scripts beyond the limits of
+        `execute` can't be run, their cost is infinite.
+
+        :param code: list: The opcodes of the script.
+        :return: int: The cost.
+        """
+        compiled = Script.compile(code)
+        if compiled is None:
+            return math.inf
+        return sum(Script.operation_costs[operation] for operation, _ in compiled)
+
+    @staticmethod
+    def cache_info():
+        """
+        Returns the statistics of the cache of compiled scripts (hits, misses, maxsize, currsize).
+        """
+        return _compile.cache_info()
 
     def execute(self, stack):
         """
@@ -19,15 +72,48 @@ class Script:
         - "OP_EQUALVERIFY": Pops the top two elements of the stack and verifies if they are equal. If they are not
         equal, returns False.
         - Any other opcode: Pushes the opcode onto the stack.
+        The execution is aborted, and False returned, when the script is malformed, has more than `max_length`
+        opcodes, pushes an item larger than `max_item_size`, grows the stack beyond `max_stack_depth` items or needs
+        more items than the stack holds.
         """
-        for op in self.code:
-            if op == "OP_DUP":
+        if self.compiled is None:
+            self.compiled = Script.compile(self.code)
+        if self.compiled is None:
+            return False
+        for operation, argument in self.compiled:
+            if operation == PUSH:
+                if len(argument) > Script.max_item_size or len(stack) >= Script.max_stack_depth:
+                    return False
+                stack.append(argument)
+            elif operation == DUP:
+                if not stack or len(stack) >= Script.max_stack_depth:
+                    return False
                 stack.append(stack[-1])
-            elif op == "OP_HASH160":
-                stack.append(hashlib.sha256(stack.pop().encode()).hexdigest())
-            elif op.startswith("OP_EQUALVERIFY"):
-                if stack.pop() != stack.pop():
+            elif operation == HASH160:
+                if not stack or not isinstance(stack[-1], str):
                     return False
-            else:
-                stack.append(op)
+                stack.append(hashlib.sha256(stack.pop().encode()).hexdigest())
+            elif len(stack) < 2 or stack.pop() != stack.pop():
+                return False
         return True
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile(code):
+    """
+    Compiles a tuple of opcodes, see Script.compile.
+
+    :param code: tuple: The opcodes of the script.
+    :return: tuple: The compiled script.
+    """
+    compiled = []
+    for op in code:
+        if op == "OP_DUP":
+            compiled.append((DUP, None))
+        elif op == "OP_HASH160":
+            compiled.append((HASH160, None))
+        elif op.startswith("OP_EQUALVERIFY"):
+            compiled.append((EQUALVERIFY, None))
+        else:
+            compiled.append((PUSH, op))
+    return tuple(compiled)
@@ -0,0 +1,104 @@
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import DSS, eddsa, pkcs1_15
+
+
+class Signature:
+    """
+    The signature schemes supported by the nodes. Each scheme is identified by a name, which is written in the
+    unlocking scripts so that the miners know how to check their signatures:
+
+    - "rsa": RSA-2048 with PKCS#1 v1.5 and SHA256, the original scheme. Unlocking scripts without a scheme use it.
+    - "ed25519": Ed25519 (RFC 8032), fast key generation, signing and verification with 64 bytes signatures.
+    - "ecdsa": ECDSA on the NIST P-256 curve with SHA256 (FIPS 186-3).
+    """
+    DEFAULT = "ed25519"
+    LEGACY = "rsa"
+    SCHEMES = ("rsa", "ed25519", "ecdsa")
+
+    @staticmethod
+    def generate_key_pair(scheme=DEFAULT):
+        """
+        Generates a pair of keys for the given scheme.
+
+        :param scheme: str: The name of the signature scheme.
+        :return: tuple: The private key and the public key.
+        """
+        if scheme == "rsa":
+            private_key = RSA.generate(2048)
+        elif scheme == "ed25519":
+            private_key = ECC.generate(curve="ed25519")
+        elif scheme == "ecdsa":
+            private_key = ECC.generate(curve="p256")
+        else:
+            raise ValueError(f"Unknown signature scheme {scheme}")
+        return private_key, private_key.public_key()
+
+    @staticmethod
+    def scheme_of(key):
+        """
+        Returns the name of the signature scheme of a private or public key.
+
+        :param key: RsaKey or EccKey: The key.
+        :return: str: The name of the signature scheme.
+        """
+        if isinstance(key, RSA.RsaKey):
+            return "rsa"
+        if isinstance(key, ECC.EccKey):
+            return "ed25519" if key.curve == "Ed25519" else "ecdsa"
+        raise ValueError(f"Unsupported key type {type(key).__name__}")
+
+    @staticmethod
+    def export_public_key(public_key):
+        """
+        Exports a public key in DER format, the format used in the unlocking scripts and hashed into the addresses.
+
+        :param public_key: RsaKey or EccKey: The public key.
+        :return: bytes: The DER encoding of the public key.
+        """
+        return public_key.export_key(format="DER")
+
+    @staticmethod
+    def sign(private_key, message):
+        """
+        Signs a message with a private key, using the scheme of the key.
+
+        :param private_key: RsaKey or EccKey: The private key.
+        :param message: bytes: The message to sign.
+        :return: bytes: The signature.
+        """
+        scheme = Signature.scheme_of(private_key)
+        if scheme == "rsa":
+            return pkcs1_15.new(private_key).sign(SHA256.new(message))
+        if scheme == "ed25519":
+            return eddsa.new(private_key, "rfc8032").sign(message)
+        return DSS.new(private_key, "fips-186-3").sign(SHA256.new(message))
+
+    @staticmethod
+    def verify(scheme, public_key_der, message, signature):
+        """
+        Verifies the signature of a message. The key must belong to the given scheme, so that a signature can't be
+        checked with another scheme than the one written in the unlocking script.
+
+        :param scheme: str: The name of the signature scheme.
+        :param public_key_der: bytes: The DER encoding of the public key.
+        :param message: bytes: The signed message.
+        :param signature: bytes: The signature.
+        :return: bool: True if the signature is valid, False otherwise.
+        """
+        try:
+            if scheme == "rsa":
+                pkcs1_15.new(RSA.import_key(public_key_der)).verify(SHA256.new(message), signature)
+                return True
+            if scheme not in ("ed25519", "ecdsa"):
+                return False
+            public_key = ECC.import_key(public_key_der)
+            if Signature.scheme_of(public_key) != scheme:
+                return False
+            if scheme == "ed25519":
+                eddsa.new(public_key, "rfc8032").verify(message, signature)
+            else:
+                DSS.new(public_key, "fips-186-3").verify(SHA256.new(message), signature)
+            return True
+        except (ValueError, TypeError, IndexError):
+            return False
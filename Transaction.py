@@ -1,38 +1,74 @@
 import base64
 import hashlib
 import json
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA256
+import math
+import threading
 import time
+from collections import OrderedDict
 
+from Encoding import Encoding
 from Script import Script
+from Signature import Signature
+from Workers import Workers
 
 
 class Transaction:
+    # No __dict__ per transaction, a pool or a block can hold a lot of them
+    __slots__ = ("inputs", "outputs", "timestamp", "h", "_encoding")
+    # Bounded LRU cache of the signatures already checked, see verify_signatures
+    signature_cache_size = 1 << 16
+    _signature_cache = OrderedDict()
+    _signature_cache_lock = threading.Lock()
+    # Execution cost of a signature check, in the units of Script.operation_costs
+    signature_cost = 100
+    # Limits enforced by execute
+    max_inputs = 1000
+    max_cost = 100000
+
     def __init__(self, data):
         """
-        initializes the Transaction instance. If the provided data is of type Transaction, it sets the inputs, outputs,
-        and timestamp to that of the given Transaction instance. Otherwise, it sets the inputs and outputs to the
-        'inputs' and 'outputs' properties of the data dictionary, respectively, and sets the timestamp to the value of
-        the 'timestamp' key in the data dictionary if it exists. Otherwise, it sets the timestamp to the current time in
-        nanoseconds. It then calculates and sets the hash of the Transaction instance by applying the SHA256 hash
-        function to the string representation of the instance.
+        initializes the Transaction instance. If the provided data is of type Transaction, it shares the inputs,
+        outputs, timestamp, encoding and hash of the given Transaction instance, since transactions are immutable.
+        Otherwise, it sets the inputs and outputs to the 'inputs' and 'outputs' properties of the data dictionary,
+        respectively, and sets the timestamp to the value of the 'timestamp' key in the data dictionary if it exists.
+        Otherwise, it sets the timestamp to the current time in nanoseconds. It then computes the canonical encoding of
+        the instance once and caches it along with its SHA256 hash.
         """
         if isinstance(data, Transaction):
-            self.inputs = data.inputs
-            self.outputs = data.outputs
-            self.timestamp = data.timestamp if data.timestamp else time.time_ns()
-        else:
-            self.inputs = data['inputs']
-            self.outputs = data['outputs']
-            self.timestamp = data['timestamp'] if 'timestamp' in data.keys() else time.time_ns()
-        self.h = hashlib.sha256(str(self).encode()).hexdigest()
+            for attribute in Transaction.__slots__:
+                object.__setattr__(self, attribute, getattr(data, attribute))
+            return
+        object.__setattr__(self, "inputs", tuple(data['inputs']))
+        object.__setattr__(self, "outputs", tuple(data['outputs']))
+        object.__setattr__(self, "timestamp", data['timestamp'] if 'timestamp' in data.keys() else time.time_ns())
+        object.__setattr__(self, "_encoding", Encoding.encode({'inputs': self.inputs, 'outputs': self.outputs,
+                                                               'timestamp': self.timestamp}))
+        object.__setattr__(self, "h", hashlib.sha256(self._encoding).hexdigest())
+
+    def __setattr__(self, name, value):
+        """
+        Transactions are immutable, their hash is computed once when they are created.
+        """
+        raise AttributeError(f"Transaction is immutable, can't set {name}")
+
+    def __getstate__(self):
+        """
+        Returns the state of the Transaction instance, used when it is sent to a worker process.
+        """
+        return tuple(getattr(self, attribute) for attribute in Transaction.__slots__)
+
+    def __setstate__(self, state):
+        """
+        Restores the state of the Transaction instance, used when it is received from a worker process.
+        """
+        for attribute, value in zip(Transaction.__slots__, state):
+            object.__setattr__(self, attribute, value)
 
     def __str__(self):
         """
-        Returns a string representation of the Transaction instance consisting of the inputs, outputs, and timestamp.
+        Returns a string representation of the Transaction instance consisting of its canonical encoding.
         """
-        return str((self.inputs, self.outputs, self.timestamp))
+        return self._encoding.decode()
 
     def __repr__(self):
         """
@@ -43,14 +79,19 @@ class Transaction:
     def __eq__(self, other):
         """
         Returns True if the provided 'other' object is equal to the Transaction instance. Equality is defined as having
-        the same inputs, outputs, and timestamp.
+        the same hash, i.e. the same inputs, outputs, and timestamp.
         """
-        other_tx = Transaction(other)
-        res = True
-        res = res and self.inputs == other_tx.inputs
-        res = res and self.outputs == other_tx.outputs
-        res = res and self.timestamp == other_tx.timestamp
-        return res
+        if isinstance(other, Transaction):
+            return self.h == other.h
+        if isinstance(other, dict):
+            return self.h == Transaction(other).h
+        return NotImplemented
+
+    def __hash__(self):
+        """
+        Returns a hash of the Transaction instance based on its SHA256 hash, so that it can be used in sets and dicts.
+        """
+        return hash(self.h)
 
     def hash(self):
         """
@@ -58,51 +99,248 @@ class Transaction:
         """
         return self.h
 
+    def encode(self):
+        """
+        Returns the canonical encoding of the Transaction instance (inputs, outputs, and timestamp), the bytes that are
+        hashed. It can be stored and decoded with `decode`.
+        """
+        return self._encoding
+
+    @staticmethod
+    def decode(data):
+        """
+        Returns the Transaction instance encoded in the given bytes by `encode`.
+        """
+        return Transaction(Encoding.decode(data))
+
     def as_dict(self):
         """
-        Returns a copy of the Transaction instance's dictionary representation.
+        Returns a dictionary representation of the Transaction instance.
         """
-        return self.__dict__.copy()
+        return {'inputs': list(self.inputs), 'outputs': list(self.outputs), 'timestamp': self.timestamp, 'h': self.h}
 
-    def execute(self):
+    def execute(self, max_cost=None):
         """
-        Executes the transaction by iterating over each input and output pair, applying their unlocking and locking
-        scripts, respectively, and checking that the result is True for each pair. Returns True if all input/output
-        pairs were successfully executed, False otherwise.
+        Checks the structure of the transaction before its inputs are verified: it is rejected if it is malformed (see
+        `is_well_formed`), if it has more than `max_inputs` inputs or if its `cost` exceeds max_cost. No script is run
+        here, an input can only be checked against the output it spends, which the transaction doesn't hold: see
+        `verify_unlocking_scripts`, called by the miners and the Validator once the spent outputs are known.
+
+        :param max_cost: int: The maximum cost of the transaction, defaults to Transaction.max_cost.
+        :return: bool: True if the transaction can be verified, False otherwise.
         """
-        for tx_input, tx_output in zip(self.inputs, self.outputs):
-            unlocking_script = Script(tx_input["unlocking_script"])
-            locking_script = Script(tx_output["locking_script"])
-            stack = []
+        if not self.is_well_formed() or len(self.inputs) > Transaction.max_inputs:
+            return False
+        return self.cost() <= (Transaction.max_cost if max_cost is None else max_cost)
 
-            if not unlocking_script.execute(stack) or not locking_script.execute(stack):
-                return False
+    def cost(self):
+        """
+        Returns the execution cost of the transaction: `signature_cost` for each input with a standard unlocking script,
+        whose signature is checked by the miners, and the cost of the scripts of the other input/output pairs (see
+        Script.cost). The cost is known without running the scripts, and can be used for the fee rate policy. A
+        malformed transaction can't be run, its cost is infinite.
+
+        :return: int: The cost.
+        """
+        if not self.is_well_formed():
+            return math.inf
+        cost = 0
+        for i, tx_input in enumerate(self.inputs):
+            if Transaction._is_standard_unlocking_script(tx_input["unlocking_script"]):
+                cost += Transaction.signature_cost
+            else:
+                locking_script = self.outputs[i]["locking_script"] if i < len(self.outputs) else []
+                cost += Script.cost(tx_input["unlocking_script"]) + Script.cost(locking_script)
+        return cost
+
+    def is_well_formed(self):
+        """
+        Checks the structure of the transaction: the inputs reference an output by its transaction hash and index and
+        carry an unlocking script, and the outputs have a non-negative amount and a locking script. The scripts
+        themselves are checked when they are compiled.
 
+        :return: bool: True if the transaction is well-formed, False otherwise.
+        """
+        for tx_input in self.inputs:
+            if not isinstance(tx_input, dict) or not isinstance(tx_input.get("transaction_hash"), str) or \
+                    type(tx_input.get("output_index")) is not int or "unlocking_script" not in tx_input:
+                return False
+        for tx_output in self.outputs:
+            if not isinstance(tx_output, dict) or type(tx_output.get("amount")) not in (int, float) or \
+                    not tx_output["amount"] >= 0 or "locking_script" not in tx_output:
+                return False
         return True
 
+    @staticmethod
+    def is_standard(unlocking_script, locking_script):
+        """
+        Checks if an unlocking script and a locking script follow the standard pay-to-address templates of
+        `Node.generate_unlocking_script` ([signature, "transaction_hash:output_index"], optionally followed by the
+        public key and the signature scheme) and `Node.generate_locking_script` ([address, "OP_EQUAL"]).
+        """
+        return (Transaction._is_standard_locking_script(locking_script)
+                and Transaction._is_standard_unlocking_script(unlocking_script))
+
+    @staticmethod
+    def _is_standard_locking_script(locking_script):
+        """
+        Checks if a locking script follows the template of `Node.generate_locking_script`.
+        """
+        return (isinstance(locking_script, (list, tuple)) and len(locking_script) == 2
+                and locking_script[1] == "OP_EQUAL" and isinstance(locking_script[0], str)
+                and not locking_script[0].startswith("OP_"))
+
+    @staticmethod
+    def _is_standard_unlocking_script(unlocking_script):
+        """
+        Checks if an unlocking script follows the template of `Node.generate_unlocking_script`.
+        """
+        return (isinstance(unlocking_script, (list, tuple)) and 2 <= len(unlocking_script) <= 4
+                and all(isinstance(item, str) and not item.startswith("OP_") for item in unlocking_script))
+
     @staticmethod
     def sign_transaction_input(private_key, transaction_hash, output_index):
         """
         Creates a signature for the transaction input using the provided private key, transaction hash, and output
-        index.
+        index. The signature scheme is the one of the private key.
         """
-        h = SHA256.new(f"{transaction_hash}:{output_index}".encode())
-        signature = pkcs1_15.new(private_key).sign(h)
-        return signature
+        return Signature.sign(private_key, f"{transaction_hash}:{output_index}".encode())
 
     @staticmethod
     def verify_transaction_signature(public_key, transaction_hash, output_index, signature_str):
         """
         Verifies the signature of a transaction input by converting the provided signature string to bytes, hashing the
         string representation of the transaction hash and output index, and attempting to verify the signature using the
-        provided public key and the hashed result. Returns True if the signature is valid, False otherwise.
+        provided public key and the hashed result. Returns True if the signature is valid, False otherwise. The result
+        is cached, so checking the same signature again is almost free.
         """
         # Convert the signature string back to bytes
         signature = base64.b64decode(signature_str.encode())
+        public_key_der = Signature.export_public_key(public_key)
+        return Transaction.verify_signatures([(public_key_der, f"{transaction_hash}:{output_index}", signature,
+                                               Signature.scheme_of(public_key))])[0]
 
-        h = SHA256.new(f"{transaction_hash}:{output_index}".encode())
-        try:
-            pkcs1_15.new(public_key).verify(h, signature)
-            return True
-        except (ValueError, TypeError):
+    @staticmethod
+    def verify_unlocking_script(unlocking_script, transaction_hash, output_index, locking_script):
+        """
+        Verifies that an unlocking script can spend the output with the given locking script. An output locked by a
+        standard [address, "OP_EQUAL"] script is spent by an unlocking script of the form
+        [signature, "transaction_hash:output_index", public_key, scheme] (scripts without a scheme are RSA scripts),
+        which must reference the spent output with a public key matching the address and a valid signature. For any
+        other locking script, the unlocking script then the locking script are run by the interpreter on the same
+        stack (see Script), they must both succeed and leave the stack empty. Returns True if the output can be
+        spent, False otherwise.
+        """
+        return Transaction.verify_unlocking_scripts([(unlocking_script, transaction_hash, output_index,
+                                                      locking_script)])[0]
+
+    @staticmethod
+    def verify_unlocking_scripts(scripts, threshold=64):
+        """
+        Verifies a batch of unlocking scripts like `verify_unlocking_script`. The signatures that are not in the cache
+        are checked on the process pool when there are at least `threshold` of them, the non-standard scripts are run
+        right away.
+
+        :param scripts: list: (unlocking_script, transaction_hash, output_index, locking_script) of each input.
+        :param threshold: int: The minimum number of signatures to check to use the process pool.
+        :return: list: Whether each input can spend its output.
+        """
+        signatures = [Transaction._parse_unlocking_script(*script) for script in scripts]
+        results = iter(Transaction.verify_signatures([signature for signature in signatures if signature is not None],
+                                                     threshold))
+        return [next(results) if signature is not None else Transaction._run_scripts(unlocking_script, locking_script)
+                for (unlocking_script, _, _, locking_script), signature in zip(scripts, signatures)]
+
+    @staticmethod
+    def _run_scripts(unlocking_script, locking_script):
+        """
+        Runs an unlocking script then the non-standard locking script of the output it spends on the same stack. The
+        items pushed by the unlocking script must all be consumed, so that an output locked by a script that checks
+        nothing, like [], is not spent by a signature left on the stack.
+
+        :return: bool: True if both scripts succeed and leave the stack empty, False otherwise.
+        """
+        if locking_script is None or Transaction._is_standard_locking_script(locking_script):
             return False
+        stack = []
+        return Script(unlocking_script).execute(stack) and Script(locking_script).execute(stack) and not stack
+
+    @staticmethod
+    def verify_signatures(signatures, threshold=64):
+        """
+        Verifies a batch of signatures. The results are kept in a bounded cache keyed by (public key, message,
+        signature), since the same input is checked when it enters the pool, when its block is received and when the
+        blockchain is synchronized. The signatures missing from the cache are checked on the process pool when there are
+        at least `threshold` of them.
+
+        :param signatures: list: (DER public key, message, signature, scheme) of each signature, the scheme defaults to
+        RSA when it is omitted.
+        :param threshold: int: The minimum number of signatures to check to use the process pool.
+        :return: list: Whether each signature is valid.
+        """
+        signatures = [tuple(signature) if len(signature) == 4 else (*signature, Signature.LEGACY)
+                      for signature in signatures]
+        cache = Transaction._signature_cache
+        results = []
+        with Transaction._signature_cache_lock:
+            for signature in signatures:
+                results.append(cache.get(signature))
+                if results[-1] is not None:
+                    cache.move_to_end(signature)
+        missing = list({signature for signature, result in zip(signatures, results) if result is None})
+        if not missing:
+            return results
+
+        checked = dict(zip(missing, Workers.map(_verify_signatures, missing, threshold=threshold)))
+        with Transaction._signature_cache_lock:
+            for signature, result in checked.items():
+                cache[signature] = result
+            while len(cache) > Transaction.signature_cache_size:
+                cache.popitem(last=False)
+        return [checked[signature] if result is None else result for signature, result in zip(signatures, results)]
+
+    @staticmethod
+    def _parse_unlocking_script(unlocking_script, transaction_hash, output_index, locking_script):
+        """
+        Extracts the signature to check from an unlocking script after checking that it references the spent output
+        and that its public key matches the address of the output. Only a standard locking script names the owner of
+        the output, a signature can't spend any other output, whichever key it was made with.
+
+        :return: tuple: (DER public key, message, signature, scheme), None if the script can't spend the output.
+        """
+        if not Transaction._is_standard_locking_script(locking_script) or \
+                not isinstance(unlocking_script, (list, tuple)) or len(unlocking_script) < 3:
+            return None
+        signature_str, outpoint, public_key_str = unlocking_script[:3]
+        scheme = unlocking_script[3] if len(unlocking_script) > 3 else Signature.LEGACY
+        if scheme not in Signature.SCHEMES:
+            return None
+        if outpoint != f"{transaction_hash}:{output_index}":
+            return None
+        try:
+            signature = base64.b64decode(signature_str.encode())
+            public_key_der = base64.b64decode(public_key_str.encode())
+        except (ValueError, TypeError, AttributeError):
+            return None
+        if hashlib.sha256(public_key_der).hexdigest() != locking_script[0]:
+            return None
+        return public_key_der, outpoint, signature, scheme
+
+    @staticmethod
+    def _verify_signature(public_key_der, message, signature, scheme=Signature.LEGACY):
+        """
+        Verifies a signature without using the cache.
+
+        :return: bool: True if the signature is valid, False otherwise.
+        """
+        return Signature.verify(scheme, public_key_der, message.encode(), signature)
+
+
+def _verify_signatures(signatures):
+    """
+    Verifies a chunk of signatures, meant to run on the process pool.
+
+    :param signatures: list: (DER public key, message, signature, scheme) of each signature.
+    :return: list: Whether each signature is valid.
+    """
+    return [Transaction._verify_signature(*signature) for signature in signatures]
@@ -0,0 +1,196 @@
+from Block import Block
+from Transaction import Transaction
+from Workers import Workers
+
+
+class Validator:
+    def __init__(self, difficulty, **options):
+        """
+        A class to validate the blocks and blockchains received from other nodes before they are adopted. The
+        CPU-bound checks (proof of work, Merkle roots, scripts and signatures) are fanned out to the shared process pool
+        when there is enough work to make it worthwhile.
+
+        :param difficulty: int: The number of leading zeros required in the hash of a block.
+        :param options: dict: include parallel_threshold, the minimum number of blocks or signatures to use the pool.
+        """
+        self.difficulty = difficulty
+        self.parallel_threshold = options.get("parallel_threshold", 64)
+
+    def validate_blockchain(self, serialized_blockchain):
+        """
+        Validates a whole blockchain, starting from the genesis block.
+
+        :param serialized_blockchain: list: The blocks as dictionaries, as they are sent over the network.
+        :return: tuple: (index, reason) of the first invalid block, None if the blockchain is valid.
+        """
+        results = Workers.map(_check_serialized_blocks, serialized_blockchain, self.difficulty,
+                              threshold=self.parallel_threshold)
+        summaries = []
+        for i, (data, (block_hash, tx_hashes, error)) in enumerate(zip(serialized_blockchain, results)):
+            if error is not None:
+                # The blocks after an invalid one are not checked
+                summaries.append((data.get("index", i) if isinstance(data, dict) else i, None, None, None, None, [],
+                                  error))
+                break
+            transactions = [(tx_hash, tx["inputs"], tx["outputs"]) for tx_hash, tx in
+                            zip(tx_hashes, data["merkle_tree"]["transactions"])]
+            summaries.append((data["index"], data["previous_hash"], data["timestamp"], data["nonce"], block_hash,
+                              transactions, error))
+        return self._validate(summaries, None, {})
+
+    def validate_block(self, block, previous_block, utxos, advertised_hash=None):
+        """
+        Validates a block that follows the given previous block.
+
+        :param block: Block: The block to validate.
+        :param previous_block: Block: The last block of the current blockchain, None if the blockchain is empty.
+        :param utxos: dict: The unspent transaction outputs of the current blockchain.
+        :param advertised_hash: str: The hash of the block announced by its sender, if any.
+        :return: tuple: (index, reason) if the block is invalid, None otherwise.
+        """
+        return self._validate([_summarize_block(block, self.difficulty, advertised_hash)], previous_block, utxos)
+
+    @staticmethod
+    def check_proof_of_work(block, difficulty):
+        """
+        Checks the proof of work of a block and that its nonce was not cheated.
+
+        :param block: Block: The block to check.
+        :param difficulty: int: The number of leading zeros required in the hash of the block.
+        :return: str: The reason why the block is invalid, None if it is valid.
+        """
+        # Validate the proof-of-work by checking if the block's hash starts with the required number of zeros
+        if not block.hash().startswith("0" * difficulty):
+            return "invalid proof of work"
+        # Validate that the block was not cheated
+        if not block.nonce >= block.timestamp:
+            return "nonce older than the timestamp"
+        return None
+
+    def _validate(self, summaries, previous_block, utxos):
+        """
+        Checks the linkage of the summarized blocks and the signatures of their inputs, then reports the first invalid
+        block.
+
+        :param summaries: list: (index, previous_hash, timestamp, nonce, hash, transactions, error) of each block.
+        :param previous_block: Block: The block preceding the first summarized block, None for a genesis block.
+        :param utxos: dict: The unspent transaction outputs before the first summarized block.
+        :return: tuple: (index, reason) of the first invalid block, None if all the blocks are valid.
+        """
+        previous = (previous_block.index, previous_block.hash(), previous_block.nonce) if previous_block else None
+        created = {}
+        spent = set()
+        jobs = []
+        first_error = None
+        for index, previous_hash, timestamp, nonce, block_hash, transactions, error in summaries:
+            if error is None:
+                error = self._check_link(index, previous_hash, timestamp, previous)
+            if error is None:
+                error = self._collect_signature_jobs(index, transactions, utxos, created, spent, jobs)
+            if error is not None:
+                first_error = (index, error)
+                break
+            previous = (index, block_hash, nonce)
+
+        # The signatures are checked last, an invalid one can only be in a block before the first structural error
+        results = Transaction.verify_unlocking_scripts([job[1:] for job in jobs], self.parallel_threshold)
+        for job, valid in zip(jobs, results):
+            if not valid:
+                return job[0], "invalid signature"
+        return first_error
+
+    @staticmethod
+    def _check_link(index, previous_hash, timestamp, previous):
+        """
+        Checks that a block follows the previous one.
+
+        :return: str: The reason why the block doesn't follow the previous one, None if it does.
+        """
+        if previous is None:
+            if index != 0 or previous_hash != "0" * 64:
+                return "invalid genesis block"
+            return None
+        previous_index, previous_block_hash, previous_nonce = previous
+        if index != previous_index + 1:
+            return "invalid index"
+        if previous_hash != previous_block_hash:
+            return "previous hash doesn't match"
+        # Check that this block was created AFTER the previous block was mined
+        if not previous_nonce < timestamp:
+            return "created before the previous block was mined"
+        return None
+
+    @staticmethod
+    def _collect_signature_jobs(index, transactions, utxos, created, spent, jobs):
+        """
+        Resolves the outputs spent by the inputs of a block and collects the signatures to check. The outputs created
+        by the block are added to `created` and the spent ones to `spent`.
+
+        :return: str: The reason why the block is invalid, None if all the spent outputs exist.
+        """
+        block_jobs = []
+        try:
+            block_outputs = {f"{tx_hash}:{i}": tx_output for tx_hash, _, outputs in transactions for i, tx_output in
+                             enumerate(outputs)}
+            for _, inputs, _ in transactions:
+                for tx_input in inputs:
+                    utxo_id = f"{tx_input['transaction_hash']}:{tx_input['output_index']}"
+                    if utxo_id in spent:
+                        return "double spend"
+                    tx_output = block_outputs.get(utxo_id) or created.get(utxo_id) or utxos.get(utxo_id)
+                    if tx_output is None:
+                        return "spends an unknown output"
+                    spent.add(utxo_id)
+                    block_jobs.append((index, tx_input["unlocking_script"], tx_input["transaction_hash"],
+                                       tx_input["output_index"], tx_output["locking_script"]))
+        except Exception:
+            # Malformed inputs or outputs, sent by a faulty or malicious peer
+            return "malformed transaction"
+        jobs.extend(block_jobs)
+        created.update(block_outputs)
+        return None
+
+
+def _summarize_block(block, difficulty, advertised_hash):
+    """
+    Checks the parts of a block that don't depend on the rest of the blockchain: proof of work, Merkle root and
+    structure of the transactions (see Transaction.execute), their scripts are run with the outputs they spend. The
+    header is checked first with the advertised Merkle root, so the Merkle tree of a block with an invalid proof of work
+    is never built. The tree is then built to check that the transactions match the root.
+
+    Any exception raised by a malformed block makes it invalid.
+
+    :return: tuple: (index, previous_hash, timestamp, nonce, hash, transactions, error).
+    """
+    try:
+        error = Validator.check_proof_of_work(block, difficulty)
+        if error is None and advertised_hash is not None and advertised_hash != block.hash():
+            error = "Merkle root doesn't match the block hash"
+        if error is None and not block.verify_merkle_root():
+            error = "Merkle root doesn't match the transactions"
+        if error is None and not all(tx.execute() for tx in block.transactions()):
+            error = "invalid transaction script"
+        transactions = [(tx.hash(), tx.inputs, tx.outputs) for tx in block.transactions()] if error is None else []
+        return block.index, block.previous_hash, block.timestamp, block.nonce, block.hash(), transactions, error
+    except Exception:
+        return block.index, block.previous_hash, block.timestamp, block.nonce, None, [], "malformed block"
+
+
+def _check_serialized_blocks(serialized_blocks, difficulty):
+    """
+    Builds and checks serialized blocks, meant to run on the process pool.
+
+    :return: list: (hash, transaction hashes, error) of each block.
+    """
+    results = []
+    for data in serialized_blocks:
+        try:
+            block = Block(data["index"], data["merkle_tree"]["transactions"], data["previous_hash"],
+                          nonce=data["nonce"], timestamp=data["timestamp"], merkle_root=data.get("merkle_root"))
+        except Exception:
+            results.append((None, [], "malformed block"))
+            continue
+        summary = _summarize_block(block, difficulty, data.get("h"))
+        results.append((summary[4], [tx[0] for tx in summary[5]], summary[6]))
+    return results
+
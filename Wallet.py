@@ -1,23 +1,85 @@
 import hashlib
 import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from Crypto.PublicKey import RSA
 from Node import Node
+from Block import Block
+from CoinSelection import CoinSelection
+from MerkleTree import MerkleTree
 from Transaction import Transaction
+from Validator import Validator
 
 
 class Wallet(Node):
     """
     A class that represents a cryptocurrency wallet, which is used to store and manage cryptocurrency balances and to
     send and receive transactions.
+
+    In light client mode, the wallet doesn't trust the miners blindly: it keeps the chain of the block headers, checks
+    their proof of work, and only accepts the transactions and UTXOs whose Merkle proof matches the Merkle root of one
+    of its headers (Simplified Payment Verification). A Merkle proof shows that a transaction is in a block, not that
+    its outputs are still unspent.
+
+    In subscription mode, the wallet doesn't request its UTXOs: the miners push the UTXOs created and spent for its
+    address each time a block is connected, and all of them when blocks are disconnected. The balance is kept up to date
+    as the changes arrive.
+
+    The methods ending with `_async` return a Future instead of blocking, so that many balance queries and payments can
+    be made at once. The UTXO requests carry a request id, each response only resolves the request it answers.
     """
     def __init__(self, **options):
         """
         Constructor method that initializes a new instance of the Wallet class with the given options.
+
+        :param options: dict: the options of Node, and light_client (False by default), the difficulty of the
+        blockchain (2 by default), used to check the proof of work of the headers in light client mode, the hashing of
+        the Merkle trees of the blockchain (MerkleTree.default_hashing by default), used to check the Merkle proofs, and
+        subscribe_utxos (False by default) to subscribe to the UTXOs of the wallet when it starts, and coin_selection,
+        the default strategy used to choose the UTXOs spent by the payments (see CoinSelection), and max_workers, the
+        number of threads running the asynchronous payments (8 by default).
         """
-        super().__init__(**options)
+        # The node is started once the wallet is fully initialized
+        super().__init__(**{**options, "autostart": False})
         self.utxos = {}
+        # Sum of the amounts of the UTXOs, updated with them
+        self.balance = 0
         self.utxos_condition = threading.Condition()
+        # Height of the blockchain of the last pushed UTXO changes applied, indexed by the subscribed address
+        self.utxos_heights = {}
+        # Future and timeout timer of each UTXO request waiting for its response, indexed by the request id
+        self.pending_requests = {}
+        self.requests_lock = threading.Lock()
+        self.max_workers = options.get("max_workers", 8)
+        self.executor = None
+        self.subscribe_utxos = options.get("subscribe_utxos", False)
+        self.coin_selection = options.get("coin_selection", CoinSelection.DEFAULT)
+        self.light_client = options.get("light_client", False)
+        self.difficulty = options.get("difficulty", 2)
+        # The hashing is a setting of the blockchain, a miner could choose the one that lets it forge a proof
+        self.hashing = options.get("hashing", MerkleTree.default_hashing)
+        # Chain of the block headers and of their hashes, in light client mode
+        self.headers = []
+        self.header_hashes = []
+        self.headers_condition = threading.Condition()
+        # Block index and content of the transactions whose Merkle proof was verified, indexed by their hash
+        self.confirmed_transactions = {}
+        self.proof_responses = 0
+        self.proofs_condition = threading.Condition()
+        if options.get("autostart", True):
+            self.start()
+
+    def start(self):
+        """
+        Starts the node, and subscribes to the UTXOs of the wallet in subscription mode.
+
+        :return: Wallet: the Wallet object
+        """
+        super().start()
+        if self.subscribe_utxos:
+            self.subscribe()
+        return self
 
     def _handle_incoming_data(self, payload, addr):
         """
@@ -29,88 +91,397 @@ class Wallet(Node):
     def _handle_incoming_utxos_response(self, payload, addr):
         """
         A method that is called when a response to a request for unspent transaction outputs (UTXOs) is received from
-        a Miner.
+        a Miner. The response resolves the request with the same id, the responses of the other miners to the same
+        request are ignored. The responses without a request id, from older miners, replace the UTXOs of the wallet.
+        """
+        data = payload.get("data")
+        if "request_id" not in data or "utxos" not in data:
+            with self.utxos_condition:
+                self._set_utxos(data)
+                self.utxos_condition.notify_all()
+            return
+        with self.requests_lock:
+            future, timer = self.pending_requests.pop(data["request_id"], (None, None))
+        if future is None:
+            return
+        if timer is not None:
+            timer.cancel()
+        if not future.cancelled():
+            future.set_result(data["utxos"])
+
+    def _expire_request(self, request_id):
+        """
+        Fails a UTXO request that didn't get a response in time.
+        """
+        with self.requests_lock:
+            future, _ = self.pending_requests.pop(request_id, (None, None))
+        if future is not None and not future.cancelled():
+            future.set_exception(TimeoutError(f"No response to the UTXO request {request_id}"))
+
+    def _handle_incoming_utxos_delta(self, payload, addr):
+        """
+        A method that is called when a Miner pushes the changes of the UTXOs of the wallet. The changes of a block are
+        only applied on top of those of the previous block: the changes and the snapshots of a height already applied,
+        sent again or by a lagging miner, are ignored, and all the UTXOs are requested again when changes are missing.
+        Like the UTXO responses, they are not checked with Merkle proofs in light client mode, refresh_balance does it.
         """
+        data = payload.get("data")
+        address = data.get("address")
+        if address != self.address:
+            return
+        height = data.get("height")
         with self.utxos_condition:
-            self.utxos = payload.get("data")
-            self.utxos_condition.notify()
+            last_height = self.utxos_heights.get(address)
+            if data.get("reset"):
+                # A snapshot of the same height replaces the UTXOs after blocks are disconnected
+                if last_height is not None and height < last_height:
+                    return
+                self._set_utxos(data.get("created"))
+            else:
+                # The changes can't be applied before the first snapshot, which the miners send first
+                if last_height is None or height <= last_height:
+                    return
+                missing = height > last_height + 1
+                if not missing:
+                    for utxo_id in data.get("spent"):
+                        self._remove_utxo(utxo_id)
+                    for utxo_id, utxo in data.get("created").items():
+                        self._add_utxo(utxo_id, utxo)
+            if data.get("reset") or not missing:
+                self.utxos_heights[address] = height
+                self.utxos_condition.notify_all()
+                return
+        # The miners push all the UTXOs again to a wallet that subscribes again
+        self._send(address, "utxos_subscribe")
+
+    def subscribe(self):
+        """
+        A method that subscribes the wallet to the changes of its UTXOs, see the subscription mode.
+        """
+        self.subscribe_utxos = True
+        self._send(self.address, "utxos_subscribe")
+
+    def _set_utxos(self, utxos):
+        """
+        Replaces the UTXOs of the wallet and recomputes its balance. The UTXOs condition must be held.
+        """
+        self.utxos = utxos
+        self.balance = sum(utxo["amount"] for utxo in utxos.values())
+
+    def _add_utxo(self, utxo_id, utxo):
+        """
+        Adds a UTXO to the wallet if it doesn't have it yet. The UTXOs condition must be held.
+        """
+        if utxo_id not in self.utxos:
+            self.utxos[utxo_id] = utxo
+            self.balance += utxo["amount"]
+
+    def _remove_utxo(self, utxo_id):
+        """
+        Removes a UTXO from the wallet if it has it. The UTXOs condition must be held.
+        """
+        utxo = self.utxos.pop(utxo_id, None)
+        if utxo is not None:
+            self.balance -= utxo["amount"]
+
+    def _handle_incoming_mined_block(self, payload, addr):
+        """
+        In light client mode, appends the header of a mined block to the chain of headers. The missing headers are
+        requested from the miner when the block doesn't follow the last known header.
+        """
+        if not self.light_client:
+            return
+        data = payload.get("data")
+        header = {key: data.get(key) for key in ("index", "previous_hash", "merkle_root", "nonce", "timestamp")}
+        with self.headers_condition:
+            if header["index"] < len(self.headers) - 1 or self._connect_headers([header], header["index"]):
+                self.headers_condition.notify_all()
+                return
+        self._send(min(header["index"], len(self.headers)), "headers_request", receiver=tuple(payload.get("sender")))
+
+    def _handle_incoming_headers_response(self, payload, addr):
+        """
+        A method that is called when a Miner sends block headers. They replace the headers of the wallet from the same
+        height if they form a valid and longer chain. All the headers are requested again when they fork before that
+        height.
+        """
+        data = payload.get("data")
+        with self.headers_condition:
+            connected = self._connect_headers(data.get("headers"), data.get("start"))
+            self.headers_condition.notify_all()
+        if connected is None:
+            self._send(0, "headers_request", receiver=tuple(payload.get("sender")))
+
+    def _connect_headers(self, headers, start):
+        """
+        Replaces the headers from the start height with the given ones if they are valid, follow the header before the
+        start height and make the chain longer. The headers condition must be held.
+
+        :param headers: list: The headers, see Block.header.
+        :param start: int: The height of the first header.
+        :return: bool: True if the headers were connected, False if they are invalid or don't make the chain longer,
+        None if they don't follow the header before the start height.
+        """
+        if not headers or start > len(self.headers) or start + len(headers) <= len(self.headers):
+            return False
+        previous = (start - 1, self.header_hashes[start - 1], self.headers[start - 1]["nonce"]) if start > 0 else None
+        header_hashes = []
+        for header in headers:
+            header_hash = Block.header_hash(header)
+            error = Validator._check_link(header["index"], header["previous_hash"], header["timestamp"], previous)
+            if error is not None or not header_hash.startswith("0" * self.difficulty) or \
+                    not header["nonce"] >= header["timestamp"]:
+                return None if error is not None and not header_hashes else False
+            header_hashes.append(header_hash)
+            previous = (header["index"], header_hash, header["nonce"])
+        # The transactions of the replaced headers may no longer be in the blockchain
+        for tx_hash, (block_index, _) in list(self.confirmed_transactions.items()):
+            if block_index >= start:
+                del self.confirmed_transactions[tx_hash]
+        self.headers[start:] = headers
+        self.header_hashes[start:] = header_hashes
+        return True
+
+    def sync_headers(self, timeout=5):
+        """
+        A method that requests the headers of the blocks the wallet doesn't have yet, and waits for them.
+
+        :param timeout: float: The maximum number of seconds to wait for the headers.
+        :return: int: The number of known headers.
+        """
+        with self.headers_condition:
+            self._send(len(self.headers), "headers_request")
+            self.headers_condition.wait(timeout)
+            return len(self.headers)
+
+    def _handle_incoming_merkle_proof_response(self, payload, addr):
+        """
+        A method that is called when a Miner sends the Merkle proofs of transactions. A transaction is confirmed when
+        its proof leads to the Merkle root of the header of its block.
+        """
+        with self.proofs_condition:
+            for item in payload.get("data") or []:
+                tx = Transaction(item["transaction"])
+                tx_hash = tx.hash()
+                with self.headers_condition:
+                    block_index = item["block_index"]
+                    if not 0 <= block_index < len(self.headers):
+                        continue
+                    merkle_root = self.headers[block_index]["merkle_root"]
+                    if MerkleTree.get_proof_root(tx_hash, item["proof"], self.hashing) == merkle_root:
+                        self.confirmed_transactions[tx_hash] = (block_index, tx)
+            self.proof_responses += 1
+            self.proofs_condition.notify_all()
+
+    def confirm_transactions(self, tx_hashes, timeout=5):
+        """
+        A method that requests the Merkle proofs of transactions and waits until they are all confirmed, or until the
+        first response if some of them are not. The headers must be synchronized, see `sync_headers`.
+
+        :param tx_hashes: list: The hashes of the transactions.
+        :param timeout: float: The maximum number of seconds to wait for the proofs.
+        :return: dict: The index of the block of each confirmed transaction, indexed by the hash of the transaction.
+        """
+        with self.proofs_condition:
+            missing = [tx_hash for tx_hash in tx_hashes if tx_hash not in self.confirmed_transactions]
+            if missing:
+                responses = self.proof_responses
+                self._send(missing, "merkle_proof_request")
+                self.proofs_condition.wait_for(lambda: self.proof_responses > responses or all(
+                    tx_hash in self.confirmed_transactions for tx_hash in missing), timeout)
+            return {tx_hash: self.confirmed_transactions[tx_hash][0] for tx_hash in tx_hashes
+                    if tx_hash in self.confirmed_transactions}
+
+    def confirm_transaction(self, tx_hash, timeout=5):
+        """
+        A method that checks with a Merkle proof that a transaction is in the blockchain, see `confirm_transactions`.
+
+        :param tx_hash: str: The hash of the transaction.
+        :param timeout: float: The maximum number of seconds to wait for the proof.
+        :return: int: The index of the block of the transaction, None if it couldn't be confirmed.
+        """
+        return self.confirm_transactions([tx_hash], timeout).get(tx_hash)
+
+    def _verify_utxos(self, utxos, timeout=5):
+        """
+        Keeps the UTXOs created by confirmed transactions, whose output matches the one sent by the Miner.
 
-    def _request_utxos(self):
+        :param utxos: dict: The UTXOs received from a Miner.
+        :param timeout: float: The maximum number of seconds to wait for the proofs.
+        :return: dict: The verified UTXOs.
+        """
+        self.confirm_transactions({utxo_id.split(':')[0] for utxo_id in utxos}, timeout)
+        verified_utxos = {}
+        for utxo_id, utxo in utxos.items():
+            tx_hash, output_index = utxo_id.split(':')[0], int(utxo_id.split(':')[1])
+            if tx_hash not in self.confirmed_transactions:
+                continue
+            outputs = self.confirmed_transactions[tx_hash][1].outputs
+            if output_index < len(outputs) and outputs[output_index] == utxo:
+                verified_utxos[utxo_id] = utxo
+        return verified_utxos
+
+    def _request_utxos(self, timeout=10):
         """
         A method that sends a request to the network for the wallet's UTXOs.
+
+        :param timeout: float: The number of seconds after which the request fails, None to wait forever.
+        :return: Future: The UTXOs of the first response, or a TimeoutError.
         """
-        self._send(self.address, 'utxos_request')
+        request_id = uuid.uuid4().hex
+        future = Future()
+        timer = threading.Timer(timeout, self._expire_request, (request_id,)) if timeout is not None else None
+        with self.requests_lock:
+            self.pending_requests[request_id] = (future, timer)
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        self._send({"address": self.address, "request_id": request_id}, 'utxos_request')
+        return future
 
-    def refresh_balance(self):
+    def refresh_balance_async(self, timeout=10):
         """
-        A method that updates the wallet's balance by requesting and waiting for the UTXOs from the network.
+        A method that requests the UTXOs of the wallet from the network and updates its balance when they arrive,
+        without waiting for them. In light client mode, the headers are synchronized and only the UTXOs of confirmed
+        transactions are kept.
+
+        :param timeout: float: The maximum number of seconds to wait for the UTXOs, None to wait forever.
+        :return: Future: The balance of the wallet, or a TimeoutError.
         """
-        with self.utxos_condition:
-            self._request_utxos()
-            self.utxos_condition.wait()
+        future = Future()
+
+        def update_balance(utxos_future):
+            try:
+                utxos = utxos_future.result()
+                if self.light_client:
+                    self.sync_headers()
+                    utxos = self._verify_utxos(utxos)
+                with self.utxos_condition:
+                    self._set_utxos(utxos)
+                    self.utxos_condition.notify_all()
+                    balance = self.balance
+            except Exception as e:
+                future.set_exception(e)
+                return
+            future.set_result(balance)
+
+        self._request_utxos(timeout).add_done_callback(update_balance)
+        return future
+
+    def refresh_balance(self, timeout=10):
+        """
+        A method that updates the wallet's balance by requesting and waiting for the UTXOs from the network. In light
+        client mode, the headers are synchronized and only the UTXOs of confirmed transactions are kept. In
+        subscription mode, the balance is already up to date, this only resynchronizes it.
+
+        :param timeout: float: The maximum number of seconds to wait for the UTXOs, None to wait forever.
+        :return: bool: True if the UTXOs were received, False if the request timed out.
+        """
+        try:
+            self.refresh_balance_async(timeout).result()
+        except TimeoutError:
+            return False
+        return True
 
     def get_balance(self):
         """
-        A method that calculates and returns the total balance of the wallet based on the UTXOs currently held.
+        A method that returns the total balance of the wallet based on the UTXOs currently held, without going through
+        them: the balance is updated with the UTXOs.
         """
-        total_input_value = 0
-        for utxo_id, utxo in self.utxos.items():
-            total_input_value += utxo["amount"]
-        return total_input_value
+        return self.balance
 
-    def send_crypto(self, receiver_address, amount):
+    def send_crypto(self, receiver_address, amount, coin_selection=None):
         """
         A method that sends a cryptocurrency transaction from the wallet to a specified receiver address. It selects the
-        necessary UTXOs to cover the transaction amount, generates the inputs and outputs for the transaction, signs the
-        transaction using the wallet's private key, creates and sends the transaction to the network, and updates the
-        utxos dictionary of the wallet with any new UTXOs that were created as change outputs. If the wallet has
-        insufficient balance, the method returns None. It returns the created transaction on success.
-        """
-        inputs = []
-        outputs = []
-        total_input_value = 0
-        utxos_to_remove = []
-        utxos_to_add = []
-
-        for utxo_id, utxo in self.utxos.items():
-            inputs.append({"transaction_hash": utxo_id.split(':')[0], "output_index": int(utxo_id.split(':')[1]),
-                           "unlocking_script": None})
-            total_input_value += utxo["amount"]
-            utxos_to_remove.append(utxo_id)  # Add the used utxo_id to the used_utxos list
-
-            if total_input_value >= amount:
-                break
-
-        # Check if the wallet has enough balance
-        if total_input_value < amount:
-            Node.print(f"Node {self.node_name} has insufficient balance.")
+        necessary UTXOs to cover the transaction amount with the coin selection strategy (the one of the wallet by
+        default), generates the inputs and outputs for the transaction, signs the transaction using the wallet's private
+        key, creates and sends the transaction to the network, and updates the utxos dictionary of the wallet with any
+        new UTXOs that were created as change outputs. If the wallet has insufficient balance, the method returns None.
+        It returns the created transaction on success.
+        """
+        tx = self._create_payment(receiver_address, amount, coin_selection)
+        if tx is None:
             return
+        self._send(tx.as_dict(), "transaction")
+        Node.print(f"Node {self.node_name} sent a transaction : {tx.as_dict()}")
+        return tx
 
-        # Create outputs
-        outputs.append({"amount": amount, "locking_script": self.generate_locking_script(receiver_address)})
+    def send_crypto_async(self, receiver_address, amount, coin_selection=None):
+        """
+        A method that sends a payment like `send_crypto`, on the threads of the wallet, without waiting for it.
 
-        # If there's change, add another output for the change
-        change = total_input_value - amount
-        if change > 0:
-            change_utxo = {"amount": change, "locking_script": self.generate_locking_script(self.address)}
-            outputs.append(change_utxo)
-            utxos_to_add.append(change_utxo)
+        :return: Future: The created transaction, None if the wallet has insufficient balance.
+        """
+        if self.executor is None:
+            with self.requests_lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                       thread_name_prefix=f"{self.node_name}")
+        return self.executor.submit(self.send_crypto, receiver_address, amount, coin_selection)
 
-        # Sign the inputs using the wallet's private key
-        for tx_input in inputs:
-            signature = Transaction.sign_transaction_input(self.private_key, tx_input['transaction_hash'],
-                                                           tx_input['output_index'])
-            tx_input['unlocking_script'] = self.generate_unlocking_script(tx_input['transaction_hash'],
-                                                                          tx_input['output_index'], signature)
+    def send_crypto_many(self, payments):
+        """
+        A method that sends several payments at once. One transaction is created and signed per payment like in
+        `send_crypto`, and the transactions are sent together in batches. A payment may spend the change of a previous
+        one. The payments that exceed the balance are skipped.
 
-        # Create and send the transaction
-        tx = self.create_transaction(inputs, outputs)
+        :param payments: list: (receiver_address, amount) tuples.
+        :return: list: The created transactions, None for the skipped payments.
+        """
+        transactions = [self._create_payment(receiver_address, amount) for receiver_address, amount in payments]
+        self.send_transactions([tx for tx in transactions if tx is not None])
+        return transactions
 
-        # Remove used UTXOs from the wallet's utxos dictionary
-        for utxo_id in utxos_to_remove:
-            del self.utxos[utxo_id]
+    def _create_payment(self, receiver_address, amount, coin_selection=None):
+        """
+        Creates and signs a transaction paying the amount to the receiver address, without sending it, and updates the
+        utxos dictionary of the wallet: the spent UTXOs are removed and the change output is added.
 
-        for utxo in utxos_to_add:
-            self.utxos[f"{tx.hash()}:1"] = utxo
+        :return: Transaction: The created transaction, None if the wallet has insufficient balance.
+        """
+        with self.utxos_condition:
+            inputs = []
+            outputs = []
+            utxos_to_add = []
 
-        return tx
+            # Check if the wallet has enough balance
+            utxos_to_remove = CoinSelection.select(self.utxos, amount, coin_selection or self.coin_selection)
+            if utxos_to_remove is None:
+                Node.print(f"Node {self.node_name} has insufficient balance.")
+                return
+
+            total_input_value = 0
+            for utxo_id in utxos_to_remove:
+                inputs.append({"transaction_hash": utxo_id.split(':')[0], "output_index": int(utxo_id.split(':')[1]),
+                               "unlocking_script": None})
+                total_input_value += self.utxos[utxo_id]["amount"]
+
+            # Create outputs
+            outputs.append({"amount": amount, "locking_script": self.generate_locking_script(receiver_address)})
+
+            # If there's change, add another output for the change
+            change = total_input_value - amount
+            if change > 0:
+                change_utxo = {"amount": change, "locking_script": self.generate_locking_script(self.address)}
+                outputs.append(change_utxo)
+                utxos_to_add.append(change_utxo)
+
+            # Sign the inputs using the wallet's private key
+            for tx_input in inputs:
+                signature = Transaction.sign_transaction_input(self.private_key, tx_input['transaction_hash'],
+                                                               tx_input['output_index'])
+                tx_input['unlocking_script'] = self.generate_unlocking_script(tx_input['transaction_hash'],
+                                                                              tx_input['output_index'], signature,
+                                                                              self.public_key)
+
+            # Create the transaction
+            tx = Transaction({'inputs': inputs, 'outputs': outputs})
+
+            # Remove used UTXOs from the wallet's utxos dictionary
+            for utxo_id in utxos_to_remove:
+                self._remove_utxo(utxo_id)
+
+            for utxo in utxos_to_add:
+                self._add_utxo(f"{tx.hash()}:1", utxo)
+
+            return tx
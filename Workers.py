@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+class Workers:
+    """
+    A process pool shared by the CPU-bound parts of the nodes (block validation, signature checks...). The pool is only
+    started the first time it is needed, and one worker is used per core. The workers never use the pool themselves:
+    a forked worker inherits a copy of the pool of its parent which would never answer.
+    """
+    _executor = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def count():
+        """
+        Returns the number of workers of the pool, which is the number of cores of the machine.
+
+        :return: int: The number of workers.
+        """
+        return os.cpu_count() or 1
+
+    @staticmethod
+    def in_worker():
+        """
+        Checks if the current process is a worker of the pool, or any other child process.
+
+        :return: bool: True in a child process, False in the main process.
+        """
+        return multiprocessing.parent_process() is not None
+
+    @staticmethod
+    def _reset():
+        """
+        Forgets the pool of the parent process in a forked child.
+        """
+        Workers._executor = None
+        Workers._lock = threading.Lock()
+
+    @staticmethod
+    def executor():
+        """
+        Returns the shared process pool, starting it if needed.
+
+        :return: ProcessPoolExecutor: The process pool.
+        """
+        with Workers._lock:
+            if Workers._executor is None:
+                Workers._executor = ProcessPoolExecutor(max_workers=Workers.count())
+            return Workers._executor
+
+    @staticmethod
+    def chunks(items, n):
+        """
+        Splits a list into n contiguous chunks of similar sizes.
+
+        :param items: list: The items to split.
+        :param n: int: The number of chunks.
+        :return: list: The non-empty chunks, in order.
+        """
+        size = -(-len(items) // max(n, 1))
+        return [items[i:i + size] for i in range(0, len(items), size)] if size else []
+
+    @staticmethod
+    def map(fn, items, *args, threshold=0):
+        """
+        Applies fn(chunk, *args) to contiguous chunks of items on the process pool and concatenates the results in
+        order. fn must be a module level function returning a list with one result per item. The work is done in the
+        current process when there are fewer items than the threshold, when there is only one core, or when called from
+        a worker.
+
+        :param fn: function: The function to apply on each chunk.
+        :param items: list: The items to process.
+        :param args: Additional arguments passed to fn.
+        :param threshold: int: The minimum number of items to use the pool.
+        :return: list: The results, one per item.
+        """
+        if len(items) < max(threshold, 1) or Workers.count() == 1 or Workers.in_worker():
+            return fn(items, *args)
+        # A few chunks per worker, so that a slow chunk doesn't leave the other cores idle
+        futures = [Workers.executor().submit(fn, chunk, *args) for chunk in Workers.chunks(items, 4 * Workers.count())]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Workers._reset)
@@ -1,6 +1,9 @@
 import time
 import random
 import hashlib
+import os
+import tempfile
+import threading
 
 from Miner import Miner
 from Node import Node
@@ -9,6 +12,14 @@ from Transaction import Transaction
 from Script import Script
 from MerkleTree import MerkleTree
 from Wallet import Wallet
+from Mempool import Mempool
+from Signature import Signature
+from Keystore import Keystore
+from CoinSelection import CoinSelection
+from Validator import Validator
+from Workers import Workers
+from Encoding import Encoding
+from tests.helpers import mine_block
 
 logging_level = 1
 
@@ -286,11 +297,837 @@ def test_exercise_5():
     print(f"\n{'-'*20}")
 
 
+def test_mempool():
+    print("Starting Mempool tests :")
+    print("Here we test that the pool rejects double spends and stays within its limits.")
+
+    def make_transaction(spent_outputs, timestamp=0):
+        return Transaction({
+            'inputs': [{'transaction_hash': h, 'output_index': i, 'unlocking_script': []} for h, i in spent_outputs],
+            'outputs': [{'amount': 1, 'locking_script': Node.generate_locking_script("address")}],
+            'timestamp': timestamp,
+        })
+
+    # Two transactions can't spend the same output
+    pool = Mempool()
+    tx_1 = make_transaction([("a", 0)])
+    assert pool.add(tx_1)
+    assert not pool.add(make_transaction([("a", 0)], timestamp=1))
+    assert pool.spender("a:0") == tx_1.hash()
+
+    # A block spending the same output evicts the transaction and its descendants
+    tx_2 = make_transaction([(tx_1.hash(), 0)])
+    assert pool.add(tx_2)
+    assert len(pool.remove_conflicts([make_transaction([("a", 0)], timestamp=2)])) == 2
+    assert len(pool) == 0
+
+    # When the pool is full, the lowest fee rate is evicted first
+    pool = Mempool(max_count=2)
+    assert pool.add(make_transaction([("b", 0)]), fee=10)
+    assert pool.add(make_transaction([("c", 0)]), fee=1)
+    assert not pool.add(make_transaction([("d", 0)]), fee=1)
+    assert pool.add(make_transaction([("d", 0)]), fee=5)
+    assert pool.spender("c:0") is None and len(pool) == 2
+    assert pool.stats["evicted"] == 1 and pool.stats["rejected"] == 1
+
+    # Old transactions expire
+    pool.expire(time.time() + pool.expiry)
+    assert len(pool) == 0 and pool.stats["expired"] == 2
+
+    # The miners only pool the transactions whose inputs cover their outputs
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level)
+    miner.utxos = {f"{'00' * 32}:0": {'amount': 10, 'locking_script': miner.generate_locking_script(miner.address)}}
+
+    def spend(transaction_hash, amount, timestamp=0, private_key=None):
+        signature = Transaction.sign_transaction_input(private_key or miner.private_key, transaction_hash, 0)
+        unlocking_script = miner.generate_unlocking_script(transaction_hash, 0, signature, miner.public_key)
+        return Transaction({
+            'inputs': [{'transaction_hash': transaction_hash, 'output_index': 0, 'unlocking_script': unlocking_script}],
+            'outputs': [{'amount': amount, 'locking_script': miner.generate_locking_script(miner.address)}],
+            'timestamp': timestamp,
+        })
+
+    miner._add_transactions([spend("00" * 32, 11)])
+    assert len(miner.transaction_pool) == 0
+    tx_1 = spend("00" * 32, 9)
+    miner._add_transactions([tx_1, spend(tx_1.hash(), 10)])
+    assert list(miner.transaction_pool) == [tx_1]
+
+    # The pool received along with a blockchain goes through the same checks
+    coinbase = Transaction({'inputs': [], 'outputs': [{'amount': 10, 'locking_script': miner.generate_locking_script(
+        miner.address)}], 'timestamp': 0})
+    block = Block(0, [coinbase], "0" * 64)
+    block.nonce = block.timestamp
+    while not block.hash().startswith("0" * miner.difficulty):
+        block.nonce += 1
+    forged = spend(coinbase.hash(), 10, private_key=Node.generate_key_pair()[0])
+    miner._handle_incoming_blockchain_update({"data": ([block.as_dict()], [forged.as_dict(), spend(
+        coinbase.hash(), 11, timestamp=1).as_dict()]), "sender_name": "Peer"}, None)
+    assert miner.blockchain == [block] and len(miner.transaction_pool) == 0
+    tx_2 = spend(coinbase.hash(), 10)
+    miner._handle_incoming_blockchain_update({"data": ([block.as_dict()], [tx_2.as_dict()]), "sender_name": "Peer"},
+                                             None)
+    assert list(miner.transaction_pool) == [tx_2]
+
+    # A malformed transaction is skipped without dropping the rest of its batch
+    tx_3 = spend(tx_2.hash(), 10)
+    malformed = [None, {'inputs': [{'output_index': 0}], 'outputs': [], 'timestamp': 0}, {'inputs': 0}]
+    miner._handle_incoming_transactions({"data": malformed + [tx_3.as_dict()], "sender_name": "Peer"}, None)
+    assert list(miner.transaction_pool) == [tx_2, tx_3]
+
+    # Nor can an output locked by a non-standard script be spent with a signature of any key
+    miner.utxos[f"{'11' * 32}:0"] = {'amount': 10, 'locking_script': ["OP_HASH160", hashlib.sha256(
+        "secret".encode()).hexdigest(), "OP_EQUALVERIFY"]}
+    forged = spend("11" * 32, 10)
+    miner._add_transactions([forged])
+    assert forged not in miner.transaction_pool
+    # The holder of the secret spends it through the interpreter
+    secret_input = {'transaction_hash': "11" * 32, 'output_index': 0, 'unlocking_script': ["secret"]}
+    secret_spend = Transaction({'inputs': [secret_input], 'outputs': [
+        {'amount': 9, 'locking_script': miner.generate_locking_script(miner.address)}]})
+    miner._add_transactions([secret_spend])
+    assert secret_spend in miner.transaction_pool
+
+    # The batches are cut before their message exceeds the size that the receiving nodes read
+    sender = Node(node_name="Sender", autostart=False, max_recv_size=16 * 1024)
+    sender.known_nodes = {("localhost", 0)}
+    payloads = []
+    sender._connect_and_send = lambda node, payload: payloads.append(payload)
+    sender._disconnect = lambda: sender
+    large_input = {'transaction_hash': "22" * 32, 'output_index': 0, 'unlocking_script': ["x" * 700]}
+    large_transactions = [Transaction({'inputs': [dict(large_input, output_index=i)], 'outputs': [], 'timestamp': 0})
+                          for i in range(100)]
+    sender.send_transactions(large_transactions)
+    assert len(payloads) > 100 * 800 // (16 * 1024) and all(len(payload) <= 16 * 1024 for payload in payloads)
+    assert [tx for payload in payloads for tx in Encoding.decode(payload)["data"]] == large_transactions
+    # And after max_batch_size transactions
+    sender.max_batch_size = 15
+    payloads.clear()
+    sender.send_transactions(large_transactions[:20])
+    assert [len(Encoding.decode(payload)["data"]) for payload in payloads] == [15, 5]
+
+    print("Passed Mempool tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_signature_schemes():
+    print("Starting signature scheme tests :")
+    print("Here we test that the inputs signed with each signature scheme can be spent.")
+
+    # Every scheme signs inputs that can be spent with its public key, a legacy RSA script has no scheme
+    for scheme in Signature.SCHEMES:
+        private_key, public_key = Node.generate_key_pair(scheme)
+        locking_script = Node.generate_locking_script(Node.generate_address(public_key))
+        signature = Transaction.sign_transaction_input(private_key, "a", 0)
+        unlocking_script = Node.generate_unlocking_script("a", 0, signature, public_key)
+        assert unlocking_script[3] == scheme
+        assert Transaction.verify_transaction_signature(public_key, "a", 0, unlocking_script[0])
+        assert Transaction.verify_unlocking_script(unlocking_script, "a", 0, locking_script)
+        assert not Transaction.verify_unlocking_script(unlocking_script, "a", 1, locking_script)
+        if scheme == "rsa":
+            assert Transaction.verify_unlocking_script(unlocking_script[:3], "a", 0, locking_script)
+        # The signature can't be checked with another scheme than the one of the key
+        for other_scheme in Signature.SCHEMES:
+            if other_scheme != scheme:
+                assert not Transaction.verify_unlocking_script(unlocking_script[:3] + [other_scheme], "a", 0,
+                                                               locking_script)
+
+    # The standard pay-to-address scripts skip the interpreter, their address and signature are checked against the
+    # outputs they spend by verify_unlocking_scripts
+    private_key, public_key = Node.generate_key_pair()
+    locking_script = Node.generate_locking_script(Node.generate_address(public_key))
+    signature = Transaction.sign_transaction_input(private_key, "a", 0)
+    unlocking_script = Node.generate_unlocking_script("a", 0, signature, public_key)
+    tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': unlocking_script}],
+                      'outputs': [{'amount': 1, 'locking_script': locking_script}]})
+    assert Transaction.is_standard(unlocking_script, locking_script) and tx.execute()
+    assert Transaction.verify_unlocking_scripts([(unlocking_script, "a", 0, locking_script), (
+        unlocking_script, "a", 0, Node.generate_locking_script("other address"))]) == [True, False]
+    # A signature can only spend an output locked to the address of its key, never a non-standard output
+    digest = hashlib.sha256("secret".encode()).hexdigest()
+    assert not Transaction.verify_unlocking_script(unlocking_script, "a", 0, ["OP_HASH160", digest, "OP_EQUALVERIFY"])
+    assert not Transaction.verify_unlocking_script(unlocking_script, "a", 0, [])
+    # The other locking scripts are run by the interpreter after the unlocking script, which must leave nothing behind
+    for unlocking_script, valid in ((["secret"], True), (["other"], False), (["secret", "secret"], False)):
+        assert Transaction.verify_unlocking_scripts([(unlocking_script, "a", 0, ["OP_HASH160", digest,
+                                                                                 "OP_EQUALVERIFY"])]) == [valid]
+    assert Transaction.verify_unlocking_script([], "a", 0, [])
+    assert not Transaction.verify_unlocking_script([], "a", 0, None)
+    # Executing a transaction only checks its structure, its inputs are checked against the outputs they spend
+    tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': ["other"]}],
+                      'outputs': [{'amount': 1, 'locking_script': ["OP_HASH160", digest, "OP_EQUALVERIFY"]}]})
+    assert tx.execute()
+
+    print("Passed signature scheme tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_keystore():
+    print("Starting keystore tests :")
+    print("Here we test that the nodes start without generating keys and keep their address across restarts.")
+
+    # A node created without starting it has no socket, its keys are only loaded when needed
+    with tempfile.TemporaryDirectory() as path:
+        keystore = Keystore(path).fill(2)
+        node = Node(node_name="Keystore node", keystore=keystore, autostart=False)
+        assert node.incoming_socket is None and node._key_pair is None
+        address = node.address
+        assert len(keystore.pool[Signature.DEFAULT]) == 1
+
+        # A node restarted with the same keystore keeps its address
+        restarted_node = Node(node_name="Keystore node", keystore=Keystore(path), autostart=False)
+        assert restarted_node.address == address
+        assert Node(node_name="Other node", keystore=keystore, autostart=False).address != address
+        assert len(keystore.pool[Signature.DEFAULT]) == 0
+
+        # RSA keys are saved and loaded too
+        rsa_node = Node(node_name="RSA node", keystore=keystore, signature_scheme="rsa", autostart=False)
+        assert Node(node_name="RSA node", keystore=Keystore(path), autostart=False).address == rsa_node.address
+
+        # The nodes without a name or a fixed port get their own key, which isn't saved
+        unnamed_nodes = [Node(keystore=keystore, autostart=False) for _ in range(2)]
+        assert unnamed_nodes[0].address != unnamed_nodes[1].address
+        assert sorted(os.listdir(path)) == ["Keystore_node.pem", "Other_node.pem", "RSA_node.pem"]
+        assert Node(port=5000, keystore=keystore, autostart=False).key_name == str(("127.0.0.1", 5000))
+
+    print("Passed keystore tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_script():
+    print("Starting script tests :")
+    print("Here we test that the compiled scripts are cached and behave like the original opcodes.")
+
+    # The compiled scripts behave like the opcodes they are compiled from
+    digest = hashlib.sha256("data".encode()).hexdigest()
+    assert Script(["data", "OP_DUP", "OP_HASH160", digest, "OP_EQUALVERIFY"]).execute([])
+    assert not Script(["other", "OP_HASH160", digest, "OP_EQUALVERIFY"]).execute([])
+    stack = []
+    assert Script(["address", "OP_EQUAL"]).execute(stack) and stack == ["address", "OP_EQUAL"]
+
+    # A script is only compiled once
+    hits = Script.cache_info().hits
+    assert Script.compile(["data", "OP_HASH160"]) is Script.compile(("data", "OP_HASH160"))
+    assert Script.cache_info().hits == hits + 1
+
+    # The cost of a transaction is known before running its scripts, and bounded
+    digest = hashlib.sha256("secret".encode()).hexdigest()
+    hash_lock = {'amount': 1, 'locking_script': ["OP_HASH160", digest, "OP_EQUALVERIFY"]}
+    tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': ["secret"]}],
+                      'outputs': [hash_lock]})
+    assert tx.cost() == 1 + 10 + 1 + 1
+    assert tx.execute() and not tx.execute(max_cost=12)
+    tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': ["x" * 1000]}],
+                      'outputs': [{'amount': 1, 'locking_script': []}]})
+    assert not tx.execute()
+    tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': i, 'unlocking_script': ["secret"]}
+                                 for i in range(Transaction.max_inputs + 1)], 'outputs': [hash_lock]})
+    assert not tx.execute()
+
+    # The scripts beyond the limits are rejected without being compiled or cached
+    size = Script.cache_info().currsize
+    tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0,
+                                   'unlocking_script': ["x"] * (Script.max_length + 1)}], 'outputs': [hash_lock]})
+    assert tx.cost() > Transaction.max_cost and not tx.execute()
+    assert Script.compile(["x" * (Script.max_item_size + 1)]) is None
+    assert Script.cache_info().currsize == size
+
+    # Malformed scripts and transactions are rejected instead of raising
+    for code in (["OP_DUP"], ["OP_HASH160"], ["OP_EQUALVERIFY"], ["a", "OP_EQUALVERIFY"], [1, "OP_DUP"], None,
+                 "OP_DUP"):
+        assert not Script(code).execute([])
+    assert Script.compile([1]) is None and Script.cost(None) > Transaction.max_cost
+    for unlocking_script in (None, "secret", [None], ["secret", 1]):
+        tx_input = {'transaction_hash': "a", 'output_index': 0, 'unlocking_script': unlocking_script}
+        tx = Transaction({'inputs': [tx_input], 'outputs': [hash_lock]})
+        assert tx.cost() > Transaction.max_cost and not tx.execute()
+    for inputs, outputs in (([{'transaction_hash': "a", 'unlocking_script': []}], []), ([None], []),
+                            ([], [{'amount': -1, 'locking_script': []}]), ([], [[]]), ([], [{'amount': 1}])):
+        tx = Transaction({'inputs': inputs, 'outputs': outputs})
+        assert not tx.is_well_formed() and not tx.execute() and tx.cost() > Transaction.max_cost
+
+    print("Passed script tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_merkle_tree():
+    print("Starting Merkle tree tests :")
+    print("Here we test that the levels of the Merkle tree give valid roots and proofs.")
+
+    # The levels of the tree give the same root and proofs as hashing the nodes one by one
+    transactions = [Transaction({'inputs': [], 'outputs': [], 'timestamp': i}) for i in range(13)]
+    merkle_tree = MerkleTree(transactions)
+    level = [tx.hash() for tx in transactions]
+    while len(level) > 1:
+        level = [merkle_tree._hash_nodes(*level[i:i + 2]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    assert merkle_tree.get_root().hash == level[0]
+    assert merkle_tree.levels[0] == b"".join(bytes.fromhex(tx.hash()) for tx in transactions)
+    for tx in transactions:
+        proof = merkle_tree.get_proof(tx.hash())
+        assert merkle_tree.verify_proof(tx.hash(), proof)
+    assert merkle_tree.get_proof("00" * 32) is None
+    assert all(merkle_tree.leaf_positions[tx.hash()] == i for i, tx in enumerate(transactions))
+
+    # The nodes are views over the levels, the lone last transaction is carried up to the last level
+    node = merkle_tree.get_root()
+    while not node.is_leaf():
+        node = node.right
+    assert node.hash == transactions[-1].hash() and node.level == 0
+    assert node.parent.parent.hash == merkle_tree.get_root().hash and node.parent.parent.parent is None
+
+    # Appending or replacing a leaf only recomputes its path to the root
+    incremental_tree = MerkleTree()
+    incremental_tree.update_tree(transactions)
+    assert incremental_tree.levels == merkle_tree.levels
+    coinbase = Transaction({'inputs': [], 'outputs': [], 'timestamp': -1})
+    incremental_tree.replace_leaf(0, coinbase)
+    assert incremental_tree.levels == MerkleTree([coinbase] + transactions[1:]).levels
+    assert incremental_tree.get_proof(transactions[0].hash()) is None
+
+    # A multiproof proves several transactions at once with fewer hashes than separate proofs
+    tx_hashes = [transactions[i].hash() for i in (0, 1, 5, 12)]
+    multiproof = merkle_tree.get_multiproof(tx_hashes)
+    assert merkle_tree.verify_multiproof(tx_hashes, multiproof)
+    assert len(multiproof['hashes']) < sum(len(merkle_tree.get_proof(tx_hash)) for tx_hash in tx_hashes)
+    assert not merkle_tree.verify_multiproof(tx_hashes[::-1], multiproof)
+    assert merkle_tree.get_multiproof(["00" * 32]) is None
+
+    # The original commutative hashing is still available, and the lower levels can be computed in subtrees
+    legacy_tree = MerkleTree(transactions, hashing="commutative")
+    assert legacy_tree.get_root().hash != merkle_tree.get_root().hash
+    assert legacy_tree.verify_proof(transactions[3].hash(), legacy_tree.get_proof(transactions[3].hash()))
+    assert merkle_tree._build_levels_in_chunks(2) == merkle_tree.levels[1:3]
+
+    # A received block is hashed with its advertised Merkle root, its tree is only built when needed
+    block = Block(0, transactions, "0" * 64)
+    received_block = Block(0, [tx.as_dict() for tx in transactions], "0" * 64, timestamp=block.timestamp,
+                           merkle_root=block.as_dict()["merkle_root"])
+    assert received_block.hash() == block.hash() and received_block._merkle_tree is None
+    assert received_block.verify_merkle_root()
+    tampered_block = Block(0, transactions[1:], "0" * 64, timestamp=block.timestamp, merkle_root=block.merkle_root())
+    assert tampered_block.hash() == block.hash() and not tampered_block.verify_merkle_root()
+
+    print("Passed Merkle tree tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_light_client():
+    print("Starting light client tests :")
+    print("Here we test that a light client wallet checks its transactions with Merkle proofs against the headers.")
+
+    # Set up the nodes
+    miner_1 = Miner(node_name="Miner 1", logging_level=logging_level)
+    time.sleep(1)
+    miner_2 = Miner(known_nodes={miner_1.id()}, node_name="Miner 2", logging_level=logging_level)
+    time.sleep(1)
+    light_wallet = Wallet(known_nodes={miner_1.id()}, node_name="Light wallet", light_client=True,
+                          logging_level=logging_level)
+    time.sleep(1)
+    wallet = Wallet(known_nodes={miner_2.id()}, node_name="Wallet", logging_level=logging_level)
+    time.sleep(1)
+
+    # Mine a first block, and pay the mining reward to the light client in a second one
+    wallet.create_transaction(inputs=[], outputs=[])
+    wallet.create_transaction(inputs=[], outputs=[])
+    while len(miner_1.blockchain) == 0 or not miner_1.blockchain == miner_2.blockchain:
+        time.sleep(1)
+    wallet.create_transaction(inputs=[], outputs=[])
+    for miner in [miner_1, miner_2]:
+        utxo_id, utxo = list(miner.utxos.items())[0]
+        if utxo["locking_script"] == miner.generate_locking_script(miner.address):
+            miner.spend_mining_reward(light_wallet.address, utxo['amount'])
+    while len(miner_1.blockchain) < 2 or not miner_1.blockchain == miner_2.blockchain:
+        time.sleep(1)
+    assert len(miner_1.blockchain) == 2
+
+    # The light client only keeps the headers, and the UTXOs of the transactions it could confirm
+    light_wallet.refresh_balance()
+    assert light_wallet.header_hashes == [block.hash() for block in miner_1.blockchain]
+    assert light_wallet.get_balance() == 50
+    tx_hash = list(light_wallet.utxos)[0].split(':')[0]
+    assert light_wallet.confirm_transaction(tx_hash) == 1
+
+    # The transactions and UTXOs that aren't in the blockchain are not confirmed
+    assert light_wallet.confirm_transaction("00" * 32, timeout=1) is None
+    forged_utxos = {f"{tx_hash}:0": {"amount": 1000, "locking_script": light_wallet.generate_locking_script(
+        light_wallet.address)}, f"{'00' * 32}:0": {"amount": 1000, "locking_script": []}}
+    assert light_wallet._verify_utxos(forged_utxos, timeout=1) == {}
+
+    # A proof doesn't match the Merkle root of another block
+    proof = miner_1.blockchain[1].merkle_tree.get_proof(tx_hash)
+    assert MerkleTree.get_proof_root(tx_hash, proof) == light_wallet.headers[1]["merkle_root"]
+    assert MerkleTree.get_proof_root(tx_hash, proof) != light_wallet.headers[0]["merkle_root"]
+
+    # The proofs are checked with the hashing of the wallet whatever the miner says, and only hold SHA256 digests
+    merkle_tree = miner_1.blockchain[1].merkle_tree
+    transaction = merkle_tree.transactions[merkle_tree.leaf_positions[tx_hash]].as_dict()
+    light_wallet.confirmed_transactions.clear()
+    light_wallet._handle_incoming_merkle_proof_response({"data": [{"transaction": transaction, "block_index": 1,
+                                                                    "proof": proof, "hashing": "commutative"}]}, None)
+    assert light_wallet.confirmed_transactions[tx_hash][0] == 1
+    assert MerkleTree.get_proof_root(tx_hash, ["00" + proof[0]] + proof[1:], "commutative") is None
+    assert MerkleTree.get_proof_root(tx_hash, [proof[0][2:]] + proof[1:]) is None
+    multiproof = merkle_tree.get_multiproof([tx_hash])
+    assert MerkleTree.get_multiproof_root([tx_hash], multiproof) == light_wallet.headers[1]["merkle_root"]
+    assert MerkleTree.get_multiproof_root([tx_hash], dict(multiproof, hashes=["00" + h for h in multiproof["hashes"]]),
+                                          "commutative") is None
+
+    # Headers with an invalid proof of work are rejected
+    forged_header = dict(light_wallet.headers[1], index=2, previous_hash=light_wallet.header_hashes[1], nonce=0,
+                         timestamp=0)
+    with light_wallet.headers_condition:
+        assert not light_wallet._connect_headers([forged_header], 2)
+    assert len(light_wallet.headers) == 2
+
+    print("Passed light client tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_utxo_subscription():
+    print("Starting UTXO subscription tests :")
+    print("Here we test that the miners push the changes of the UTXOs to the subscribed wallets.")
+
+    # Set up the nodes
+    miner_1 = Miner(node_name="Miner 1", logging_level=logging_level)
+    time.sleep(1)
+    miner_2 = Miner(known_nodes={miner_1.id()}, node_name="Miner 2", logging_level=logging_level)
+    time.sleep(1)
+    subscribed_wallet = Wallet(known_nodes={miner_1.id()}, node_name="Subscribed wallet", subscribe_utxos=True,
+                               logging_level=logging_level)
+    time.sleep(1)
+    wallet = Wallet(known_nodes={miner_2.id()}, node_name="Wallet", logging_level=logging_level)
+    time.sleep(1)
+    assert subscribed_wallet.address in miner_1.subscriptions
+
+    # Mine a first block, and pay the mining reward to the subscribed wallet in a second one
+    wallet.create_transaction(inputs=[], outputs=[])
+    wallet.create_transaction(inputs=[], outputs=[])
+    while len(miner_1.blockchain) == 0 or not miner_1.blockchain == miner_2.blockchain:
+        time.sleep(1)
+    wallet.create_transaction(inputs=[], outputs=[])
+    for miner in [miner_1, miner_2]:
+        utxo_id, utxo = list(miner.utxos.items())[0]
+        if utxo["locking_script"] == miner.generate_locking_script(miner.address):
+            miner.spend_mining_reward(subscribed_wallet.address, utxo['amount'])
+
+    # The balance is updated without requesting the UTXOs
+    while subscribed_wallet.get_balance() == 0:
+        time.sleep(1)
+    assert subscribed_wallet.get_balance() == 50
+
+    # The payments update the balance right away, the pushed changes are applied once
+    subscribed_wallet.send_crypto(wallet.address, 20)
+    assert subscribed_wallet.get_balance() == 30
+    wallet.create_transaction(inputs=[], outputs=[])
+    while len(miner_1.blockchain) < 3 or not miner_1.blockchain == miner_2.blockchain:
+        time.sleep(1)
+    time.sleep(1)
+    locking_script = subscribed_wallet.generate_locking_script(subscribed_wallet.address)
+    utxos = {utxo_id: utxo for utxo_id, utxo in miner_1.utxos.items() if utxo["locking_script"] == locking_script}
+    assert subscribed_wallet.utxos == utxos and subscribed_wallet.get_balance() == 30
+
+    # Disconnecting blocks pushes all the UTXOs again
+    with subscribed_wallet.utxos_condition:
+        subscribed_wallet._set_utxos({})
+    miner_1._update_utxos_from_blockchain()
+    while subscribed_wallet.get_balance() == 0:
+        time.sleep(1)
+    assert subscribed_wallet.utxos == utxos
+
+    # The changes are applied in the order of the blocks, whatever the order in which they are received
+    offline_wallet = Wallet(node_name="Offline wallet", autostart=False, logging_level=logging_level)
+    requests = []
+    offline_wallet._send = lambda data, data_type, receiver=None: requests.append(data_type)
+
+    def push(height, created=None, spent=(), reset=False):
+        offline_wallet._handle_incoming_utxos_delta({"data": {"address": offline_wallet.address,
+                                                              "created": created or {}, "spent": list(spent),
+                                                              "reset": reset, "height": height}},
+                                                    None)
+
+    utxo = {"amount": 10, "locking_script": locking_script}
+    push(2, {"b:0": utxo})
+    assert offline_wallet.utxos == {} and requests == []
+    push(1, {"a:0": utxo}, reset=True)
+    # The changes of block 3 arrive before those of block 2: all the UTXOs are requested again
+    push(3, {"c:0": utxo}, ["b:0"])
+    assert offline_wallet.utxos == {"a:0": utxo} and requests == ["utxos_subscribe"]
+    push(2, {"b:0": utxo})
+    assert set(offline_wallet.utxos) == {"a:0", "b:0"}
+    push(3, {"a:0": utxo, "c:0": utxo}, reset=True)
+    # The changes and the snapshots already applied, sent again or by a lagging miner, are ignored
+    push(3, {"c:0": utxo}, ["b:0"])
+    push(2, {"a:0": utxo, "b:0": utxo}, reset=True)
+    assert set(offline_wallet.utxos) == {"a:0", "c:0"} and offline_wallet.get_balance() == 20
+    assert requests == ["utxos_subscribe"]
+
+    # Requesting the UTXOs times out instead of waiting forever when no miner answers
+    lonely_wallet = Wallet(node_name="Lonely wallet", logging_level=logging_level)
+    assert not lonely_wallet.refresh_balance(timeout=1)
+
+    print("Passed UTXO subscription tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_coin_selection():
+    print("Starting coin selection tests :")
+    print("Here we test that the payments spend few UTXOs and avoid change outputs.")
+
+    utxos = {f"{i:064x}:0": {"amount": amount, "locking_script": []} for i, amount in enumerate([1, 2, 5, 10, 20, 50])}
+
+    # An exact match needs no change output, and the exact match with the fewest inputs is chosen
+    selection = CoinSelection.select(utxos, 30)
+    assert sorted(utxos[utxo_id]["amount"] for utxo_id in selection) == [10, 20]
+    assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 50)] == [50]
+    assert sum(utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 88)) == 88
+
+    # Without an exact match, the largest UTXOs are spent, and a small excess can be left to the miner
+    assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 45)] == [50]
+    assert CoinSelection.branch_and_bound(utxos, 90) is None
+    assert sorted(utxos[utxo_id]["amount"] for utxo_id in CoinSelection.branch_and_bound(utxos, 49, 1)) == [50]
+    assert CoinSelection.select(utxos, 89) is None
+
+    # Consolidation spends the smallest UTXOs, as many as allowed
+    assert len(CoinSelection.select(utxos, 3, "consolidate")) == len(utxos)
+    assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 3, "consolidate", max_inputs=2)] == \
+        [1, 2]
+    assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 60, "consolidate", max_inputs=2)] \
+        == [50, 20]
+
+    # The wallets use the coin selection, the exact match creates no change
+    wallet = Wallet(node_name="Wallet", logging_level=logging_level)
+    locking_script = wallet.generate_locking_script(wallet.address)
+    with wallet.utxos_condition:
+        wallet._set_utxos({utxo_id: dict(utxo, locking_script=locking_script) for utxo_id, utxo in utxos.items()})
+    tx = wallet._create_payment("0" * 64, 26)
+    assert len(tx.inputs) == 3 and len(tx.outputs) == 1 and wallet.get_balance() == 88 - 26
+
+    print("Passed coin selection tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_async_wallet():
+    print("Starting asynchronous wallet tests :")
+    print("Here we test that concurrent balance queries and payments are answered separately.")
+
+    # Set up the nodes
+    miner_1 = Miner(node_name="Miner 1", logging_level=logging_level)
+    time.sleep(1)
+    miner_2 = Miner(known_nodes={miner_1.id()}, node_name="Miner 2", logging_level=logging_level)
+    time.sleep(1)
+    wallet_1 = Wallet(known_nodes={miner_1.id()}, node_name="Wallet 1", logging_level=logging_level)
+    time.sleep(1)
+    wallet_2 = Wallet(known_nodes={miner_2.id()}, node_name="Wallet 2", logging_level=logging_level)
+    time.sleep(1)
+
+    # Mine a first block, and pay the mining reward to the first wallet in a second one
+    wallet_2.create_transaction(inputs=[], outputs=[])
+    wallet_2.create_transaction(inputs=[], outputs=[])
+    while len(miner_1.blockchain) == 0 or not miner_1.blockchain == miner_2.blockchain:
+        time.sleep(1)
+    wallet_2.create_transaction(inputs=[], outputs=[])
+    for miner in [miner_1, miner_2]:
+        utxo_id, utxo = list(miner.utxos.items())[0]
+        if utxo["locking_script"] == miner.generate_locking_script(miner.address):
+            miner.spend_mining_reward(wallet_1.address, utxo['amount'])
+    while len(miner_1.blockchain) < 2 or not miner_1.blockchain == miner_2.blockchain:
+        time.sleep(1)
+
+    # Concurrent balance queries each get the response to their own request
+    futures = [wallet_1.refresh_balance_async() for _ in range(5)]
+    assert [future.result(timeout=20) for future in futures] == [50] * 5
+    assert len(wallet_1.pending_requests) == 0
+
+    # The payments are made on the threads of the wallet
+    payments = [wallet_1.send_crypto_async(wallet_2.address, amount) for amount in (10, 15)]
+    transactions = [future.result(timeout=20) for future in payments]
+    assert all(tx is not None for tx in transactions) and wallet_1.get_balance() == 25
+    # One of the payments spends the change of the other one
+    spent_utxos = {f"{tx_input['transaction_hash']}:{tx_input['output_index']}" for tx in transactions
+                   for tx_input in tx.inputs}
+    assert len(spent_utxos) == 2 and any(f"{tx.hash()}:1" in spent_utxos for tx in transactions)
+
+    # A request that gets no response fails with a timeout
+    lonely_wallet = Wallet(node_name="Lonely wallet", logging_level=logging_level)
+    try:
+        lonely_wallet.refresh_balance_async(timeout=1).result(timeout=5)
+        assert False
+    except TimeoutError:
+        pass
+    assert len(lonely_wallet.pending_requests) == 0
+
+    print("Passed asynchronous wallet tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_validator():
+    print("Starting validator tests :")
+    print("Here we test that the miners reject invalid blocks and transactions.")
+
+    # The difficulty is a miner option, the validator checks the proof of work with it
+    miner = Miner(node_name="Miner", difficulty=3, autostart=False, logging_level=logging_level)
+    assert miner.difficulty == 3 and miner.validator.difficulty == 3
+
+    # Malformed transactions make a block invalid instead of raising, and mining resumes
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level)
+    output = {'amount': 1, 'locking_script': Node.generate_locking_script("address")}
+    for unlocking_script in (["OP_DUP"], None, [1], ["OP_EQUALVERIFY"]):
+        tx = {'inputs': [{'transaction_hash': "00" * 32, 'output_index': 0, 'unlocking_script': unlocking_script}],
+              'outputs': [output], 'timestamp': 0}
+        block = mine_block(0, "0" * 64, [tx])
+        assert miner.validator.validate_blockchain([block.as_dict()])[0] == 0
+        assert miner.validator.validate_block(block, None, {}) is not None
+        miner.stop_mining = True
+        miner._handle_incoming_blockchain_update({"data": ([block.as_dict()], []), "sender_name": "Peer"}, None)
+        assert not miner.stop_mining and len(miner.blockchain) == 0
+        miner._handle_incoming_mined_block({"data": block.as_dict(), "sender_name": "Peer", "sender": ["", 0]}, None)
+        assert len(miner.blockchain) == 0
+    coinbase = {'inputs': [], 'outputs': [output], 'timestamp': 0}
+    malformed_block = dict(mine_block(0, "0" * 64, [coinbase]).as_dict(),
+                           merkle_tree={'transactions': [{'inputs': []}]})
+    assert miner.validator.validate_blockchain([malformed_block]) == (0, "malformed block")
+    miner._handle_incoming_mined_block({"data": dict(malformed_block, index="0"), "sender_name": "Peer",
+                                        "sender": ["", 0]}, None)
+    miner._handle_incoming_blockchain_update({"data": "malformed", "sender_name": "Peer"}, None)
+    assert not miner.stop_mining and len(miner.blockchain) == 0
+
+    # Malformed bodies are rejected without building the Merkle tree in the handler, whether the header advertises a
+    # Merkle root or not, and a block without transactions has a root
+    bodies = [[], [{'inputs': []}], [{'inputs': [], 'outputs': [output], 'timestamp': float("nan")}]]
+    for transactions in bodies:
+        for advertised_root in (True, False):
+            data = dict(malformed_block, merkle_tree={'transactions': transactions})
+            if not advertised_root:
+                del data["merkle_root"]
+            miner._handle_incoming_mined_block({"data": data, "sender_name": "Peer", "sender": ["", 0]}, None)
+            assert len(miner.blockchain) == 0
+    assert Block(0, [], "0" * 64).merkle_root() == "0" * 64
+
+    # A valid blockchain is accepted, and each kind of invalid block is reported with its index
+    private_key, public_key = Node.generate_key_pair()
+    locking_script = Node.generate_locking_script(Node.generate_address(public_key))
+    reward = Transaction({'inputs': [], 'outputs': [{'amount': 50, 'locking_script': locking_script}], 'timestamp': 0})
+
+    def spend(tx_input, timestamp=0, signing_key=private_key):
+        signature = Transaction.sign_transaction_input(signing_key, reward.hash(), 0)
+        tx_input = dict({'transaction_hash': reward.hash(), 'output_index': 0, 'unlocking_script': (
+            Node.generate_unlocking_script(reward.hash(), 0, signature, public_key))}, **tx_input)
+        return Transaction({'inputs': [tx_input], 'outputs': [{'amount': 50, 'locking_script': locking_script}],
+                            'timestamp': timestamp})
+
+    validator = Validator(2)
+    genesis = mine_block(0, "0" * 64, [reward])
+    utxos = {f"{reward.hash()}:0": reward.outputs[0]}
+    block = mine_block(1, genesis.hash(), [spend({})])
+    assert validator.validate_blockchain([genesis.as_dict(), block.as_dict()]) is None
+    assert validator.validate_block(block, genesis, utxos) is None
+    unmined_block = Block(1, [spend({})], genesis.hash())
+    unmined_block.nonce = unmined_block.timestamp
+    while unmined_block.hash().startswith("00"):
+        unmined_block.nonce += 1
+    invalid_blocks = [
+        (unmined_block, "invalid proof of work"),
+        (mine_block(1, "11" * 32, [spend({})]), "previous hash doesn't match"),
+        (mine_block(2, genesis.hash(), [spend({})]), "invalid index"),
+        (mine_block(1, genesis.hash(), [spend({}, signing_key=Node.generate_key_pair()[0])]), "invalid signature"),
+        (mine_block(1, genesis.hash(), [spend({}), spend({}, timestamp=1)]), "double spend"),
+        (mine_block(1, genesis.hash(), [spend({'output_index': "0"})]), "invalid transaction script"),
+    ]
+    for invalid_block, reason in invalid_blocks:
+        blockchain = [genesis.as_dict(), invalid_block.as_dict()]
+        assert validator.validate_blockchain(blockchain) == (invalid_block.index, reason)
+        assert validator.validate_block(invalid_block, genesis, utxos) == (invalid_block.index, reason)
+    # A signature doesn't spend an output locked by a non-standard script
+    hash_lock = ["OP_HASH160", hashlib.sha256("secret".encode()).hexdigest(), "OP_EQUALVERIFY"]
+    hash_locked_utxos = {f"{reward.hash()}:0": {'amount': 50, 'locking_script': hash_lock}}
+    assert validator.validate_block(block, genesis, hash_locked_utxos) == (1, "invalid signature")
+    secret_input = {'transaction_hash': reward.hash(), 'output_index': 0, 'unlocking_script': ["secret"]}
+    secret_spend = Transaction({'inputs': [secret_input], 'outputs': [{'amount': 50, 'locking_script': locking_script}],
+                                'timestamp': 0})
+    assert validator.validate_block(mine_block(1, genesis.hash(), [secret_spend]), genesis, hash_locked_utxos) is None
+    forged_block = dict(block.as_dict(), merkle_tree={'transactions': [spend({}, timestamp=1).as_dict()]})
+    reason = "Merkle root doesn't match the transactions"
+    assert validator.validate_blockchain([genesis.as_dict(), forged_block]) == (1, reason)
+
+    print("Passed validator tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_workers():
+    print("Starting workers tests :")
+    print("Here we test the process pool with several workers, which never use the pool themselves.")
+
+    # Pretend there are two cores, and build the Merkle trees of small blocks in subtrees
+    count, parallel_threshold = Workers.count, MerkleTree.parallel_threshold
+    Workers.count = staticmethod(lambda: 2)
+    MerkleTree.parallel_threshold = 4
+    try:
+        transactions = [Transaction({'inputs': [], 'outputs': [{'amount': i, 'locking_script': []}], 'timestamp': i})
+                        for i in range(13)]
+        merkle_tree = MerkleTree(transactions)
+        MerkleTree.parallel_threshold = 1 << 16
+        assert merkle_tree.levels == MerkleTree(transactions).levels
+        MerkleTree.parallel_threshold = 4
+
+        # The blocks are checked on the pool, and their trees are built in the workers without the pool
+        blockchain = []
+        previous_hash = "0" * 64
+        for i in range(4):
+            block = Block(i, transactions[:8], previous_hash)
+            block.nonce = block.timestamp
+            previous_hash = block.hash()
+            blockchain.append(block.as_dict())
+            time.sleep(0.001)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            Validator(0, parallel_threshold=1).validate_blockchain(blockchain)), daemon=True)
+        thread.start()
+        thread.join(60)
+        assert result == [None]
+    finally:
+        Workers.count = count
+        MerkleTree.parallel_threshold = parallel_threshold
+
+    print("Passed workers tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_orphan_blocks():
+    print("Starting orphan blocks tests :")
+    print("Here we test that the blocks received before their parent wait for it in a bounded pool.")
+
+    def receive(miner, block):
+        miner._handle_incoming_mined_block({"data": block.as_dict(), "sender_name": "Peer",
+                                            "sender": ["localhost", 0]}, None)
+
+    blocks = [mine_block(0, "0" * 64)]
+    for i in range(1, 5):
+        blocks.append(mine_block(i, blocks[-1].hash()))
+
+    # The blocks received before their parent are buffered, and connected once the parent arrives
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level, orphan_timeout=60)
+    requests = []
+    miner._request_blockchain_update = requests.append
+    for block in [blocks[0], blocks[3], blocks[2]]:
+        receive(miner, block)
+    assert miner.blockchain == blocks[:1] and len(miner.orphan_blocks) == 2
+    receive(miner, blocks[1])
+    assert miner.blockchain == blocks[:4] and len(miner.orphan_blocks) == 0 and requests == []
+
+    # The pool of orphans is bounded, the oldest orphans are dropped first
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level, orphan_timeout=60,
+                  max_orphan_blocks=2)
+    miner._request_blockchain_update = requests.append
+    for block in [blocks[0], blocks[2], blocks[3], blocks[4]]:
+        receive(miner, block)
+    assert list(miner.orphan_blocks) == [blocks[3].hash(), blocks[4].hash()]
+    receive(miner, blocks[1])
+    assert miner.blockchain == blocks[:2] and requests == []
+
+    # A blockchain update is requested from the sender if the parent doesn't arrive in time
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level, orphan_timeout=0.5)
+    miner._request_blockchain_update = requests.append
+    for block in [blocks[0], blocks[2]]:
+        receive(miner, block)
+    assert len(miner.orphan_blocks) == 1
+    miner._expire_orphan_blocks()
+    assert len(miner.orphan_blocks) == 1
+    time.sleep(1)
+    miner._expire_orphan_blocks()
+    assert len(miner.orphan_blocks) == 0 and requests == [["localhost", 0]]
+
+    # Several orphans may claim the same parent: a forged block received first doesn't keep the valid one out
+    forged_tx = Transaction({'inputs': [{'transaction_hash': "00" * 32, 'output_index': 0,
+                                         'unlocking_script': []}], 'outputs': [], 'timestamp': 0})
+    forged_block = mine_block(2, blocks[1].hash(), [forged_tx])
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level, orphan_timeout=60)
+    requests = []
+    miner._request_blockchain_update = requests.append
+    for block in [blocks[0], forged_block, blocks[2]]:
+        receive(miner, block)
+    assert len(miner.orphan_blocks) == 2
+    receive(miner, blocks[1])
+    assert miner.blockchain == blocks[:3] and len(miner.orphan_blocks) == 0 and requests == []
+
+    # A blockchain update is requested from the sender when no orphan following the blockchain is valid
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level, orphan_timeout=60)
+    miner._request_blockchain_update = requests.append
+    for block in [blocks[0], forged_block, blocks[1]]:
+        receive(miner, block)
+    assert miner.blockchain == blocks[:2] and len(miner.orphan_blocks) == 0 and requests == [["localhost", 0]]
+
+    print("Passed orphan blocks tests !")
+    print(f"\n{'-'*20}")
+
+
+def test_pruning():
+    print("Starting pruning tests :")
+    print("Here we test that a pruned miner keeps the recent blocks and refuses to send its blockchain.")
+
+    blocks = [mine_block(0, "0" * 64)]
+    for i in range(1, 3):
+        blocks.append(mine_block(i, blocks[-1].hash()))
+
+    # At least the last block is kept whole
+    for prune_depth in (0, -1):
+        try:
+            Miner(node_name="Miner", autostart=False, logging_level=logging_level, prune_depth=prune_depth)
+            assert False
+        except ValueError:
+            pass
+
+    # A pruned miner only keeps the headers of the old blocks, and the UTXOs of the whole blockchain
+    miner = Miner(node_name="Miner", autostart=False, logging_level=logging_level, prune_depth=1)
+    for block in blocks:
+        miner._handle_incoming_mined_block({"data": block.as_dict(), "sender_name": "Peer",
+                                            "sender": ["localhost", 0]}, None)
+    assert miner.blockchain == blocks and miner.pruned_height == 2
+    assert [block.is_pruned() for block in miner.blockchain] == [True, True, False]
+    assert len(miner.utxos) == 3 and miner.blockchain[-1].as_dict()["merkle_tree"] is not None
+
+    # Its blockchain can't be used to rebuild the UTXOs, the requests are answered with data_unavailable
+    sent = []
+    miner._send = lambda data, data_type, receiver=None: sent.append((data_type, receiver))
+    miner._handle_incoming_blockchain_request({"data": None, "sender_name": "Peer", "sender": ["localhost", 0]}, None)
+    assert sent == [("data_unavailable", ["localhost", 0])]
+    # The Merkle proofs of the transactions of the pruned blocks are unavailable too
+    sent = []
+    miner._send = lambda data, data_type, receiver=None: sent.append((data, data_type))
+    tx_hashes = [blocks[0].transactions()[0].hash(), blocks[2].transactions()[0].hash()]
+    miner._handle_incoming_merkle_proof_request({"data": tx_hashes, "sender_name": "Wallet",
+                                                     "sender": ["localhost", 0]}, None)
+    assert [data_type for _, data_type in sent] == ["merkle_proof_response", "data_unavailable"]
+    assert [proof["block_index"] for proof in sent[0][0]] == [2] and sent[1][0]["transactions"] == tx_hashes[:1]
+    # The node that requested the blockchain resumes mining
+    peer = Miner(node_name="Peer", autostart=False, logging_level=logging_level)
+    peer.stop_mining = True
+    peer._handle_incoming_data_unavailable({"data": {"request": "request_blockchain", "reason": "blockchain pruned"},
+                                            "sender_name": "Miner"}, None)
+    assert not peer.stop_mining
+
+    print("Passed pruning tests !")
+    print(f"\n{'-'*20}")
+
+
 # Run the tests
 test_exercise_1()
 test_exercise_2()
 test_exercise_3()
 test_exercise_4()
 test_exercise_5()
+test_mempool()
+test_signature_schemes()
+test_keystore()
+test_script()
+test_merkle_tree()
+test_light_client()
+test_utxo_subscription()
+test_coin_selection()
+test_async_wallet()
+test_validator()
+test_workers()
+test_orphan_blocks()
+test_pruning()
 
 print("All tests passed.")
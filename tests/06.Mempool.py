@@ -0,0 +1,116 @@
+import hashlib
+import time
+from Block import Block
+from Encoding import Encoding
+from Mempool import Mempool
+from Miner import Miner
+from Node import Node
+from Transaction import Transaction
+
+
+def make_transaction(spent_outputs, timestamp=0):
+    return Transaction({
+        'inputs': [{'transaction_hash': h, 'output_index': i, 'unlocking_script': []} for h, i in spent_outputs],
+        'outputs': [{'amount': 1, 'locking_script': Node.generate_locking_script("address")}],
+        'timestamp': timestamp,
+    })
+
+
+# Two transactions can't spend the same output
+pool = Mempool()
+tx_1 = make_transaction([("a", 0)])
+assert pool.add(tx_1)
+assert not pool.add(make_transaction([("a", 0)], timestamp=1))
+assert pool.spender("a:0") == tx_1.hash()
+
+# A block spending the same output evicts the transaction and its descendants
+tx_2 = make_transaction([(tx_1.hash(), 0)])
+assert pool.add(tx_2)
+assert len(pool.remove_conflicts([make_transaction([("a", 0)], timestamp=2)])) == 2
+assert len(pool) == 0
+
+# When the pool is full, the lowest fee rate is evicted first
+pool = Mempool(max_count=2)
+assert pool.add(make_transaction([("b", 0)]), fee=10)
+assert pool.add(make_transaction([("c", 0)]), fee=1)
+assert not pool.add(make_transaction([("d", 0)]), fee=1)
+assert pool.add(make_transaction([("d", 0)]), fee=5)
+assert pool.spender("c:0") is None and len(pool) == 2
+assert pool.stats["evicted"] == 1 and pool.stats["rejected"] == 1
+
+# Old transactions expire
+pool.expire(time.time() + pool.expiry)
+assert len(pool) == 0 and pool.stats["expired"] == 2
+
+# The miners only pool the transactions whose inputs cover their outputs
+miner = Miner(node_name="Miner", autostart=False)
+miner.utxos = {f"{'00' * 32}:0": {'amount': 10, 'locking_script': miner.generate_locking_script(miner.address)}}
+
+
+def spend(transaction_hash, amount, timestamp=0, private_key=None):
+    signature = Transaction.sign_transaction_input(private_key or miner.private_key, transaction_hash, 0)
+    unlocking_script = miner.generate_unlocking_script(transaction_hash, 0, signature, miner.public_key)
+    return Transaction({
+        'inputs': [{'transaction_hash': transaction_hash, 'output_index': 0, 'unlocking_script': unlocking_script}],
+        'outputs': [{'amount': amount, 'locking_script': miner.generate_locking_script(miner.address)}],
+        'timestamp': timestamp,
+    })
+
+
+miner._add_transactions([spend("00" * 32, 11)])
+assert len(miner.transaction_pool) == 0
+tx_1 = spend("00" * 32, 9)
+miner._add_transactions([tx_1, spend(tx_1.hash(), 10)])
+assert list(miner.transaction_pool) == [tx_1]
+
+# The pool received along with a blockchain goes through the same checks
+coinbase = Transaction({'inputs': [], 'outputs': [{'amount': 10, 'locking_script': miner.generate_locking_script(
+    miner.address)}], 'timestamp': 0})
+block = Block(0, [coinbase], "0" * 64)
+block.nonce = block.timestamp
+while not block.hash().startswith("0" * miner.difficulty):
+    block.nonce += 1
+forged = spend(coinbase.hash(), 10, private_key=Node.generate_key_pair()[0])
+miner._handle_incoming_blockchain_update({"data": ([block.as_dict()], [forged.as_dict(), spend(
+    coinbase.hash(), 11, timestamp=1).as_dict()]), "sender_name": "Peer"}, None)
+assert miner.blockchain == [block] and len(miner.transaction_pool) == 0
+tx_2 = spend(coinbase.hash(), 10)
+miner._handle_incoming_blockchain_update({"data": ([block.as_dict()], [tx_2.as_dict()]), "sender_name": "Peer"}, None)
+assert list(miner.transaction_pool) == [tx_2]
+
+# A malformed transaction is skipped without dropping the rest of its batch
+tx_3 = spend(tx_2.hash(), 10)
+malformed = [None, {'inputs': [{'output_index': 0}], 'outputs': [], 'timestamp': 0}, {'inputs': 0}]
+miner._handle_incoming_transactions({"data": malformed + [tx_3.as_dict()], "sender_name": "Peer"}, None)
+assert list(miner.transaction_pool) == [tx_2, tx_3]
+
+# Nor can an output locked by a non-standard script be spent with a signature of any key
+miner.utxos[f"{'11' * 32}:0"] = {'amount': 10, 'locking_script': ["OP_HASH160", hashlib.sha256(
+    "secret".encode()).hexdigest(), "OP_EQUALVERIFY"]}
+forged = spend("11" * 32, 10)
+miner._add_transactions([forged])
+assert forged not in miner.transaction_pool
+# The holder of the secret spends it through the interpreter
+secret_input = {'transaction_hash': "11" * 32, 'output_index': 0, 'unlocking_script': ["secret"]}
+secret_spend = Transaction({'inputs': [secret_input], 'outputs': [
+    {'amount': 9, 'locking_script': miner.generate_locking_script(miner.address)}]})
+miner._add_transactions([secret_spend])
+assert secret_spend in miner.transaction_pool
+
+# The batches are cut before their message exceeds the size that the receiving nodes read
+sender = Node(node_name="Sender", autostart=False, max_recv_size=16 * 1024)
+sender.known_nodes = {("localhost", 0)}
+payloads = []
+sender._connect_and_send = lambda node, payload: payloads.append(payload)
+sender._disconnect = lambda: sender
+large_input = {'transaction_hash': "22" * 32, 'output_index': 0, 'unlocking_script': ["x" * 700]}
+large_transactions = [Transaction({'inputs': [dict(large_input, output_index=i)], 'outputs': [], 'timestamp': 0})
+                      for i in range(100)]
+sender.send_transactions(large_transactions)
+assert len(payloads) > 100 * 800 // (16 * 1024) and all(len(payload) <= 16 * 1024 for payload in payloads)
+assert [tx for payload in payloads for tx in Encoding.decode(payload)["data"]] == large_transactions
+# And after max_batch_size transactions
+sender.max_batch_size = 15
+payloads.clear()
+sender.send_transactions(large_transactions[:20])
+assert [len(Encoding.decode(payload)["data"]) for payload in payloads] == [15, 5]
@@ -0,0 +1,48 @@
+import hashlib
+from Node import Node
+from Signature import Signature
+from Transaction import Transaction
+
+# Every scheme signs inputs that can be spent with its public key, a legacy RSA script has no scheme
+for scheme in Signature.SCHEMES:
+    private_key, public_key = Node.generate_key_pair(scheme)
+    locking_script = Node.generate_locking_script(Node.generate_address(public_key))
+    signature = Transaction.sign_transaction_input(private_key, "a", 0)
+    unlocking_script = Node.generate_unlocking_script("a", 0, signature, public_key)
+    assert unlocking_script[3] == scheme
+    assert Transaction.verify_transaction_signature(public_key, "a", 0, unlocking_script[0])
+    assert Transaction.verify_unlocking_script(unlocking_script, "a", 0, locking_script)
+    assert not Transaction.verify_unlocking_script(unlocking_script, "a", 1, locking_script)
+    if scheme == "rsa":
+        assert Transaction.verify_unlocking_script(unlocking_script[:3], "a", 0, locking_script)
+    # The signature can't be checked with another scheme than the one of the key
+    for other_scheme in Signature.SCHEMES:
+        if other_scheme != scheme:
+            assert not Transaction.verify_unlocking_script(unlocking_script[:3] + [other_scheme], "a", 0,
+                                                           locking_script)
+
+# The standard pay-to-address scripts skip the interpreter, their address and signature are checked against the
+# outputs they spend by verify_unlocking_scripts
+private_key, public_key = Node.generate_key_pair()
+locking_script = Node.generate_locking_script(Node.generate_address(public_key))
+signature = Transaction.sign_transaction_input(private_key, "a", 0)
+unlocking_script = Node.generate_unlocking_script("a", 0, signature, public_key)
+tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': unlocking_script}],
+                  'outputs': [{'amount': 1, 'locking_script': locking_script}]})
+assert Transaction.is_standard(unlocking_script, locking_script) and tx.execute()
+assert Transaction.verify_unlocking_scripts([(unlocking_script, "a", 0, locking_script), (
+    unlocking_script, "a", 0, Node.generate_locking_script("other address"))]) == [True, False]
+# A signature can only spend an output locked to the address of its key, never a non-standard output
+digest = hashlib.sha256("secret".encode()).hexdigest()
+assert not Transaction.verify_unlocking_script(unlocking_script, "a", 0, ["OP_HASH160", digest, "OP_EQUALVERIFY"])
+assert not Transaction.verify_unlocking_script(unlocking_script, "a", 0, [])
+# The other locking scripts are run by the interpreter after the unlocking script, which must leave nothing behind
+for unlocking_script, valid in ((["secret"], True), (["other"], False), (["secret", "secret"], False)):
+    assert Transaction.verify_unlocking_scripts([(unlocking_script, "a", 0, ["OP_HASH160", digest,
+                                                                             "OP_EQUALVERIFY"])]) == [valid]
+assert Transaction.verify_unlocking_script([], "a", 0, [])
+assert not Transaction.verify_unlocking_script([], "a", 0, None)
+# Executing a transaction only checks its structure, its inputs are checked against the outputs they spend
+tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': ["other"]}],
+                  'outputs': [{'amount': 1, 'locking_script': ["OP_HASH160", digest, "OP_EQUALVERIFY"]}]})
+assert tx.execute()
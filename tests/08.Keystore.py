@@ -0,0 +1,29 @@
+import os
+import tempfile
+from Keystore import Keystore
+from Node import Node
+from Signature import Signature
+
+# A node created without starting it has no socket, its keys are only loaded when needed
+with tempfile.TemporaryDirectory() as path:
+    keystore = Keystore(path).fill(2)
+    node = Node(node_name="Keystore node", keystore=keystore, autostart=False)
+    assert node.incoming_socket is None and node._key_pair is None
+    address = node.address
+    assert len(keystore.pool[Signature.DEFAULT]) == 1
+
+    # A node restarted with the same keystore keeps its address
+    restarted_node = Node(node_name="Keystore node", keystore=Keystore(path), autostart=False)
+    assert restarted_node.address == address
+    assert Node(node_name="Other node", keystore=keystore, autostart=False).address != address
+    assert len(keystore.pool[Signature.DEFAULT]) == 0
+
+    # RSA keys are saved and loaded too
+    rsa_node = Node(node_name="RSA node", keystore=keystore, signature_scheme="rsa", autostart=False)
+    assert Node(node_name="RSA node", keystore=Keystore(path), autostart=False).address == rsa_node.address
+
+    # The nodes without a name or a fixed port get their own key, which isn't saved
+    unnamed_nodes = [Node(keystore=keystore, autostart=False) for _ in range(2)]
+    assert unnamed_nodes[0].address != unnamed_nodes[1].address
+    assert sorted(os.listdir(path)) == ["Keystore_node.pem", "Other_node.pem", "RSA_node.pem"]
+    assert Node(port=5000, keystore=keystore, autostart=False).key_name == str(("127.0.0.1", 5000))
@@ -0,0 +1,51 @@
+import hashlib
+from Script import Script
+from Transaction import Transaction
+
+# The compiled scripts behave like the opcodes they are compiled from
+digest = hashlib.sha256("data".encode()).hexdigest()
+assert Script(["data", "OP_DUP", "OP_HASH160", digest, "OP_EQUALVERIFY"]).execute([])
+assert not Script(["other", "OP_HASH160", digest, "OP_EQUALVERIFY"]).execute([])
+stack = []
+assert Script(["address", "OP_EQUAL"]).execute(stack) and stack == ["address", "OP_EQUAL"]
+
+# A script is only compiled once
+hits = Script.cache_info().hits
+assert Script.compile(["data", "OP_HASH160"]) is Script.compile(("data", "OP_HASH160"))
+assert Script.cache_info().hits == hits + 1
+
+# The cost of a transaction is known before running its scripts, and bounded
+digest = hashlib.sha256("secret".encode()).hexdigest()
+hash_lock = {'amount': 1, 'locking_script': ["OP_HASH160", digest, "OP_EQUALVERIFY"]}
+tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': ["secret"]}],
+                  'outputs': [hash_lock]})
+assert tx.cost() == 1 + 10 + 1 + 1
+assert tx.execute() and not tx.execute(max_cost=12)
+tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0, 'unlocking_script': ["x" * 1000]}],
+                  'outputs': [{'amount': 1, 'locking_script': []}]})
+assert not tx.execute()
+tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': i, 'unlocking_script': ["secret"]}
+                             for i in range(Transaction.max_inputs + 1)], 'outputs': [hash_lock]})
+assert not tx.execute()
+
+# The scripts beyond the limits are rejected without being compiled or cached
+size = Script.cache_info().currsize
+tx = Transaction({'inputs': [{'transaction_hash': "a", 'output_index': 0,
+                               'unlocking_script': ["x"] * (Script.max_length + 1)}], 'outputs': [hash_lock]})
+assert tx.cost() > Transaction.max_cost and not tx.execute()
+assert Script.compile(["x" * (Script.max_item_size + 1)]) is None
+assert Script.cache_info().currsize == size
+
+# Malformed scripts and transactions are rejected instead of raising
+for code in (["OP_DUP"], ["OP_HASH160"], ["OP_EQUALVERIFY"], ["a", "OP_EQUALVERIFY"], [1, "OP_DUP"], None,
+             "OP_DUP"):
+    assert not Script(code).execute([])
+assert Script.compile([1]) is None and Script.cost(None) > Transaction.max_cost
+for unlocking_script in (None, "secret", [None], ["secret", 1]):
+    tx_input = {'transaction_hash': "a", 'output_index': 0, 'unlocking_script': unlocking_script}
+    tx = Transaction({'inputs': [tx_input], 'outputs': [hash_lock]})
+    assert tx.cost() > Transaction.max_cost and not tx.execute()
+for inputs, outputs in (([{'transaction_hash': "a", 'unlocking_script': []}], []), ([None], []),
+                        ([], [{'amount': -1, 'locking_script': []}]), ([], [[]]), ([], [{'amount': 1}])):
+    tx = Transaction({'inputs': inputs, 'outputs': outputs})
+    assert not tx.is_well_formed() and not tx.execute() and tx.cost() > Transaction.max_cost
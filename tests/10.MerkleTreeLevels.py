@@ -0,0 +1,57 @@
+from Block import Block
+from MerkleTree import MerkleTree
+from Transaction import Transaction
+
+# The levels of the tree give the same root and proofs as hashing the nodes one by one
+transactions = [Transaction({'inputs': [], 'outputs': [], 'timestamp': i}) for i in range(13)]
+merkle_tree = MerkleTree(transactions)
+level = [tx.hash() for tx in transactions]
+while len(level) > 1:
+    level = [merkle_tree._hash_nodes(*level[i:i + 2]) if i + 1 < len(level) else level[i]
+             for i in range(0, len(level), 2)]
+assert merkle_tree.get_root().hash == level[0]
+assert merkle_tree.levels[0] == b"".join(bytes.fromhex(tx.hash()) for tx in transactions)
+for tx in transactions:
+    proof = merkle_tree.get_proof(tx.hash())
+    assert merkle_tree.verify_proof(tx.hash(), proof)
+assert merkle_tree.get_proof("00" * 32) is None
+assert all(merkle_tree.leaf_positions[tx.hash()] == i for i, tx in enumerate(transactions))
+
+# The nodes are views over the levels, the lone last transaction is carried up to the last level
+node = merkle_tree.get_root()
+while not node.is_leaf():
+    node = node.right
+assert node.hash == transactions[-1].hash() and node.level == 0
+assert node.parent.parent.hash == merkle_tree.get_root().hash and node.parent.parent.parent is None
+
+# Appending or replacing a leaf only recomputes its path to the root
+incremental_tree = MerkleTree()
+incremental_tree.update_tree(transactions)
+assert incremental_tree.levels == merkle_tree.levels
+coinbase = Transaction({'inputs': [], 'outputs': [], 'timestamp': -1})
+incremental_tree.replace_leaf(0, coinbase)
+assert incremental_tree.levels == MerkleTree([coinbase] + transactions[1:]).levels
+assert incremental_tree.get_proof(transactions[0].hash()) is None
+
+# A multiproof proves several transactions at once with fewer hashes than separate proofs
+tx_hashes = [transactions[i].hash() for i in (0, 1, 5, 12)]
+multiproof = merkle_tree.get_multiproof(tx_hashes)
+assert merkle_tree.verify_multiproof(tx_hashes, multiproof)
+assert len(multiproof['hashes']) < sum(len(merkle_tree.get_proof(tx_hash)) for tx_hash in tx_hashes)
+assert not merkle_tree.verify_multiproof(tx_hashes[::-1], multiproof)
+assert merkle_tree.get_multiproof(["00" * 32]) is None
+
+# The original commutative hashing is still available, and the lower levels can be computed in subtrees
+legacy_tree = MerkleTree(transactions, hashing="commutative")
+assert legacy_tree.get_root().hash != merkle_tree.get_root().hash
+assert legacy_tree.verify_proof(transactions[3].hash(), legacy_tree.get_proof(transactions[3].hash()))
+assert merkle_tree._build_levels_in_chunks(2) == merkle_tree.levels[1:3]
+
+# A received block is hashed with its advertised Merkle root, its tree is only built when needed
+block = Block(0, transactions, "0" * 64)
+received_block = Block(0, [tx.as_dict() for tx in transactions], "0" * 64, timestamp=block.timestamp,
+                       merkle_root=block.as_dict()["merkle_root"])
+assert received_block.hash() == block.hash() and received_block._merkle_tree is None
+assert received_block.verify_merkle_root()
+tampered_block = Block(0, transactions[1:], "0" * 64, timestamp=block.timestamp, merkle_root=block.merkle_root())
+assert tampered_block.hash() == block.hash() and not tampered_block.verify_merkle_root()
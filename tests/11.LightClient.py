@@ -0,0 +1,67 @@
+import time
+from MerkleTree import MerkleTree
+from Miner import Miner
+from Wallet import Wallet
+
+# Set up the nodes
+miner_1 = Miner(node_name="Miner 1")
+time.sleep(1)
+miner_2 = Miner(known_nodes={miner_1.id()}, node_name="Miner 2")
+time.sleep(1)
+light_wallet = Wallet(known_nodes={miner_1.id()}, node_name="Light wallet", light_client=True)
+time.sleep(1)
+wallet = Wallet(known_nodes={miner_2.id()}, node_name="Wallet")
+time.sleep(1)
+
+# Mine a first block, and pay the mining reward to the light client in a second one
+wallet.create_transaction(inputs=[], outputs=[])
+wallet.create_transaction(inputs=[], outputs=[])
+while len(miner_1.blockchain) == 0 or not miner_1.blockchain == miner_2.blockchain:
+    time.sleep(1)
+wallet.create_transaction(inputs=[], outputs=[])
+for miner in [miner_1, miner_2]:
+    utxo_id, utxo = list(miner.utxos.items())[0]
+    if utxo["locking_script"] == miner.generate_locking_script(miner.address):
+        miner.spend_mining_reward(light_wallet.address, utxo['amount'])
+while len(miner_1.blockchain) < 2 or not miner_1.blockchain == miner_2.blockchain:
+    time.sleep(1)
+assert len(miner_1.blockchain) == 2
+
+# The light client only keeps the headers, and the UTXOs of the transactions it could confirm
+light_wallet.refresh_balance()
+assert light_wallet.header_hashes == [block.hash() for block in miner_1.blockchain]
+assert light_wallet.get_balance() == 50
+tx_hash = list(light_wallet.utxos)[0].split(':')[0]
+assert light_wallet.confirm_transaction(tx_hash) == 1
+
+# The transactions and UTXOs that aren't in the blockchain are not confirmed
+assert light_wallet.confirm_transaction("00" * 32, timeout=1) is None
+forged_utxos = {f"{tx_hash}:0": {"amount": 1000, "locking_script": light_wallet.generate_locking_script(
+    light_wallet.address)}, f"{'00' * 32}:0": {"amount": 1000, "locking_script": []}}
+assert light_wallet._verify_utxos(forged_utxos, timeout=1) == {}
+
+# A proof doesn't match the Merkle root of another block
+proof = miner_1.blockchain[1].merkle_tree.get_proof(tx_hash)
+assert MerkleTree.get_proof_root(tx_hash, proof) == light_wallet.headers[1]["merkle_root"]
+assert MerkleTree.get_proof_root(tx_hash, proof) != light_wallet.headers[0]["merkle_root"]
+
+# The proofs are checked with the hashing of the wallet whatever the miner says, and only hold SHA256 digests
+merkle_tree = miner_1.blockchain[1].merkle_tree
+transaction = merkle_tree.transactions[merkle_tree.leaf_positions[tx_hash]].as_dict()
+light_wallet.confirmed_transactions.clear()
+light_wallet._handle_incoming_merkle_proof_response({"data": [{"transaction": transaction, "block_index": 1,
+                                                                "proof": proof, "hashing": "commutative"}]}, None)
+assert light_wallet.confirmed_transactions[tx_hash][0] == 1
+assert MerkleTree.get_proof_root(tx_hash, ["00" + proof[0]] + proof[1:], "commutative") is None
+assert MerkleTree.get_proof_root(tx_hash, [proof[0][2:]] + proof[1:]) is None
+multiproof = merkle_tree.get_multiproof([tx_hash])
+assert MerkleTree.get_multiproof_root([tx_hash], multiproof) == light_wallet.headers[1]["merkle_root"]
+assert MerkleTree.get_multiproof_root([tx_hash], dict(multiproof, hashes=["00" + h for h in multiproof["hashes"]]),
+                                      "commutative") is None
+
+# Headers with an invalid proof of work are rejected
+forged_header = dict(light_wallet.headers[1], index=2, previous_hash=light_wallet.header_hashes[1], nonce=0,
+                     timestamp=0)
+with light_wallet.headers_condition:
+    assert not light_wallet._connect_headers([forged_header], 2)
+assert len(light_wallet.headers) == 2
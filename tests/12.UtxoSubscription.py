@@ -0,0 +1,82 @@
+import time
+from Miner import Miner
+from Wallet import Wallet
+
+# Set up the nodes
+miner_1 = Miner(node_name="Miner 1")
+time.sleep(1)
+miner_2 = Miner(known_nodes={miner_1.id()}, node_name="Miner 2")
+time.sleep(1)
+subscribed_wallet = Wallet(known_nodes={miner_1.id()}, node_name="Subscribed wallet", subscribe_utxos=True)
+time.sleep(1)
+wallet = Wallet(known_nodes={miner_2.id()}, node_name="Wallet")
+time.sleep(1)
+assert subscribed_wallet.address in miner_1.subscriptions
+
+# Mine a first block, and pay the mining reward to the subscribed wallet in a second one
+wallet.create_transaction(inputs=[], outputs=[])
+wallet.create_transaction(inputs=[], outputs=[])
+while len(miner_1.blockchain) == 0 or not miner_1.blockchain == miner_2.blockchain:
+    time.sleep(1)
+wallet.create_transaction(inputs=[], outputs=[])
+for miner in [miner_1, miner_2]:
+    utxo_id, utxo = list(miner.utxos.items())[0]
+    if utxo["locking_script"] == miner.generate_locking_script(miner.address):
+        miner.spend_mining_reward(subscribed_wallet.address, utxo['amount'])
+
+# The balance is updated without requesting the UTXOs
+while subscribed_wallet.get_balance() == 0:
+    time.sleep(1)
+assert subscribed_wallet.get_balance() == 50
+
+# The payments update the balance right away, the pushed changes are applied once
+subscribed_wallet.send_crypto(wallet.address, 20)
+assert subscribed_wallet.get_balance() == 30
+wallet.create_transaction(inputs=[], outputs=[])
+while len(miner_1.blockchain) < 3 or not miner_1.blockchain == miner_2.blockchain:
+    time.sleep(1)
+time.sleep(1)
+locking_script = subscribed_wallet.generate_locking_script(subscribed_wallet.address)
+utxos = {utxo_id: utxo for utxo_id, utxo in miner_1.utxos.items() if utxo["locking_script"] == locking_script}
+assert subscribed_wallet.utxos == utxos and subscribed_wallet.get_balance() == 30
+
+# Disconnecting blocks pushes all the UTXOs again
+with subscribed_wallet.utxos_condition:
+    subscribed_wallet._set_utxos({})
+miner_1._update_utxos_from_blockchain()
+while subscribed_wallet.get_balance() == 0:
+    time.sleep(1)
+assert subscribed_wallet.utxos == utxos
+
+# The changes are applied in the order of the blocks, whatever the order in which they are received
+offline_wallet = Wallet(node_name="Offline wallet", autostart=False)
+requests = []
+offline_wallet._send = lambda data, data_type, receiver=None: requests.append(data_type)
+
+
+def push(height, created=None, spent=(), reset=False):
+    offline_wallet._handle_incoming_utxos_delta({"data": {"address": offline_wallet.address,
+                                                          "created": created or {}, "spent": list(spent),
+                                                          "reset": reset, "height": height}},
+                                                None)
+
+
+utxo = {"amount": 10, "locking_script": locking_script}
+push(2, {"b:0": utxo})
+assert offline_wallet.utxos == {} and requests == []
+push(1, {"a:0": utxo}, reset=True)
+# The changes of block 3 arrive before those of block 2: all the UTXOs are requested again
+push(3, {"c:0": utxo}, ["b:0"])
+assert offline_wallet.utxos == {"a:0": utxo} and requests == ["utxos_subscribe"]
+push(2, {"b:0": utxo})
+assert set(offline_wallet.utxos) == {"a:0", "b:0"}
+push(3, {"a:0": utxo, "c:0": utxo}, reset=True)
+# The changes and the snapshots already applied, sent again or by a lagging miner, are ignored
+push(3, {"c:0": utxo}, ["b:0"])
+push(2, {"a:0": utxo, "b:0": utxo}, reset=True)
+assert set(offline_wallet.utxos) == {"a:0", "c:0"} and offline_wallet.get_balance() == 20
+assert requests == ["utxos_subscribe"]
+
+# Requesting the UTXOs times out instead of waiting forever when no miner answers
+lonely_wallet = Wallet(node_name="Lonely wallet")
+assert not lonely_wallet.refresh_balance(timeout=1)
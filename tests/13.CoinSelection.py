@@ -0,0 +1,31 @@
+from CoinSelection import CoinSelection
+from Wallet import Wallet
+
+utxos = {f"{i:064x}:0": {"amount": amount, "locking_script": []} for i, amount in enumerate([1, 2, 5, 10, 20, 50])}
+
+# An exact match needs no change output, and the exact match with the fewest inputs is chosen
+selection = CoinSelection.select(utxos, 30)
+assert sorted(utxos[utxo_id]["amount"] for utxo_id in selection) == [10, 20]
+assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 50)] == [50]
+assert sum(utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 88)) == 88
+
+# Without an exact match, the largest UTXOs are spent, and a small excess can be left to the miner
+assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 45)] == [50]
+assert CoinSelection.branch_and_bound(utxos, 90) is None
+assert sorted(utxos[utxo_id]["amount"] for utxo_id in CoinSelection.branch_and_bound(utxos, 49, 1)) == [50]
+assert CoinSelection.select(utxos, 89) is None
+
+# Consolidation spends the smallest UTXOs, as many as allowed
+assert len(CoinSelection.select(utxos, 3, "consolidate")) == len(utxos)
+assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 3, "consolidate", max_inputs=2)] == \
+    [1, 2]
+assert [utxos[utxo_id]["amount"] for utxo_id in CoinSelection.select(utxos, 60, "consolidate", max_inputs=2)] \
+    == [50, 20]
+
+# The wallets use the coin selection, the exact match creates no change
+wallet = Wallet(node_name="Wallet")
+locking_script = wallet.generate_locking_script(wallet.address)
+with wallet.utxos_condition:
+    wallet._set_utxos({utxo_id: dict(utxo, locking_script=locking_script) for utxo_id, utxo in utxos.items()})
+tx = wallet._create_payment("0" * 64, 26)
+assert len(tx.inputs) == 3 and len(tx.outputs) == 1 and wallet.get_balance() == 88 - 26
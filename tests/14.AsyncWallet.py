@@ -0,0 +1,49 @@
+import time
+from Miner import Miner
+from Wallet import Wallet
+
+# Set up the nodes
+miner_1 = Miner(node_name="Miner 1")
+time.sleep(1)
+miner_2 = Miner(known_nodes={miner_1.id()}, node_name="Miner 2")
+time.sleep(1)
+wallet_1 = Wallet(known_nodes={miner_1.id()}, node_name="Wallet 1")
+time.sleep(1)
+wallet_2 = Wallet(known_nodes={miner_2.id()}, node_name="Wallet 2")
+time.sleep(1)
+
+# Mine a first block, and pay the mining reward to the first wallet in a second one
+wallet_2.create_transaction(inputs=[], outputs=[])
+wallet_2.create_transaction(inputs=[], outputs=[])
+while len(miner_1.blockchain) == 0 or not miner_1.blockchain == miner_2.blockchain:
+    time.sleep(1)
+wallet_2.create_transaction(inputs=[], outputs=[])
+for miner in [miner_1, miner_2]:
+    utxo_id, utxo = list(miner.utxos.items())[0]
+    if utxo["locking_script"] == miner.generate_locking_script(miner.address):
+        miner.spend_mining_reward(wallet_1.address, utxo['amount'])
+while len(miner_1.blockchain) < 2 or not miner_1.blockchain == miner_2.blockchain:
+    time.sleep(1)
+
+# Concurrent balance queries each get the response to their own request
+futures = [wallet_1.refresh_balance_async() for _ in range(5)]
+assert [future.result(timeout=20) for future in futures] == [50] * 5
+assert len(wallet_1.pending_requests) == 0
+
+# The payments are made on the threads of the wallet
+payments = [wallet_1.send_crypto_async(wallet_2.address, amount) for amount in (10, 15)]
+transactions = [future.result(timeout=20) for future in payments]
+assert all(tx is not None for tx in transactions) and wallet_1.get_balance() == 25
+# One of the payments spends the change of the other one
+spent_utxos = {f"{tx_input['transaction_hash']}:{tx_input['output_index']}" for tx in transactions
+               for tx_input in tx.inputs}
+assert len(spent_utxos) == 2 and any(f"{tx.hash()}:1" in spent_utxos for tx in transactions)
+
+# A request that gets no response fails with a timeout
+lonely_wallet = Wallet(node_name="Lonely wallet")
+try:
+    lonely_wallet.refresh_balance_async(timeout=1).result(timeout=5)
+    assert False
+except TimeoutError:
+    pass
+assert len(lonely_wallet.pending_requests) == 0
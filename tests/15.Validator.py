@@ -0,0 +1,94 @@
+import hashlib
+from Block import Block
+from Miner import Miner
+from Node import Node
+from Transaction import Transaction
+from Validator import Validator
+from helpers import mine_block
+
+# The difficulty is a miner option, the validator checks the proof of work with it
+miner = Miner(node_name="Miner", difficulty=3, autostart=False)
+assert miner.difficulty == 3 and miner.validator.difficulty == 3
+
+# Malformed transactions make a block invalid instead of raising, and mining resumes
+miner = Miner(node_name="Miner", autostart=False)
+output = {'amount': 1, 'locking_script': Node.generate_locking_script("address")}
+for unlocking_script in (["OP_DUP"], None, [1], ["OP_EQUALVERIFY"]):
+    tx = {'inputs': [{'transaction_hash': "00" * 32, 'output_index': 0, 'unlocking_script': unlocking_script}],
+          'outputs': [output], 'timestamp': 0}
+    block = mine_block(0, "0" * 64, [tx])
+    assert miner.validator.validate_blockchain([block.as_dict()])[0] == 0
+    assert miner.validator.validate_block(block, None, {}) is not None
+    miner.stop_mining = True
+    miner._handle_incoming_blockchain_update({"data": ([block.as_dict()], []), "sender_name": "Peer"}, None)
+    assert not miner.stop_mining and len(miner.blockchain) == 0
+    miner._handle_incoming_mined_block({"data": block.as_dict(), "sender_name": "Peer", "sender": ["", 0]}, None)
+    assert len(miner.blockchain) == 0
+coinbase = {'inputs': [], 'outputs': [output], 'timestamp': 0}
+malformed_block = dict(mine_block(0, "0" * 64, [coinbase]).as_dict(),
+                       merkle_tree={'transactions': [{'inputs': []}]})
+assert miner.validator.validate_blockchain([malformed_block]) == (0, "malformed block")
+miner._handle_incoming_mined_block({"data": dict(malformed_block, index="0"), "sender_name": "Peer",
+                                    "sender": ["", 0]}, None)
+miner._handle_incoming_blockchain_update({"data": "malformed", "sender_name": "Peer"}, None)
+assert not miner.stop_mining and len(miner.blockchain) == 0
+
+# Malformed bodies are rejected without building the Merkle tree in the handler, whether the header advertises a
+# Merkle root or not, and a block without transactions has a root
+bodies = [[], [{'inputs': []}], [{'inputs': [], 'outputs': [output], 'timestamp': float("nan")}]]
+for transactions in bodies:
+    for advertised_root in (True, False):
+        data = dict(malformed_block, merkle_tree={'transactions': transactions})
+        if not advertised_root:
+            del data["merkle_root"]
+        miner._handle_incoming_mined_block({"data": data, "sender_name": "Peer", "sender": ["", 0]}, None)
+        assert len(miner.blockchain) == 0
+assert Block(0, [], "0" * 64).merkle_root() == "0" * 64
+
+# A valid blockchain is accepted, and each kind of invalid block is reported with its index
+private_key, public_key = Node.generate_key_pair()
+locking_script = Node.generate_locking_script(Node.generate_address(public_key))
+reward = Transaction({'inputs': [], 'outputs': [{'amount': 50, 'locking_script': locking_script}], 'timestamp': 0})
+
+
+def spend(tx_input, timestamp=0, signing_key=private_key):
+    signature = Transaction.sign_transaction_input(signing_key, reward.hash(), 0)
+    tx_input = dict({'transaction_hash': reward.hash(), 'output_index': 0, 'unlocking_script': (
+        Node.generate_unlocking_script(reward.hash(), 0, signature, public_key))}, **tx_input)
+    return Transaction({'inputs': [tx_input], 'outputs': [{'amount': 50, 'locking_script': locking_script}],
+                        'timestamp': timestamp})
+
+
+validator = Validator(2)
+genesis = mine_block(0, "0" * 64, [reward])
+utxos = {f"{reward.hash()}:0": reward.outputs[0]}
+block = mine_block(1, genesis.hash(), [spend({})])
+assert validator.validate_blockchain([genesis.as_dict(), block.as_dict()]) is None
+assert validator.validate_block(block, genesis, utxos) is None
+unmined_block = Block(1, [spend({})], genesis.hash())
+unmined_block.nonce = unmined_block.timestamp
+while unmined_block.hash().startswith("00"):
+    unmined_block.nonce += 1
+invalid_blocks = [
+    (unmined_block, "invalid proof of work"),
+    (mine_block(1, "11" * 32, [spend({})]), "previous hash doesn't match"),
+    (mine_block(2, genesis.hash(), [spend({})]), "invalid index"),
+    (mine_block(1, genesis.hash(), [spend({}, signing_key=Node.generate_key_pair()[0])]), "invalid signature"),
+    (mine_block(1, genesis.hash(), [spend({}), spend({}, timestamp=1)]), "double spend"),
+    (mine_block(1, genesis.hash(), [spend({'output_index': "0"})]), "invalid transaction script"),
+]
+for invalid_block, reason in invalid_blocks:
+    blockchain = [genesis.as_dict(), invalid_block.as_dict()]
+    assert validator.validate_blockchain(blockchain) == (invalid_block.index, reason)
+    assert validator.validate_block(invalid_block, genesis, utxos) == (invalid_block.index, reason)
+# A signature doesn't spend an output locked by a non-standard script
+hash_lock = ["OP_HASH160", hashlib.sha256("secret".encode()).hexdigest(), "OP_EQUALVERIFY"]
+hash_locked_utxos = {f"{reward.hash()}:0": {'amount': 50, 'locking_script': hash_lock}}
+assert validator.validate_block(block, genesis, hash_locked_utxos) == (1, "invalid signature")
+secret_input = {'transaction_hash': reward.hash(), 'output_index': 0, 'unlocking_script': ["secret"]}
+secret_spend = Transaction({'inputs': [secret_input], 'outputs': [{'amount': 50, 'locking_script': locking_script}],
+                            'timestamp': 0})
+assert validator.validate_block(mine_block(1, genesis.hash(), [secret_spend]), genesis, hash_locked_utxos) is None
+forged_block = dict(block.as_dict(), merkle_tree={'transactions': [spend({}, timestamp=1).as_dict()]})
+reason = "Merkle root doesn't match the transactions"
+assert validator.validate_blockchain([genesis.as_dict(), forged_block]) == (1, reason)
@@ -0,0 +1,38 @@
+import threading
+import time
+from Block import Block
+from MerkleTree import MerkleTree
+from Transaction import Transaction
+from Validator import Validator
+from Workers import Workers
+
+# Pretend there are two cores, and build the Merkle trees of small blocks in subtrees
+count, parallel_threshold = Workers.count, MerkleTree.parallel_threshold
+Workers.count = staticmethod(lambda: 2)
+MerkleTree.parallel_threshold = 4
+try:
+    transactions = [Transaction({'inputs': [], 'outputs': [{'amount': i, 'locking_script': []}], 'timestamp': i})
+                    for i in range(13)]
+    merkle_tree = MerkleTree(transactions)
+    MerkleTree.parallel_threshold = 1 << 16
+    assert merkle_tree.levels == MerkleTree(transactions).levels
+    MerkleTree.parallel_threshold = 4
+
+    # The blocks are checked on the pool, and their trees are built in the workers without the pool
+    blockchain = []
+    previous_hash = "0" * 64
+    for i in range(4):
+        block = Block(i, transactions[:8], previous_hash)
+        block.nonce = block.timestamp
+        previous_hash = block.hash()
+        blockchain.append(block.as_dict())
+        time.sleep(0.001)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        Validator(0, parallel_threshold=1).validate_blockchain(blockchain)), daemon=True)
+    thread.start()
+    thread.join(60)
+    assert result == [None]
+finally:
+    Workers.count = count
+    MerkleTree.parallel_threshold = parallel_threshold
@@ -0,0 +1,65 @@
+import time
+from Miner import Miner
+from Transaction import Transaction
+from helpers import mine_block
+
+
+def receive(miner, block):
+    miner._handle_incoming_mined_block({"data": block.as_dict(), "sender_name": "Peer", "sender": ["localhost", 0]},
+                                       None)
+
+
+blocks = [mine_block(0, "0" * 64)]
+for i in range(1, 5):
+    blocks.append(mine_block(i, blocks[-1].hash()))
+
+# The blocks received before their parent are buffered, and connected once the parent arrives
+miner = Miner(node_name="Miner", autostart=False, orphan_timeout=60)
+requests = []
+miner._request_blockchain_update = requests.append
+for block in [blocks[0], blocks[3], blocks[2]]:
+    receive(miner, block)
+assert miner.blockchain == blocks[:1] and len(miner.orphan_blocks) == 2
+receive(miner, blocks[1])
+assert miner.blockchain == blocks[:4] and len(miner.orphan_blocks) == 0 and requests == []
+
+# The pool of orphans is bounded, the oldest orphans are dropped first
+miner = Miner(node_name="Miner", autostart=False, orphan_timeout=60, max_orphan_blocks=2)
+miner._request_blockchain_update = requests.append
+for block in [blocks[0], blocks[2], blocks[3], blocks[4]]:
+    receive(miner, block)
+assert list(miner.orphan_blocks) == [blocks[3].hash(), blocks[4].hash()]
+receive(miner, blocks[1])
+assert miner.blockchain == blocks[:2] and requests == []
+
+# A blockchain update is requested from the sender if the parent doesn't arrive in time
+miner = Miner(node_name="Miner", autostart=False, orphan_timeout=0.5)
+miner._request_blockchain_update = requests.append
+for block in [blocks[0], blocks[2]]:
+    receive(miner, block)
+assert len(miner.orphan_blocks) == 1
+miner._expire_orphan_blocks()
+assert len(miner.orphan_blocks) == 1
+time.sleep(1)
+miner._expire_orphan_blocks()
+assert len(miner.orphan_blocks) == 0 and requests == [["localhost", 0]]
+
+# Several orphans may claim the same parent: a forged block received first doesn't keep the valid one out
+forged_tx = Transaction({'inputs': [{'transaction_hash': "00" * 32, 'output_index': 0, 'unlocking_script': []}],
+                         'outputs': [], 'timestamp': 0})
+forged_block = mine_block(2, blocks[1].hash(), [forged_tx])
+miner = Miner(node_name="Miner", autostart=False, orphan_timeout=60)
+requests = []
+miner._request_blockchain_update = requests.append
+for block in [blocks[0], forged_block, blocks[2]]:
+    receive(miner, block)
+assert len(miner.orphan_blocks) == 2
+receive(miner, blocks[1])
+assert miner.blockchain == blocks[:3] and len(miner.orphan_blocks) == 0 and requests == []
+
+# A blockchain update is requested from the sender when no orphan following the blockchain is valid
+miner = Miner(node_name="Miner", autostart=False, orphan_timeout=60)
+miner._request_blockchain_update = requests.append
+for block in [blocks[0], forged_block, blocks[1]]:
+    receive(miner, block)
+assert miner.blockchain == blocks[:2] and len(miner.orphan_blocks) == 0 and requests == [["localhost", 0]]
@@ -0,0 +1,43 @@
+from Miner import Miner
+from helpers import mine_block
+
+blocks = [mine_block(0, "0" * 64)]
+for i in range(1, 3):
+    blocks.append(mine_block(i, blocks[-1].hash()))
+
+# At least the last block is kept whole
+for prune_depth in (0, -1):
+    try:
+        Miner(node_name="Miner", autostart=False, prune_depth=prune_depth)
+        assert False
+    except ValueError:
+        pass
+
+# A pruned miner only keeps the headers of the old blocks, and the UTXOs of the whole blockchain
+miner = Miner(node_name="Miner", autostart=False, prune_depth=1)
+for block in blocks:
+    miner._handle_incoming_mined_block({"data": block.as_dict(), "sender_name": "Peer", "sender": ["localhost", 0]},
+                                       None)
+assert miner.blockchain == blocks and miner.pruned_height == 2
+assert [block.is_pruned() for block in miner.blockchain] == [True, True, False]
+assert len(miner.utxos) == 3 and miner.blockchain[-1].as_dict()["merkle_tree"] is not None
+
+# Its blockchain can't be used to rebuild the UTXOs, the requests are answered with data_unavailable
+sent = []
+miner._send = lambda data, data_type, receiver=None: sent.append((data_type, receiver))
+miner._handle_incoming_blockchain_request({"data": None, "sender_name": "Peer", "sender": ["localhost", 0]}, None)
+assert sent == [("data_unavailable", ["localhost", 0])]
+# The Merkle proofs of the transactions of the pruned blocks are unavailable too
+sent = []
+miner._send = lambda data, data_type, receiver=None: sent.append((data, data_type))
+tx_hashes = [blocks[0].transactions()[0].hash(), blocks[2].transactions()[0].hash()]
+miner._handle_incoming_merkle_proof_request({"data": tx_hashes, "sender_name": "Wallet",
+                                             "sender": ["localhost", 0]}, None)
+assert [data_type for _, data_type in sent] == ["merkle_proof_response", "data_unavailable"]
+assert [proof["block_index"] for proof in sent[0][0]] == [2] and sent[1][0]["transactions"] == tx_hashes[:1]
+# The node that requested the blockchain resumes mining
+peer = Miner(node_name="Peer", autostart=False)
+peer.stop_mining = True
+peer._handle_incoming_data_unavailable({"data": {"request": "request_blockchain", "reason": "blockchain pruned"},
+                                        "sender_name": "Miner"}, None)
+assert not peer.stop_mining
@@ -0,0 +1,23 @@
+from Block import Block
+from Node import Node
+from Transaction import Transaction
+
+
+def mine_block(index, previous_hash, transactions=None, difficulty=2):
+    """
+    Mines a block for the tests, with a mining reward as only transaction by default.
+
+    :param index: the index of the block.
+    :param previous_hash: the hash of the previous block.
+    :param transactions: the transactions of the block, a mining reward whose timestamp is the index by default.
+    :param difficulty: the number of leading zeros of the hash of the block.
+    :return: Block: the mined block.
+    """
+    if transactions is None:
+        transactions = [Transaction({'inputs': [], 'outputs': [
+            {'amount': 50, 'locking_script': Node.generate_locking_script("address")}], 'timestamp': index})]
+    block = Block(index, transactions, previous_hash)
+    block.nonce = block.timestamp
+    while not block.hash().startswith("0" * difficulty):
+        block.nonce += 1
+    return block